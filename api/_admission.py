@@ -0,0 +1,106 @@
+"""
+Admission control for ingest
+Every device has a token bucket measured in readings: it refills at `rate`
+readings per second up to `burst`, and an upload is let in while its bucket
+holds enough tokens for it (or is full, for uploads larger than the burst).
+Letting a batch in may drive the bucket negative, so a large batch is paid
+back over the seconds after it instead of being refused outright. Readings
+that have been let in but not yet stored are in flight, and at most
+`max_in_flight` of them at once: uploads over that are refused at once, not
+made to wait, so a burst of concurrent uploads cannot pile up in memory.
+
+A refused upload gets the seconds to wait before trying again, which the
+server sends as Retry-After with a 429. Limits are per process, like the
+in-memory stores.
+"""
+
+import time
+import threading
+from collections import namedtuple
+
+# Why an upload was refused, and the seconds after which it would be let in
+Rejection = namedtuple("Rejection", "reason retry_after message")
+
+# Retry-After when too much is in flight: stored uploads drain it in well under a second
+BUSY_RETRY_AFTER = 1.0
+# Buckets kept before refilled (idle) ones are dropped
+MAX_BUCKETS = 4096
+
+
+class TokenBucket:
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class Admission:
+    """Per-device rate limits and a bound on readings being stored
+
+    rate=0 turns the rate limit off and max_in_flight=0 the in-flight bound.
+    """
+
+    def __init__(self, rate, burst, max_in_flight, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+        self.buckets = {}  # device -> TokenBucket
+        self.in_flight = 0  # readings admitted and not yet released
+        self.lock = threading.Lock()
+
+    def saturated(self):
+        """A Rejection when max_in_flight is already reached, checked before reading the body"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return Rejection("busy", BUSY_RETRY_AFTER, "Server is busy storing other uploads")
+        return None
+
+    def admit(self, counts):
+        """Let in an upload of {device: readings}, or return a Rejection
+
+        Either every device's bucket is charged or none is. Once admitted,
+        release() must be called with the total when the readings are stored.
+        """
+        total = sum(counts.values())
+        with self.lock:
+            # One upload larger than max_in_flight still gets in on its own
+            if self.max_in_flight and self.in_flight and self.in_flight + total > self.max_in_flight:
+                return Rejection("busy", BUSY_RETRY_AFTER, "Server is busy storing other uploads")
+            if self.rate:
+                now = self.clock()
+                buckets = []
+                wait, limited = 0.0, None
+                for device, count in counts.items():
+                    bucket = self.buckets.get(device)
+                    if bucket is None:
+                        bucket = TokenBucket(self.burst, now)
+                    else:
+                        bucket.refill(self.rate, self.burst, now)
+                    deficit = min(count, self.burst) - bucket.tokens
+                    if deficit > 0 and deficit / self.rate > wait:
+                        wait, limited = deficit / self.rate, device
+                    buckets.append((device, bucket, count))
+                if limited is not None:
+                    return Rejection("rate", wait, f"Rate limit exceeded for device '{limited}'")
+                if len(self.buckets) + len(buckets) > MAX_BUCKETS:
+                    self._forget_idle(now)
+                for device, bucket, count in buckets:
+                    bucket.tokens -= count
+                    self.buckets[device] = bucket
+            self.in_flight += total
+        return None
+
+    def release(self, count):
+        """Take stored (or failed) readings out of flight"""
+        with self.lock:
+            self.in_flight -= count
+
+    def _forget_idle(self, now):
+        # A bucket that has refilled is the same as a new one
+        for device, bucket in list(self.buckets.items()):
+            bucket.refill(self.rate, self.burst, now)
+            if bucket.tokens >= self.burst:
+                del self.buckets[device]
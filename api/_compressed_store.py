@@ -0,0 +1,423 @@
+"""
+Compressed in-memory reading store (Gorilla-style blocks)
+Readings are kept in an uncompressed head buffer; once it fills, its oldest
+BLOCK_SIZE readings are sealed into an immutable block. Timestamps (whole
+milliseconds) are stored as delta-of-deltas and temperatures as the XOR of
+each float with the previous one, both with variable-length bit codes, so a
+steady 1 Hz sensor costs one to two bytes a reading instead of 24.
+Blocks carry their time span and min/max/sum/count, so stats never decode
+and range reads only decode the blocks they overlap, lazily.
+"""
+
+import math
+import struct
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from _rollup import Rollups
+from _store import ROLLUP_PREFIX, ReadingStore, rollup_columns
+
+# Readings per sealed block; the head holds up to twice this many
+BLOCK_SIZE = 4096
+
+# A sealed block: readings [start, start + count) in absolute positions
+Block = namedtuple("Block", "start count first_ts last_ts min max sum data")
+
+_DOUBLE = struct.Struct(">d")
+_BITS = struct.Struct(">Q")
+
+
+def _float_bits(value):
+    return _BITS.unpack(_DOUBLE.pack(value))[0]
+
+
+def _bits_float(bits):
+    return _DOUBLE.unpack(_BITS.pack(bits))[0]
+
+
+class BitWriter:
+    """Appends big-endian bit fields to a bytearray"""
+
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+        self.bits += bits
+        if self.bits >= 64:
+            spare = self.bits & 7
+            self.out += (self.acc >> spare).to_bytes(self.bits >> 3, "big")
+            self.acc &= (1 << spare) - 1
+            self.bits = spare
+
+    def getvalue(self):
+        if self.bits:
+            pad = -self.bits & 7
+            self.out += (self.acc << pad).to_bytes((self.bits + pad) >> 3, "big")
+            self.acc = self.bits = 0
+        return bytes(self.out)
+
+
+class BitReader:
+    """Reads big-endian bit fields written by BitWriter"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def bit(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return (self.data[pos >> 3] >> (7 - (pos & 7))) & 1
+
+    def read(self, bits):
+        pos = self.pos
+        first, last = pos >> 3, (pos + bits + 7) >> 3
+        chunk = int.from_bytes(self.data[first:last], "big")
+        self.pos = pos + bits
+        return (chunk >> ((last << 3) - pos - bits)) & ((1 << bits) - 1)
+
+
+# Delta-of-delta buckets: (prefix, prefix length, value bits)
+_DOD_CODES = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+def encode_block(ts_ms, temps):
+    """Compress parallel sequences of int millisecond timestamps and floats"""
+    writer = BitWriter()
+    write = writer.write
+    writer.write(ts_ms[0] & (2**64 - 1), 64)
+    prev_bits = _float_bits(temps[0])
+    writer.write(prev_bits, 64)
+
+    prev_ts, prev_delta = ts_ms[0], 0
+    prev_lead, prev_trail = 65, 65  # no XOR window yet
+    for i in range(1, len(ts_ms)):
+        delta = ts_ms[i] - prev_ts
+        dod = delta - prev_delta
+        prev_ts, prev_delta = ts_ms[i], delta
+        if dod == 0:
+            write(0, 1)
+        else:
+            for prefix, prefix_bits, bits in _DOD_CODES:
+                if -(1 << (bits - 1)) < dod <= (1 << (bits - 1)):
+                    write(prefix, prefix_bits)
+                    write(dod, bits)
+                    break
+            else:
+                write(0b1111, 4)
+                write(dod, 64)
+
+        value_bits = _float_bits(temps[i])
+        xor = value_bits ^ prev_bits
+        prev_bits = value_bits
+        if xor == 0:
+            write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if lead >= prev_lead and trail >= prev_trail:
+            # Fits the previous window: reuse its leading/trailing zero counts
+            write(0b10, 2)
+            write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+        else:
+            meaningful = 64 - lead - trail
+            write(0b11, 2)
+            write(lead, 5)
+            write(meaningful & 63, 6)  # 64 is sent as 0
+            write(xor >> trail, meaningful)
+            prev_lead, prev_trail = lead, trail
+    return writer.getvalue()
+
+
+def decode_block(data, count):
+    """Yield (timestamp in seconds, temp_c) for each reading of a block"""
+    reader = BitReader(data)
+    bit, read = reader.bit, reader.read
+    ts = read(64)
+    if ts >= 2**63:
+        ts -= 2**64
+    value_bits = read(64)
+    yield ts / 1000, _bits_float(value_bits)
+
+    delta = 0
+    lead, trail = 0, 0
+    for _ in range(count - 1):
+        if bit():
+            for _, prefix_bits, bits in _DOD_CODES:
+                if not bit():
+                    break
+            else:
+                bits = 64
+            dod = read(bits)
+            if dod > (1 << (bits - 1)):
+                dod -= 1 << bits
+            delta += dod
+        ts += delta
+
+        if bit():
+            if bit():
+                lead = read(5)
+                meaningful = read(6) or 64
+                trail = 64 - lead - meaningful
+            value_bits ^= read(64 - lead - trail) << trail
+        yield ts / 1000, _bits_float(value_bits)
+
+
+def _seal(start, ts_ms, temps):
+    return Block(start, len(ts_ms), ts_ms[0] / 1000, ts_ms[-1] / 1000,
+                 min(temps), max(temps), math.fsum(temps), encode_block(ts_ms, temps))
+
+
+class CompressedStore(ReadingStore):
+    """Keeps the newest `capacity` readings as compressed blocks plus a head buffer
+
+    Timestamps are kept to the millisecond. Appending is O(1) amortized;
+    a batch older than the newest stored reading is merged by re-encoding
+    the blocks from the first one it overlaps. Eviction drops whole blocks,
+    so up to one block more than `capacity` readings may be held.
+    """
+
+    def __init__(self, capacity, block_size=BLOCK_SIZE):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.block_size = max(1, min(block_size, capacity))
+        self.blocks = []
+        self.block_ends = []  # last_ts of each block, for bisecting
+        self.head_ts = array('q')   # epoch milliseconds
+        self.head_temp = array('d')
+        # Absolute positions as in RingBufferStore: oldest is `start`, newest `end - 1`
+        self.start = 0
+        self.end = 0
+        # Running totals over sealed blocks and over the head
+        self.block_sum = 0.0
+        self.head_sum = 0.0
+        self.head_min = self.head_max = None
+        self.seq = 0
+        self.offset = 0
+        self.reset_seq = 0
+        self.rollups = Rollups()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.end - self.start
+
+    def nbytes(self):
+        """Approximate bytes of reading data held (compressed blocks plus head)"""
+        with self.lock:
+            return (sum(len(b.data) for b in self.blocks)
+                    + self.head_ts.itemsize * len(self.head_ts)
+                    + self.head_temp.itemsize * len(self.head_temp))
+
+    def snapshot(self):
+        # Sealed blocks go out as they are, so restoring never re-encodes
+        with self.lock:
+            columns = {
+                "block_meta": array('d', [value for b in self.blocks
+                                          for value in (b.count, b.first_ts, b.last_ts, b.min, b.max, b.sum,
+                                                        len(b.data))]),
+                "block_data": array('B', b"".join(b.data for b in self.blocks)),
+                "head_ts": array('q', self.head_ts),
+                "head_temp": array('d', self.head_temp),
+            }
+            columns.update((ROLLUP_PREFIX + name, values) for name, values in self.rollups.columns().items())
+            return self.seq, columns
+
+    def restore(self, seq, columns):
+        if len(self) or "block_meta" not in columns:
+            return super().restore(seq, columns)
+        with self.lock:
+            meta, data = columns["block_meta"], columns["block_data"].tobytes()
+            position = used = 0
+            for i in range(0, len(meta), 7):
+                count, first_ts, last_ts, low, high, total, size = meta[i:i + 7]
+                count, size = int(count), int(size)
+                self.blocks.append(Block(position, count, first_ts, last_ts, low, high, total,
+                                         data[used:used + size]))
+                self.block_ends.append(last_ts)
+                position += count
+                used += size
+            self.head_ts, self.head_temp = columns["head_ts"], columns["head_temp"]
+            self.start, self.end = 0, position + len(self.head_ts)
+            self.block_sum = math.fsum(b.sum for b in self.blocks)
+            self._reset_head_totals()
+            self._evict()  # in case capacity shrank since the snapshot
+            # Cursors handed out before the snapshot get a full reload
+            self.seq = self.reset_seq = seq
+            self.offset = seq - self.end
+            self.rollups.restore(rollup_columns(columns))
+
+    def extend(self, readings, extremes=()):
+        readings = list(readings)
+        if not readings:
+            return 0
+        with self.lock:
+            newest = self._newest_ts()
+            if newest is not None and round(readings[0][0] * 1000) < newest:
+                self._merge(readings)
+                self.reset_seq = self.seq + len(readings)
+            else:
+                for ts, temp_c in readings:
+                    self._append(round(ts * 1000), temp_c)
+            self._evict()
+            self.seq += len(readings)
+            self.offset = self.seq - self.end
+            self.rollups.extend(readings, extremes)
+        return len(readings)
+
+    def latest(self):
+        with self.lock:
+            if self.head_ts:
+                ts, temp_c = self.head_ts[-1] / 1000, self.head_temp[-1]
+            elif self.blocks:
+                ts, temp_c = _last(decode_block(self.blocks[-1].data, self.blocks[-1].count))
+            else:
+                return None
+        return (ts, temp_c, temp_c * 9/5 + 32)
+
+    def stats(self):
+        with self.lock:
+            count = len(self)
+            if not count:
+                return None
+            lows = [b.min for b in self.blocks]
+            highs = [b.max for b in self.blocks]
+            if self.head_temp:
+                lows.append(self.head_min)
+                highs.append(self.head_max)
+            return {
+                "min": min(lows),
+                "max": max(highs),
+                "avg": (self.block_sum + self.head_sum) / count,
+                "count": count,
+            }
+
+    def recent(self, n):
+        with self.lock:
+            return self._from_position(max(self.start, self.end - n))
+
+    def iter_range(self, start=None, end=None):
+        # Blocks are immutable, so only the snapshot needs the lock; decoding happens lazily
+        with self.lock:
+            first = 0 if start is None else bisect_left(self.block_ends, start)
+            blocks = [b for b in self.blocks[first:] if end is None or b.first_ts <= end]
+            lo = 0 if start is None else bisect_left(self.head_ts, start * 1000)
+            hi = len(self.head_ts) if end is None else bisect_right(self.head_ts, end * 1000)
+            head = (self.head_ts[lo:hi], self.head_temp[lo:hi])
+        return self._iter_range(blocks, head, start, end)
+
+    def changes(self, cursor, limit):
+        with self.lock:
+            if cursor is not None and self.reset_seq <= cursor <= self.seq:
+                first = cursor - self.offset
+                if first >= self.start and self.end - first <= limit:
+                    return self.seq, self._from_position(first), False
+            return self.seq, self._from_position(max(self.start, self.end - limit)), True
+
+    def _iter_range(self, blocks, head, start, end):
+        low = float("-inf") if start is None else start
+        high = float("inf") if end is None else end
+        for block in blocks:
+            for ts, temp_c in decode_block(block.data, block.count):
+                if ts > high:
+                    return
+                if ts >= low:
+                    yield (ts, temp_c, temp_c * 9/5 + 32)
+        for ts_ms, temp_c in zip(*head):
+            yield (ts_ms / 1000, temp_c, temp_c * 9/5 + 32)
+
+    def _from_position(self, first):
+        """Readings from absolute position `first` to the newest, decoding only the blocks needed"""
+        head_start = self.end - len(self.head_ts)
+        readings = []
+        if first < head_start:
+            index = max(bisect_right([b.start for b in self.blocks], first) - 1, 0)
+            for block in self.blocks[index:]:
+                skip = max(first - block.start, 0)
+                for i, (ts, temp_c) in enumerate(decode_block(block.data, block.count)):
+                    if i >= skip:
+                        readings.append((ts, temp_c, temp_c * 9/5 + 32))
+        for i in range(max(first - head_start, 0), len(self.head_ts)):
+            temp_c = self.head_temp[i]
+            readings.append((self.head_ts[i] / 1000, temp_c, temp_c * 9/5 + 32))
+        return readings
+
+    def _newest_ts(self):
+        if self.head_ts:
+            return self.head_ts[-1]
+        if self.blocks:
+            return round(self.blocks[-1].last_ts * 1000)
+        return None
+
+    def _append(self, ts_ms, temp_c):
+        self.head_ts.append(ts_ms)
+        self.head_temp.append(temp_c)
+        self.head_sum += temp_c
+        if self.head_min is None or temp_c < self.head_min:
+            self.head_min = temp_c
+        if self.head_max is None or temp_c > self.head_max:
+            self.head_max = temp_c
+        self.end += 1
+        # Seal the oldest half of a full head so recent reads stay uncompressed
+        if len(self.head_ts) >= 2 * self.block_size:
+            self._seal_head(self.block_size)
+
+    def _seal_head(self, n):
+        block = _seal(self.end - len(self.head_ts), self.head_ts[:n], self.head_temp[:n])
+        self.blocks.append(block)
+        self.block_ends.append(block.last_ts)
+        self.block_sum += block.sum
+        del self.head_ts[:n]
+        del self.head_temp[:n]
+        self._reset_head_totals()
+
+    def _reset_head_totals(self):
+        self.head_sum = math.fsum(self.head_temp)
+        self.head_min = min(self.head_temp, default=None)
+        self.head_max = max(self.head_temp, default=None)
+
+    def _evict(self):
+        evicted = False
+        while self.blocks and len(self) - self.blocks[0].count >= self.capacity:
+            block = self.blocks.pop(0)
+            self.block_ends.pop(0)
+            self.start += block.count
+            evicted = True
+        if evicted:
+            # Re-sum exactly rather than subtracting, so float error cannot build up
+            self.block_sum = math.fsum(b.sum for b in self.blocks)
+
+    def _merge(self, readings):
+        """Slow path for late readings: re-encode from the first block they overlap"""
+        oldest_late = min(round(ts * 1000) for ts, _ in readings) / 1000
+        index = bisect_right(self.block_ends, oldest_late)
+        merged = []
+        for block in self.blocks[index:]:
+            merged.extend((round(ts * 1000), temp_c) for ts, temp_c in decode_block(block.data, block.count))
+        merged.extend(zip(self.head_ts, self.head_temp))
+        merged.extend((round(ts * 1000), temp_c) for ts, temp_c in readings)
+        # Stable sort, so equal timestamps keep their arrival order
+        merged.sort(key=lambda reading: reading[0])
+
+        rebuild_from = self.blocks[index].start if index < len(self.blocks) else self.end - len(self.head_ts)
+        del self.blocks[index:]
+        del self.block_ends[index:]
+        self.block_sum = math.fsum(b.sum for b in self.blocks)
+        self.head_ts = array('q')
+        self.head_temp = array('d')
+        self._reset_head_totals()
+        self.end = rebuild_from
+        for ts_ms, temp_c in merged:
+            self._append(ts_ms, temp_c)
+
+
+def _last(iterator):
+    item = None
+    for item in iterator:
+        pass
+    return item
@@ -0,0 +1,135 @@
+"""
+Server-side downsampling of reading ranges for charts
+Both methods make one streaming pass over time-ordered readings and split
+[start, end] into equal time buckets, so memory depends on the number of
+points returned, not the number scanned.
+"""
+
+from collections import deque
+
+METHODS = ("lttb", "minmax")
+
+
+def downsample(readings, start, end, max_points, method="lttb"):
+    """Reduce time-ordered readings to at most max_points
+
+    `readings` yields tuples whose first two items are (timestamp, temp_c).
+    Returns (points, scanned), where scanned is the number of readings read.
+    """
+    counted = _Counter(readings)
+    if method == "lttb":
+        points = lttb(counted, end, max_points)
+    elif method == "minmax":
+        points = minmax(counted, start, end, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    return points, counted.count
+
+
+def lttb(readings, end, max_points):
+    """Largest-Triangle-Three-Buckets over time buckets
+
+    Keeps the first and last readings and, from each non-empty bucket
+    between the first reading and `end`, the reading forming the largest
+    triangle with the previously kept reading and the average of the next
+    non-empty bucket.
+    """
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3 for lttb")
+
+    readings = iter(readings)
+    first = next(readings, None)
+    if first is None:
+        return []
+    previous = next(readings, None)
+    if previous is None:
+        return [first]
+
+    buckets = max_points - 2
+    width = max(end - first[0], 1e-9) / buckets
+    selected = [first]
+    pending = deque()  # completed buckets waiting for the next bucket's average
+    current, current_index = [], None
+
+    def finish_oldest(next_avg):
+        bucket, _ = pending.popleft()
+        anchor = selected[-1]
+        selected.append(max(bucket, key=lambda p: _triangle_area(anchor, p, next_avg)))
+
+    # Hold back one reading so the final one can be kept on its own
+    for reading in readings:
+        index = min(int((previous[0] - first[0]) / width), buckets - 1)
+        if index != current_index:
+            if current:
+                pending.append((current, _average(current)))
+                while len(pending) >= 2:
+                    finish_oldest(pending[1][1])
+            current, current_index = [], index
+        current.append(previous)
+        previous = reading
+
+    if current:
+        pending.append((current, _average(current)))
+    last = previous
+    while pending:
+        finish_oldest(pending[1][1] if len(pending) > 1 else (last[0], last[1]))
+    selected.append(last)
+    return selected
+
+
+def minmax(readings, start, end, max_points):
+    """Keep the lowest and highest reading of each time bucket, in time order"""
+    if max_points < 2:
+        raise ValueError("max_points must be at least 2 for minmax")
+
+    buckets = max_points // 2
+    width = max(end - start, 1e-9) / buckets
+    selected = []
+    low = high = None
+    current_index = None
+
+    def flush():
+        if low is high:
+            selected.append(low)
+        else:
+            selected.extend(sorted((low, high), key=lambda p: p[0]))
+
+    for reading in readings:
+        index = min(max(int((reading[0] - start) / width), 0), buckets - 1)
+        if index != current_index:
+            if low is not None:
+                flush()
+            low = high = reading
+            current_index = index
+        elif reading[1] < low[1]:
+            low = reading
+        elif reading[1] > high[1]:
+            high = reading
+    if low is not None:
+        flush()
+    return selected
+
+
+def _average(bucket):
+    n = len(bucket)
+    return (sum(p[0] for p in bucket) / n, sum(p[1] for p in bucket) / n)
+
+
+def _triangle_area(a, b, c):
+    return abs((a[0] - c[0]) * (b[1] - a[1]) - (a[0] - b[0]) * (c[1] - a[1])) / 2
+
+
+class _Counter:
+    """Iterator wrapper that counts the readings passing through it"""
+
+    def __init__(self, readings):
+        self.readings = iter(readings)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        reading = next(self.readings)
+        self.count += 1
+        return reading
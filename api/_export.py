@@ -0,0 +1,124 @@
+"""
+CSV and NDJSON export/import of readings
+Exports are generators of byte chunks: rows are formatted a page at a time
+straight from a store's iter_range, so a response starts as soon as the
+first page is ready and memory stays flat however long the range is.
+Imports go the other way, parsing an uploaded body line by line into
+reading dicts that the receiver validates and stores in batches.
+
+Both formats carry one reading per row:
+
+    timestamp,device_id,probe_id,temperature
+    2024-05-01T12:00:00+00:00,kitchen,0,21.5
+
+    {"timestamp": "2024-05-01T12:00:00+00:00", "device_id": "kitchen", "probe_id": "0", "temperature": 21.5}
+
+Timestamps are ISO 8601 in UTC on export; imports also take epoch seconds.
+"""
+
+import io
+import csv
+import json
+import zlib
+from datetime import datetime, timezone
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+COLUMNS = ("timestamp", "device_id", "probe_id", "temperature")
+
+# Rows formatted per chunk handed to the server (~250 KB of CSV)
+CHUNK_ROWS = 5000
+
+
+def format_for(mimetype):
+    """The format name for a Content-Type, or None"""
+    for name, media_type in FORMATS.items():
+        if mimetype == media_type:
+            return name
+    if mimetype in ("application/ndjson", "application/jsonlines", "application/x-jsonlines"):
+        return "ndjson"
+    return None
+
+
+def encode(frames, fmt):
+    """Yield the export of frames of (device, probe, readings) as UTF-8 byte chunks
+
+    readings yield (timestamp, temp_c, ...) and are only pulled as each chunk is built.
+    """
+    if fmt == "csv":
+        yield (",".join(COLUMNS) + "\r\n").encode()
+    rows = []
+    for device, probe, readings in frames:
+        for reading in readings:
+            timestamp = datetime.fromtimestamp(reading[0], timezone.utc).isoformat()
+            if fmt == "csv":
+                rows.append(f"{timestamp},{device},{probe},{reading[1]!r}\r\n")
+            else:
+                rows.append(json.dumps({"timestamp": timestamp, "device_id": device,
+                                        "probe_id": probe, "temperature": reading[1]}) + "\n")
+            if len(rows) >= CHUNK_ROWS:
+                yield "".join(rows).encode()
+                rows = []
+    if rows:
+        yield "".join(rows).encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of byte chunks into one gzip member, yielding output as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse(stream, fmt):
+    """Yield (line number, reading dict) for each row of a binary stream in fmt
+
+    CSV needs a header row naming at least timestamp and temperature;
+    device_id and probe_id columns are optional and empty cells are left
+    out. Blank lines are skipped. Raises ValueError, with the line number,
+    on a row that cannot be read.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        yield from _parse_csv(text)
+    else:
+        yield from _parse_ndjson(text)
+
+
+def _parse_csv(text):
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    for name in ("timestamp", "temperature"):
+        if name not in header:
+            raise ValueError(f"line 1: CSV header must name a {name} column")
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if len(row) != len(header):
+            raise ValueError(f"line {reader.line_num}: expected {len(header)} fields, got {len(row)}")
+        item = {name: cell for name, cell in zip(header, row) if cell != ""}
+        if "timestamp" in item:
+            try:
+                item["timestamp"] = float(item["timestamp"])  # epoch seconds
+            except ValueError:
+                pass  # ISO 8601, parsed by the receiver
+        yield reader.line_num, item
+
+
+def _parse_ndjson(text):
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from None
+        yield number, item
@@ -0,0 +1,150 @@
+"""
+Held values from send-on-change devices
+A device in deadband mode uploads a reading only when the temperature moves
+beyond its deadband, or when its heartbeat comes due, and tags those readings
+with `heartbeat`: the most seconds it stays silent. Each reading then stands
+for the temperature until the next one, for up to the heartbeat, so
+averages weigh each value by how long it was held instead of counting
+readings, and the series is only late once the heartbeat has passed.
+
+Heartbeats are learnt from uploads and kept per process, like alert state.
+"""
+
+import math
+import threading
+from array import array
+
+# Longest heartbeat accepted: a value is never assumed to hold longer than a day
+MAX_HEARTBEAT = 86400
+
+
+def parse_heartbeat(value):
+    """Validate a heartbeat in seconds; raises ValueError"""
+    heartbeat = float(value)
+    if not math.isfinite(heartbeat) or not 0 < heartbeat <= MAX_HEARTBEAT:
+        raise ValueError(f"heartbeat must be between 0 and {MAX_HEARTBEAT} seconds")
+    return heartbeat
+
+
+class TimeWeighted:
+    """Running time-weighted mean of readings folded in time order
+
+    Each reading is held until the next for at most heartbeat seconds; the
+    newest has no successor yet and carries no weight. Falls back to the
+    plain mean while no time has elapsed between the readings at all.
+    The readings are kept too, so the oldest can be dropped again.
+    """
+
+    def __init__(self, heartbeat, seq=None):
+        self.heartbeat = heartbeat
+        self.seq = seq  # store.seq the readings folded so far go up to
+        self.reset()
+
+    def reset(self):
+        self.area = self.held = self.total = 0.0
+        self.count = 0
+        self.last = None
+        self.ts, self.temp_c = array("d"), array("d")
+        self.first = 0  # index of the oldest reading still folded in
+
+    def extend(self, readings):
+        for reading in readings:
+            ts, temp_c = reading[0], reading[1]
+            if self.last is not None:
+                span = min(ts - self.last[0], self.heartbeat)
+                self.area += self.last[1] * span
+                self.held += span
+            self.last = (ts, temp_c)
+            self.ts.append(ts)
+            self.temp_c.append(temp_c)
+            self.total += temp_c
+            self.count += 1
+        return self
+
+    def drop(self, count):
+        """Take the oldest count readings back out, as the store evicts them"""
+        stop = min(self.first + count, len(self.ts))
+        if stop * 2 > len(self.ts):
+            # Once most of the arrays are dropped, refold the rest: this costs no
+            # more than the drops did and keeps the sums from drifting
+            kept = list(zip(self.ts[stop:], self.temp_c[stop:]))
+            self.reset()
+            return self.extend(kept)
+        for i in range(self.first, stop):
+            span = min(self.ts[i + 1] - self.ts[i], self.heartbeat)
+            self.area -= self.temp_c[i] * span
+            self.held -= span
+            self.total -= self.temp_c[i]
+        self.count -= stop - self.first
+        self.first = stop
+        return self
+
+    def mean(self):
+        if self.held > 0:
+            return self.area / self.held
+        return self.total / self.count if self.count else None
+
+
+class HeldSeries:
+    """The heartbeat of each series reporting in deadband mode, and its time-weighted mean"""
+
+    # Readings folded in per update before a full rescan is cheaper
+    CATCH_UP_LIMIT = 10_000
+
+    def __init__(self):
+        self.heartbeats = {}  # series -> heartbeat seconds
+        self.weighted = {}  # series -> TimeWeighted over the stored readings
+        self.lock = threading.Lock()
+
+    def update(self, heartbeats):
+        """Record {series: heartbeat or None} from an upload; None means every reading is sent"""
+        with self.lock:
+            for key, heartbeat in heartbeats.items():
+                if heartbeat is None:
+                    self.heartbeats.pop(key, None)
+                    self.weighted.pop(key, None)
+                else:
+                    self.heartbeats[key] = heartbeat
+
+    def heartbeat(self, key):
+        return self.heartbeats.get(key)
+
+    def stats(self, key, store):
+        """store.stats(), with the time-weighted mean as avg for held series
+
+        Readings written since the last call are folded in through
+        store.changes() and evicted ones dropped again; only when history
+        was rewritten does the mean read every stored reading again.
+        """
+        if store is None:
+            return None
+        stats = store.stats()
+        heartbeat = self.heartbeats.get(key)
+        if heartbeat is None or stats is None:
+            return stats
+        with self.lock:
+            weighted = self.weighted.pop(key, None)
+        if weighted is not None and (weighted.heartbeat != heartbeat or weighted.seq is None):
+            weighted = None
+        if weighted is not None and weighted.seq != store.seq:
+            cursor, readings, full = store.changes(weighted.seq, self.CATCH_UP_LIMIT)
+            # Late readings mean starting over
+            if full or (readings and weighted.last is not None and readings[0][0] < weighted.last[0]):
+                weighted = None
+            else:
+                # Stores evict their oldest readings, as many as they are now short
+                evicted = weighted.extend(readings).count - len(store)
+                if evicted < 0:  # written to again since changes(), so read afresh
+                    weighted = None
+                else:
+                    weighted.drop(evicted).seq = cursor
+        if weighted is None:
+            seq = store.seq
+            weighted = TimeWeighted(heartbeat).extend(store.iter_range())
+            # A write during the scan may or may not be in it, so it cannot be caught up on
+            weighted.seq = seq if store.seq == seq else None
+        with self.lock:
+            if key in self.heartbeats:
+                self.weighted[key] = weighted
+        stats["avg"] = weighted.mean()
+        return stats
@@ -0,0 +1,84 @@
+"""
+In-process pub/sub hub for the live stream
+One ingest publishes one pre-serialized event per topic (series), and every
+subscriber queue on that topic gets a reference to it, so fan-out costs no
+extra encoding per client.
+"""
+
+import queue
+import threading
+from collections import namedtuple
+
+# A published change: readings after `since` up to `cursor`, pre-encoded as `text`
+Event = namedtuple("Event", "since cursor full text")
+
+# Put on a subscriber's queue when it fell behind and events were dropped
+LAGGED = object()
+
+
+class Subscription:
+    """A subscriber's bounded event queue"""
+
+    def __init__(self, max_events):
+        self.events = queue.Queue(max_events)
+        self.lagged = False
+
+    def get(self, timeout):
+        """Next event, LAGGED after dropped events, or None on timeout"""
+        try:
+            event = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if event is LAGGED:
+            self.lagged = False
+        return event
+
+
+class Hub:
+    """Fans published events out to every current subscriber of a topic"""
+
+    def __init__(self, max_events=64):
+        self.max_events = max_events
+        self.topics = {}  # topic -> set of subscriptions
+        self.lock = threading.Lock()
+
+    def has_subscribers(self, topic):
+        with self.lock:
+            return bool(self.topics.get(topic))
+
+    def subscribe(self, topic):
+        subscription = Subscription(self.max_events)
+        with self.lock:
+            self.topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, topic, subscription):
+        with self.lock:
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.topics[topic]
+
+    def publish(self, topic, event):
+        """Deliver event to every subscriber of topic without ever blocking the publisher"""
+        with self.lock:
+            subscribers = list(self.topics.get(topic, ()))
+        for subscription in subscribers:
+            if subscription.lagged:
+                continue
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                # A slow client must not hold up ingest: tell it to resync instead
+                subscription.lagged = True
+                _drain(subscription.events)
+                subscription.events.put_nowait(LAGGED)
+
+
+def _drain(events):
+    try:
+        while True:
+            events.get_nowait()
+    except queue.Empty:
+        pass
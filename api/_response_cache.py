@@ -0,0 +1,77 @@
+"""
+Cache of encoded responses, valid until the data behind them changes
+Each entry is stored with the write generation it was built at (the series'
+sequence number, or a global ingest counter) and served only while that
+generation is still current, so repeated polls between writes cost a dict
+lookup instead of re-reading the store and re-encoding the body.
+"""
+
+import gzip
+import threading
+import collections
+
+from flask import Response, request
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+
+class CachedResponse:
+    """A 200 response's body (and optionally its gzipped body), status headers and ETag"""
+
+    def __init__(self, response, compress):
+        self.body = response.get_data()
+        self.mimetype = response.mimetype
+        self.headers = [(name, value) for name, value in response.headers.items()
+                        if name not in ("Content-Type", "Content-Length")]
+        self.etag = response.get_etag()[0]
+        self.gzipped = gzip.compress(self.body, 6) if compress and len(self.body) >= GZIP_MIN_BYTES else None
+
+    def respond(self):
+        """A fresh Response for the current request (304, gzipped or plain)"""
+        if self.etag is not None and request.if_none_match.contains(self.etag):
+            response = Response(status=304)
+            response.headers.extend(self.headers)
+            return response
+        if self.gzipped is not None and "gzip" in request.accept_encodings:
+            response = Response(self.gzipped, mimetype=self.mimetype)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(self.body, mimetype=self.mimetype)
+        response.headers.extend(self.headers)
+        if self.gzipped is not None:
+            response.vary.add("Accept-Encoding")
+        return response
+
+
+class ResponseCache:
+    """Least-recently-used map of request key -> (generation, CachedResponse)"""
+
+    def __init__(self, max_entries=256, compress=False):
+        self.max_entries = max_entries
+        self.compress = compress
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """The cached response for key if it was built at this generation, else None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, generation, response):
+        """Cache a 200 response built at generation; returns its CachedResponse"""
+        cached = CachedResponse(response, self.compress)
+        with self.lock:
+            self.entries[key] = (generation, cached)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return cached
@@ -0,0 +1,254 @@
+"""
+Continuous rollup aggregates for long time ranges
+Every ingested reading is folded into 1-minute, 1-hour and 1-day buckets
+holding min, max, sum, count and the last reading, so a range query reads
+one bucket per minute/hour/day instead of every raw sample. Buckets merge
+exactly, which lets a query combine them into any coarser grid. Each tier
+keeps its own retention, measured back from its newest bucket.
+
+A reading that is itself the mean of several samples (a device reporting
+once per period) may come with their extremes, (timestamp, temp_c, min,
+max, count): its bucket then spans that min and max and counts and weighs
+it as count samples, so a spike inside the period still shows.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+
+# name, bucket width and retention in seconds, finest first
+Tier = namedtuple("Tier", "name width retention")
+
+TIERS = (
+    Tier("1m", 60, 14 * 86400),
+    Tier("1h", 3600, 2 * 365 * 86400),
+    Tier("1d", 86400, 10 * 365 * 86400),
+)
+
+# A bucket is [min, max, sum, count, last_ts, last]
+MIN, MAX, SUM, COUNT, LAST_TS, LAST = range(6)
+
+
+class RollupTier:
+    """Buckets of one width, keyed by bucket start time"""
+
+    def __init__(self, tier):
+        self.tier = tier
+        self.buckets = {}  # bucket start -> bucket
+        self.starts = []   # sorted bucket starts
+
+    def bucket_start(self, ts):
+        return ts - ts % self.tier.width
+
+    def cutoff(self):
+        """Oldest bucket start kept by retention, or None when empty"""
+        if not self.starts:
+            return None
+        return self.starts[-1] - self.tier.retention
+
+    def add(self, ts, temp_c):
+        """Fold one reading in; returns its bucket start, or None if past retention"""
+        start = self.bucket_start(ts)
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            cutoff = self.cutoff()
+            if cutoff is not None and start < cutoff:
+                return None
+            self.buckets[start] = [temp_c, temp_c, temp_c, 1, ts, temp_c]
+            if not self.starts or start > self.starts[-1]:
+                self.starts.append(start)
+                self.expire()
+            else:
+                insort(self.starts, start)
+            return start
+        if temp_c < bucket[MIN]:
+            bucket[MIN] = temp_c
+        if temp_c > bucket[MAX]:
+            bucket[MAX] = temp_c
+        bucket[SUM] += temp_c
+        bucket[COUNT] += 1
+        # Equal timestamps: the later arrival is the last, as in the stores
+        if ts >= bucket[LAST_TS]:
+            bucket[LAST_TS] = ts
+            bucket[LAST] = temp_c
+        return start
+
+    def widen(self, ts, temp_c, low, high, count):
+        """Make an added reading stand for count samples between low and high"""
+        bucket = self.buckets.get(self.bucket_start(ts))
+        if bucket is None:
+            return  # past retention
+        if low < bucket[MIN]:
+            bucket[MIN] = low
+        if high > bucket[MAX]:
+            bucket[MAX] = high
+        bucket[SUM] += temp_c * (count - 1)
+        bucket[COUNT] += count - 1
+
+    def load(self, start, bucket):
+        """Restore a persisted bucket"""
+        if start not in self.buckets:
+            insort(self.starts, start)
+        self.buckets[start] = list(bucket)
+
+    def expire(self):
+        """Drop buckets older than retention; returns the new cutoff"""
+        cutoff = self.cutoff()
+        expired = bisect_left(self.starts, cutoff) if cutoff is not None else 0
+        if expired:
+            for start in self.starts[:expired]:
+                del self.buckets[start]
+            del self.starts[:expired]
+        return cutoff
+
+    def covers(self, start):
+        """True when retention still holds buckets back to `start`"""
+        return bool(self.starts) and start >= self.cutoff()
+
+    def range(self, start, end):
+        """(bucket start, bucket) for buckets overlapping [start, end], oldest first"""
+        first = 0 if start is None else bisect_left(self.starts, self.bucket_start(start))
+        last = len(self.starts) if end is None else bisect_right(self.starts, end)
+        return [(s, self.buckets[s]) for s in self.starts[first:last]]
+
+
+class Rollups:
+    """The rollup tiers of one series
+
+    Not thread-safe on its own: the owning store calls it under its lock.
+    """
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = [RollupTier(tier) for tier in tiers]
+        self.by_name = {t.tier.name: t for t in self.tiers}
+
+    def extend(self, readings, extremes=()):
+        """Fold (timestamp, temp_c) readings into every tier
+
+        extremes are (timestamp, temp_c, min, max, count) for those of the
+        readings that summarize several samples. Returns {tier name: set of
+        touched bucket starts} for persistence.
+        """
+        readings = list(readings)
+        touched = {}
+        for t in self.tiers:
+            width = t.tier.width
+            starts = touched[t.tier.name] = set()
+            current, bucket = None, None
+            for ts, temp_c in readings:
+                start = ts - ts % width
+                # In-order readings mostly land in the bucket of the one before
+                if start != current or bucket is None:
+                    current = t.add(ts, temp_c)
+                    if current is not None:
+                        starts.add(current)
+                        bucket = t.buckets[current]
+                    continue
+                if temp_c < bucket[MIN]:
+                    bucket[MIN] = temp_c
+                if temp_c > bucket[MAX]:
+                    bucket[MAX] = temp_c
+                bucket[SUM] += temp_c
+                bucket[COUNT] += 1
+                if ts >= bucket[LAST_TS]:
+                    bucket[LAST_TS] = ts
+                    bucket[LAST] = temp_c
+            for summary in extremes:
+                t.widen(*summary)
+        return touched
+
+    def columns(self):
+        """{tier name: array of start + bucket, 7 values per bucket}, for snapshots"""
+        return {t.tier.name: array('d', [value for start in t.starts for value in (start, *t.buckets[start])])
+                for t in self.tiers}
+
+    def restore(self, columns):
+        """Load buckets saved by columns(); tiers this process does not have are skipped"""
+        for name, values in columns.items():
+            t = self.by_name.get(name)
+            if t is None:
+                continue
+            fields = [values[i::7] for i in range(7)]
+            if not t.starts:
+                # columns() writes buckets oldest first, so they can go in as they are
+                t.starts = list(fields[0])
+                t.buckets = {start: [low, high, total, int(count), last_ts, last]
+                             for start, low, high, total, count, last_ts, last in zip(*fields)}
+                continue
+            for start, *bucket in zip(*fields):
+                bucket[COUNT] = int(bucket[COUNT])
+                t.load(start, bucket)
+
+    def pick(self, start, end, max_points):
+        """Coarsest tier whose buckets are no wider than (end - start) / max_points
+
+        Only tiers whose retention reaches back to `start` qualify; when none
+        is fine enough, the finest qualifying tier is used.
+        """
+        covering = [t for t in self.tiers if t.covers(start)] or self.tiers[-1:]
+        target = (end - start) / max_points
+        fine_enough = [t for t in covering if t.tier.width <= target]
+        return fine_enough[-1] if fine_enough else covering[0]
+
+    def oldest(self):
+        """Start of the oldest bucket in any tier, or None when empty"""
+        starts = [t.starts[0] for t in self.tiers if t.starts]
+        return min(starts) if starts else None
+
+    def query(self, start, end, max_points, tier=None):
+        """Buckets for [start, end] as (tier name, scanned, [(time, bucket), ...])
+
+        The tier is picked with pick() unless named; start=None means from
+        the oldest bucket. When the tier holds more than max_points buckets
+        in range they are merged into max_points equal time slots.
+        """
+        if start is None:
+            start = self.oldest()
+            if start is None:
+                return (tier or self.tiers[0].tier.name), 0, []
+        if tier is None:
+            chosen = self.pick(start, end, max_points)
+        elif tier in self.by_name:
+            chosen = self.by_name[tier]
+        else:
+            raise ValueError(f"Unknown rollup tier '{tier}'")
+        buckets = chosen.range(start, end)
+        if len(buckets) <= max_points:
+            return chosen.tier.name, len(buckets), [(s, list(b)) for s, b in buckets]
+
+        width = max(end - start, 1e-9) / max_points
+        merged = []
+        current_index = None
+        for s, bucket in buckets:
+            index = min(max(int((s - start) / width), 0), max_points - 1)
+            if index != current_index:
+                merged.append((s, list(bucket)))
+                current_index = index
+            else:
+                _merge_into(merged[-1][1], bucket)
+        return chosen.tier.name, len(buckets), merged
+
+
+def mean(bucket):
+    return bucket[SUM] / bucket[COUNT]
+
+
+def summarize(bucket):
+    """A bucket as {min, max, mean, count, last}"""
+    return {
+        "min": bucket[MIN],
+        "max": bucket[MAX],
+        "mean": mean(bucket),
+        "count": bucket[COUNT],
+        "last": bucket[LAST],
+    }
+
+
+def _merge_into(target, bucket):
+    target[MIN] = min(target[MIN], bucket[MIN])
+    target[MAX] = max(target[MAX], bucket[MAX])
+    target[SUM] += bucket[SUM]
+    target[COUNT] += bucket[COUNT]
+    if bucket[LAST_TS] >= target[LAST_TS]:
+        target[LAST_TS] = bucket[LAST_TS]
+        target[LAST] = bucket[LAST]
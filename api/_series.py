@@ -0,0 +1,136 @@
+"""
+Series index: one reading store per (device_id, probe_id)
+Each series has its own buffer, cursor and stats, and is found with a dict
+lookup, so reading one series never touches the others.
+"""
+
+import re
+import atexit
+import threading
+
+from _store import RingBufferStore
+
+# Series for readings that do not say which device or probe they came from
+DEFAULT_DEVICE = "default"
+DEFAULT_PROBE = "0"
+
+# Allowed device and probe ids: short, URL- and table-name-safe
+SERIES_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+
+
+def validate_series_id(value, name):
+    """Return a device/probe id as a string, or raise ValueError"""
+    value = str(value)
+    if not SERIES_ID_PATTERN.match(value):
+        raise ValueError(f"{name} must be 1-64 letters, digits or . _ : -")
+    return value
+
+
+class SeriesIndex:
+    """Maps (device, probe) to its ReadingStore, created on first write"""
+
+    def __init__(self, factory, database=None, directory=None):
+        self.factory = factory
+        self.database = database  # shared by the stores, closed with the index
+        # Series registered by other processes (the shared backend), picked up as they appear
+        self.directory = directory
+        self.series = {}  # (device, probe) -> store, in registration order
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        self.sync()
+        with self.lock:
+            return len(self.series)
+
+    def sync(self):
+        """Open any series another process added to the shared directory"""
+        if self.directory is None or self.directory.count() <= len(self.series):
+            return
+        with self.lock:
+            for key in self.directory.keys(len(self.series)):
+                if key not in self.series:
+                    self.series[key] = self.factory(*key)
+
+    def get(self, device, probe):
+        """Store for a series, or None if nothing was ever written to it"""
+        store = self.series.get((device, probe))
+        if store is None and self.directory is not None:
+            self.sync()
+            store = self.series.get((device, probe))
+        return store
+
+    def get_or_create(self, device, probe):
+        store = self.series.get((device, probe))
+        if store is None:
+            self.sync()
+            with self.lock:
+                store = self.series.get((device, probe))
+                if store is None:
+                    store = self.series[(device, probe)] = self.factory(device, probe)
+        return store
+
+    def resolve(self, device=None, probe=None):
+        """Pick the series a query means: ((device, probe), store) or None
+
+        Without a device this is the default series if it exists, otherwise
+        the first one registered; without a probe, the device's first probe.
+        """
+        if device is not None and probe is not None:
+            store = self.get(device, probe)
+            return ((device, probe), store) if store is not None else None
+        self.sync()
+        with self.lock:
+            keys = list(self.series)
+        if device is None and probe is None and (DEFAULT_DEVICE, DEFAULT_PROBE) in self.series:
+            keys = [(DEFAULT_DEVICE, DEFAULT_PROBE)]
+        for key in keys:
+            if (device is None or key[0] == device) and (probe is None or key[1] == probe):
+                return key, self.series[key]
+        return None
+
+    def items(self):
+        """((device, probe), store) for every series, in registration order"""
+        self.sync()
+        with self.lock:
+            return list(self.series.items())
+
+    def close(self):
+        with self.lock:
+            stores = list(self.series.values())
+        for store in stores:
+            store.close()
+        if self.database is not None:
+            self.database.close()
+        if self.directory is not None:
+            self.directory.close()
+
+
+def open_series_index(backend="memory", capacity=200_000, path="temperature.db", retention_days=365,
+                      name="temperature"):
+    """Create the series index for a storage backend ("memory", "compressed", "sqlite" or "shared")
+
+    ``name`` names the shared memory segments of the "shared" backend.
+    """
+    if backend == "memory":
+        return SeriesIndex(lambda device, probe: RingBufferStore(capacity))
+    if backend == "compressed":
+        from _compressed_store import CompressedStore
+        return SeriesIndex(lambda device, probe: CompressedStore(capacity))
+    if backend == "sqlite":
+        from _sqlite_store import SQLiteDatabase, SQLiteStore
+        database = SQLiteDatabase(path)
+        index = SeriesIndex(lambda device, probe: SQLiteStore(
+            database, database.series_id(device, probe), retention_days), database)
+        for _, device, probe in database.all_series():
+            index.get_or_create(device, probe)
+        return index
+    if backend == "shared":
+        from _shared_store import SharedDirectory, SharedRingStore
+        directory = SharedDirectory(name)
+        index = SeriesIndex(lambda device, probe: SharedRingStore(directory, device, probe, capacity),
+                            directory=directory)
+        index.sync()
+        # Unmap before exit; the segments themselves stay for the other workers
+        atexit.register(index.close)
+        return index
+    raise ValueError(f"Unknown store backend '{backend}'")
@@ -0,0 +1,591 @@
+"""
+Reading store in shared memory, for several worker processes on one host
+Under gunicorn with N workers every process otherwise keeps its own stores,
+so each sees only the uploads that happened to land on it. Here each series
+is one ring buffer in a multiprocessing.shared_memory segment that every
+worker maps, plus a directory segment listing the series, so all workers
+read the same history.
+
+Writes are serialized across processes with flock() on a lock file (and a
+thread lock within a process), so there is one writer at a time. Reads take
+no lock: each segment starts with a seqlock version counter that the writer
+makes odd while it changes the ring and even again when done, and a reader
+retries whenever the version was odd or moved while it copied. Long ranges
+are copied a page at a time, each page its own consistent read. A version
+left odd by a writer that died mid-write (flock is released with the
+process) is repaired by the next writer, or by a reader that has waited
+STALLED_WRITE_SECONDS: it takes the lock and rebuilds the ring.
+
+Segments outlive the processes, so history survives worker restarts; they
+are removed with SharedDirectory.unlink() or a reboot. Linux/macOS only.
+
+    directory  count (u32), reserved (u32), then MAX_SERIES entries of
+               device length (u8) + 64 bytes, probe length (u8) + 64 bytes
+    series     version, start, end, seq, reset_seq, capacity (u64 each), sum (f64),
+               reserved to 64 bytes; ts[capacity] (f64), temp_c[capacity] (f64),
+               block_min[capacity / BLOCK] (f64), block_max[capacity / BLOCK] (f64),
+               then per rollup tier: newest start, oldest start, buckets written (f64 each),
+               and slots x (start, min, max, sum, count, last_ts, last) (f64 each)
+
+Positions are absolute as in RingBufferStore: the oldest reading is `start`,
+the newest `end - 1`, stored in slot position % capacity. Per-block min/max
+summaries keep stats() at O(capacity / BLOCK) without monotonic deques.
+
+Rollups live in the segment too, written with the readings under the same
+version counter, so every worker serves the same 1m/1h/1d history, for as
+long as each tier's retention, however little of it the ring still holds.
+Each tier is a direct-mapped ring of buckets with a slot for every bucket
+its retention covers (about 2.3 MB a series for the default tiers).
+"""
+
+import os
+import math
+import time
+import struct
+import tempfile
+import threading
+from array import array
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from _rollup import COUNT, LAST, LAST_TS, MAX, MIN, SUM, TIERS, Rollups
+from _store import ITER_PAGE, ROLLUP_PREFIX, ReadingStore, rollup_columns
+
+# Series one directory can hold
+MAX_SERIES = 1024
+# Readings per min/max summary block; capacity is rounded up to a multiple
+BLOCK = 1024
+# Seconds a reader waits on an odd version before taking the lock to check the writer is alive
+STALLED_WRITE_SECONDS = 1.0
+
+_DIRECTORY_HEADER = struct.Struct("<II")
+_ENTRY = struct.Struct("<B64sB64s")
+_HEADER = struct.Struct("<QQQQQQd")
+_HEADER_SIZE = 64
+_VERSION = struct.Struct("<Q")
+
+
+def _segment(name, size=None):
+    """Attach to a segment, or create it when size is given, without tying its life to this process"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=size is not None, size=size or 0, track=False)
+    except TypeError:
+        # Before Python 3.13 the resource tracker unlinks segments when the process that
+        # opened them exits, which would pull the history out from under the other workers
+        segment = shared_memory.SharedMemory(name=name, create=size is not None, size=size or 0)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        segment.untracked = True
+        return segment
+
+
+def _unlink(segment):
+    if getattr(segment, "untracked", False):
+        # unlink() tells the tracker to forget the segment, which it no longer knows
+        resource_tracker.register(segment._name, "shared_memory")
+    segment.unlink()
+
+
+class SharedDirectory:
+    """The series held under one name, and the lock their writers share"""
+
+    def __init__(self, name="temperature"):
+        import fcntl  # POSIX only; imported here so other backends work everywhere
+        self.fcntl = fcntl
+        self.name = name
+        self.thread_lock = threading.Lock()
+        self.lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.shm.lock"), "a+b")
+        with self.locked():
+            try:
+                self.segment = _segment(f"{name}-series")
+            except FileNotFoundError:
+                self.segment = _segment(f"{name}-series", _DIRECTORY_HEADER.size + MAX_SERIES * _ENTRY.size)
+
+    @contextmanager
+    def locked(self):
+        """Hold the write lock: one thread in this process, one process on the host"""
+        with self.thread_lock:
+            self.fcntl.flock(self.lock_file, self.fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self.fcntl.flock(self.lock_file, self.fcntl.LOCK_UN)
+
+    def count(self):
+        return _DIRECTORY_HEADER.unpack_from(self.segment.buf, 0)[0]
+
+    def keys(self, first=0):
+        """(device, probe) of every series from index `first` on, in registration order"""
+        keys = []
+        for slot in range(first, self.count()):
+            device_len, device, probe_len, probe = _ENTRY.unpack_from(
+                self.segment.buf, _DIRECTORY_HEADER.size + slot * _ENTRY.size)
+            keys.append((device[:device_len].decode(), probe[:probe_len].decode()))
+        return keys
+
+    def register(self, device, probe, capacity):
+        """Slot of a series, creating its segment (holding `capacity` readings) if it is new"""
+        with self.locked():
+            keys = self.keys()
+            if (device, probe) in keys:
+                return keys.index((device, probe))
+            slot = len(keys)
+            if slot >= MAX_SERIES:
+                raise ValueError(f"shared store is full ({MAX_SERIES} series)")
+            capacity = -(-capacity // BLOCK) * BLOCK
+            try:
+                segment = _segment(f"{self.name}-{slot}", series_size(capacity))
+            except FileExistsError:
+                # Left over from a directory that was unlinked on its own: start it afresh
+                stale = _segment(f"{self.name}-{slot}")
+                stale.close()
+                _unlink(stale)
+                segment = _segment(f"{self.name}-{slot}", series_size(capacity))
+            _HEADER.pack_into(segment.buf, 0, 0, 0, 0, 0, 0, capacity, 0.0)
+            segment.close()
+            # Publish the entry only once its segment is ready
+            encoded_device, encoded_probe = device.encode(), probe.encode()
+            _ENTRY.pack_into(self.segment.buf, _DIRECTORY_HEADER.size + slot * _ENTRY.size,
+                             len(encoded_device), encoded_device, len(encoded_probe), encoded_probe)
+            _DIRECTORY_HEADER.pack_into(self.segment.buf, 0, slot + 1, 0)
+            return slot
+
+    def close(self):
+        self.segment.close()
+        self.lock_file.close()
+
+    def unlink(self):
+        """Remove every segment under this name from the system"""
+        for slot in range(self.count()):
+            try:
+                segment = _segment(f"{self.name}-{slot}")
+            except FileNotFoundError:
+                continue
+            segment.close()
+            _unlink(segment)
+        _unlink(self.segment)
+
+
+def series_size(capacity):
+    return _HEADER_SIZE + 16 * capacity + 16 * (capacity // BLOCK) + sum(8 * tier_size(t) for t in TIERS)
+
+
+def tier_slots(tier):
+    """Bucket slots for a tier: enough that a slot is only reused once its bucket is past retention"""
+    return tier.retention // tier.width + 1
+
+
+def tier_size(tier):
+    """Doubles taken by a tier: its three header values and 7 per slot"""
+    return 3 + 7 * tier_slots(tier)
+
+
+class SharedRollupTier:
+    """One rollup tier in shared memory, with the interface Rollups uses of a RollupTier
+
+    Bucket start s lives in slot (s // width) % slots; a slot holding another
+    start, or a count of 0, is empty. Buckets older than the newest minus
+    retention are expired and ignored in place rather than removed.
+    """
+
+    def __init__(self, tier, view):
+        self.tier = tier
+        self.slots = tier_slots(tier)
+        self.view = view  # doubles: newest start, oldest start, buckets written, then the slots
+
+    def _slot(self, start):
+        return 3 + int(start // self.tier.width) % self.slots * 7
+
+    def cutoff(self):
+        """Oldest bucket start kept by retention, or None when empty"""
+        return self.view[0] - self.tier.retention if self.view[2] else None
+
+    def add(self, ts, temp_c):
+        """Fold one reading in; returns its bucket start, or None if past retention"""
+        start = ts - ts % self.tier.width
+        view = self.view
+        base = self._slot(start)
+        if not view[base + 1 + COUNT] or view[base] != start:
+            if not self.load(start, [temp_c, temp_c, temp_c, 1, ts, temp_c]):
+                return None
+            return start
+        if temp_c < view[base + 1 + MIN]:
+            view[base + 1 + MIN] = temp_c
+        if temp_c > view[base + 1 + MAX]:
+            view[base + 1 + MAX] = temp_c
+        view[base + 1 + SUM] += temp_c
+        view[base + 1 + COUNT] += 1
+        if ts >= view[base + 1 + LAST_TS]:
+            view[base + 1 + LAST_TS] = ts
+            view[base + 1 + LAST] = temp_c
+        return start
+
+    def widen(self, ts, temp_c, low, high, count):
+        """Make an added reading stand for count samples between low and high"""
+        start = ts - ts % self.tier.width
+        view = self.view
+        base = self._slot(start)
+        if not view[base + 1 + COUNT] or view[base] != start:
+            return  # past retention
+        if low < view[base + 1 + MIN]:
+            view[base + 1 + MIN] = low
+        if high > view[base + 1 + MAX]:
+            view[base + 1 + MAX] = high
+        view[base + 1 + SUM] += temp_c * (count - 1)
+        view[base + 1 + COUNT] += count - 1
+
+    def load(self, start, bucket):
+        """Put a bucket in its slot; False if it is already past retention"""
+        view = self.view
+        cutoff = self.cutoff()
+        if cutoff is not None and start < cutoff:
+            return False
+        base = self._slot(start)
+        view[base:base + 7] = array('d', [start, *bucket])
+        if not view[2] or start > view[0]:
+            view[0] = start
+        if not view[2] or start < view[1]:
+            view[1] = start
+        view[2] += 1
+        return True
+
+    def oldest(self):
+        """Start of the oldest bucket retention may still hold, or None when empty"""
+        return max(self.view[1], self.cutoff()) if self.view[2] else None
+
+    def covers(self, start):
+        """True when retention still holds buckets back to `start`"""
+        return bool(self.view[2]) and start >= self.cutoff()
+
+    def range(self, start, end):
+        """(bucket start, bucket) for buckets overlapping [start, end], oldest first"""
+        if not self.view[2]:
+            return []
+        view = self.view
+        width = self.tier.width
+        first = self.oldest() if start is None else max(self.oldest(), start - start % width)
+        last = view[0] if end is None else min(view[0], end)
+        # One copy of every slot beats reading them one at a time, even for short ranges
+        values = view[3:].tolist()
+        buckets = []
+        for slot, (bucket_start, count) in enumerate(zip(values[0::7], values[1 + COUNT::7])):
+            if count and first <= bucket_start <= last:
+                bucket = values[slot * 7 + 1:slot * 7 + 7]
+                bucket[COUNT] = int(count)
+                buckets.append((bucket_start, bucket))
+        buckets.sort(key=lambda bucket: bucket[0])
+        return buckets
+
+
+class SharedRollups(Rollups):
+    """The rollup tiers of one series in its segment
+
+    Written by the store under its write lock; read inside its seqlock reads.
+    """
+
+    def __init__(self, view):
+        self.tiers = []
+        offset = 0
+        for tier in TIERS:
+            size = tier_size(tier)
+            self.tiers.append(SharedRollupTier(tier, view[offset:offset + size]))
+            offset += size
+        self.by_name = {t.tier.name: t for t in self.tiers}
+
+    def extend(self, readings, extremes=()):
+        for t in self.tiers:
+            for ts, temp_c in readings:
+                t.add(ts, temp_c)
+            for summary in extremes:
+                t.widen(*summary)
+
+    def columns(self):
+        return {t.tier.name: array('d', [value for start, bucket in t.range(None, None)
+                                         for value in (start, *bucket)])
+                for t in self.tiers}
+
+    def restore(self, columns):
+        for name, values in columns.items():
+            t = self.by_name.get(name)
+            if t is None:
+                continue
+            fields = [values[i::7] for i in range(7)]
+            for start, *bucket in zip(*fields):
+                t.load(start, bucket)
+
+    def oldest(self):
+        starts = [start for t in self.tiers if (start := t.oldest()) is not None]
+        return min(starts) if starts else None
+
+    def release(self):
+        for t in self.tiers:
+            t.view.release()
+
+
+class SharedRingStore(ReadingStore):
+    """One series' ring buffer in shared memory; see the module docstring"""
+
+    def __init__(self, directory, device, probe, capacity):
+        self.directory = directory
+        self.segment = _segment(f"{directory.name}-{directory.register(device, probe, capacity)}")
+        buf = self.segment.buf
+        # The segment's own capacity wins if it was created with another MAX_READINGS
+        self.capacity = _HEADER.unpack_from(buf, 0)[5]
+        if self.segment.size < series_size(self.capacity):
+            self.segment.close()
+            raise ValueError(f"shared segment {self.segment.name} has an older layout; "
+                             "remove it with SharedDirectory.unlink() or a reboot")
+        blocks = self.capacity // BLOCK
+        columns = _HEADER_SIZE
+        self.ts = buf[columns:columns + 8 * self.capacity].cast('d')
+        self.temp_c = buf[columns + 8 * self.capacity:columns + 16 * self.capacity].cast('d')
+        summaries = columns + 16 * self.capacity
+        self.block_min = buf[summaries:summaries + 8 * blocks].cast('d')
+        self.block_max = buf[summaries + 8 * blocks:summaries + 16 * blocks].cast('d')
+        rollups = summaries + 16 * blocks
+        self.rollups = SharedRollups(buf[rollups:series_size(self.capacity)].cast('d'))
+
+    # --- reading ---
+
+    def _read(self, fn):
+        """Call fn(start, end, seq, reset_seq, sum) until it ran while no write was in progress"""
+        buf = self.segment.buf
+        waits = 0
+        stalled_at = None
+        while True:
+            version = _VERSION.unpack_from(buf, 0)[0]
+            if version & 1:
+                # A write is in progress: yield, then back off so a busy reader cannot starve it
+                time.sleep(0 if waits < 10 else 0.0005)
+                waits += 1
+                if waits == 10:
+                    stalled_at = time.monotonic()
+                elif stalled_at is not None and time.monotonic() - stalled_at > STALLED_WRITE_SECONDS:
+                    # Blocks while a live writer finishes; repairs the ring if the writer died
+                    with self.directory.locked():
+                        self._repair()
+                    waits, stalled_at = 0, None
+                continue
+            _, start, end, seq, reset_seq, _, total = _HEADER.unpack_from(buf, 0)
+            try:
+                result = fn(start, end, seq, reset_seq, total)
+            except (IndexError, ValueError, ZeroDivisionError):
+                # Torn read: positions changed under us
+                if _VERSION.unpack_from(buf, 0)[0] == version:
+                    raise
+                continue
+            if _VERSION.unpack_from(buf, 0)[0] == version:
+                return result
+
+    def _copy(self, first, last):
+        """Readings at positions [first, last) as (timestamp, temp_c, temp_f), for use inside _read"""
+        if last <= first:
+            return []
+        ts, temps = [], []
+        pos = first
+        while pos < last:
+            slot = pos % self.capacity
+            stop = min(last - pos, self.capacity - slot) + slot
+            ts += self.ts[slot:stop].tolist()
+            temps += self.temp_c[slot:stop].tolist()
+            pos += stop - slot
+        return [(t, c, c * 9/5 + 32) for t, c in zip(ts, temps)]
+
+    def _bisect(self, ts, right, start, end):
+        """First position in [start, end) whose timestamp is >= ts (> ts when right=True)"""
+        lo, hi = start, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_ts = self.ts[mid % self.capacity]
+            if mid_ts < ts or (right and mid_ts == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @property
+    def seq(self):
+        return _HEADER.unpack_from(self.segment.buf, 0)[3]
+
+    def __len__(self):
+        return self._read(lambda start, end, *_: end - start)
+
+    def nbytes(self):
+        return series_size(self.capacity)
+
+    def latest(self):
+        return self._read(lambda start, end, *_: self._copy(end - 1, end)[0] if end > start else None)
+
+    def stats(self):
+        def read(start, end, seq, reset_seq, total):
+            if end == start:
+                return None
+            # The block holding `start` may include evicted readings: scan that part directly
+            boundary = min(end, (start // BLOCK + 1) * BLOCK)
+            slot = start % self.capacity
+            head = self.temp_c[slot:slot + boundary - start]
+            lows, highs = [min(head)], [max(head)]
+            blocks = self.capacity // BLOCK
+            for block in range(boundary // BLOCK, (end - 1) // BLOCK + 1) if boundary < end else ():
+                lows.append(self.block_min[block % blocks])
+                highs.append(self.block_max[block % blocks])
+            return {"min": min(lows), "max": max(highs), "avg": total / (end - start), "count": end - start}
+        return self._read(read)
+
+    def recent(self, n):
+        return self._read(lambda start, end, *_: self._copy(max(start, end - n), end))
+
+    def changes(self, cursor, limit):
+        def read(start, end, seq, reset_seq, total):
+            if cursor is not None and reset_seq <= cursor <= seq:
+                first = cursor - (seq - end)
+                if first >= start and end - first <= limit:
+                    return seq, self._copy(first, end), False
+            return seq, self._copy(max(start, end - limit), end), True
+        return self._read(read)
+
+    def iter_range(self, start=None, end=None):
+        def bounds(first, last, seq, reset_seq, total):
+            lo = first if start is None else self._bisect(start, False, first, last)
+            hi = last if end is None else self._bisect(end, True, first, last)
+            return lo, hi, reset_seq, self.ts[(hi - 1) % self.capacity] if hi > lo else None
+        first, last, reset_seq, newest = self._read(bounds)
+        return self._iter_pages(first, last, start, newest if end is None else end, reset_seq)
+
+    def _iter_pages(self, pos, last, start, end, reset_seq):
+        # Each page is its own consistent read; after a rebuild, find our place again by timestamp
+        last_ts = None
+        while pos < last:
+            def page(first, newest, seq, current_reset, total):
+                lo, hi = pos, last
+                if current_reset != reset_seq:
+                    lo = (self._bisect(last_ts, True, first, newest) if last_ts is not None
+                          else first if start is None else self._bisect(start, False, first, newest))
+                    hi = self._bisect(end, True, first, newest)
+                lo = max(lo, first)
+                stop = min(hi, newest, lo + ITER_PAGE)
+                return current_reset, hi, stop, self._copy(lo, stop)
+            reset_seq, last, pos, readings = self._read(page)
+            if not readings:
+                return
+            last_ts = readings[-1][0]
+            yield from readings
+
+    def rollup(self, start, end, max_points, tier=None):
+        if tier is not None and tier not in self.rollups.by_name:
+            raise ValueError(f"Unknown rollup tier '{tier}'")
+        return self._read(lambda *_: self.rollups.query(start, end, max_points, tier))
+
+    def snapshot(self):
+        # The ring and the rollups in one consistent read
+        def read(start, end, seq, reset_seq, total):
+            ts, temp_c = array('d'), array('d')
+            for reading in self._copy(start, end):
+                ts.append(reading[0])
+                temp_c.append(reading[1])
+            columns = {"ts": ts, "temp_c": temp_c}
+            columns.update((ROLLUP_PREFIX + name, values) for name, values in self.rollups.columns().items())
+            return seq, columns
+        return self._read(read)
+
+    def restore(self, seq, columns):
+        if "ts" not in columns:
+            raise ValueError("written by another store backend")
+        self.extend(zip(columns["ts"], columns["temp_c"]))
+        with self._writing():
+            self.rollups.restore(rollup_columns(columns))
+
+    # --- writing ---
+
+    def extend(self, readings, extremes=()):
+        readings = list(readings)
+        if not readings:
+            return 0
+        buf = self.segment.buf
+        with self._writing():
+            version, start, end, seq, reset_seq, _, total = _HEADER.unpack_from(buf, 0)
+            try:
+                if end > start and readings[0][0] < self.ts[(end - 1) % self.capacity]:
+                    start, end, total = self._merge(readings, start, end)
+                    reset_seq = seq + len(readings)
+                else:
+                    for ts, temp_c in readings:
+                        start, end, total = self._append(ts, temp_c, start, end, total)
+                seq += len(readings)
+            finally:
+                _HEADER.pack_into(buf, 0, version, start, end, seq, reset_seq, self.capacity, total)
+            # Rollups outlive the ring: evicting raw readings leaves their buckets alone
+            self.rollups.extend(readings, extremes)
+        return len(readings)
+
+    @contextmanager
+    def _writing(self):
+        """Hold the write lock with the version odd, so readers retry until the write is done"""
+        buf = self.segment.buf
+        with self.directory.locked():
+            self._repair()
+            version = _VERSION.unpack_from(buf, 0)[0]
+            _VERSION.pack_into(buf, 0, version + 1)
+            try:
+                yield
+            finally:
+                _VERSION.pack_into(buf, 0, version + 2)
+
+    def _append(self, ts, temp_c, start, end, total):
+        if end - start == self.capacity:
+            total -= self.temp_c[start % self.capacity]
+            start += 1
+            # Re-sum exactly once per full turn of the ring so float error cannot build up
+            if start % self.capacity == 0:
+                total = math.fsum(self.temp_c[pos % self.capacity] for pos in range(start, end))
+        slot = end % self.capacity
+        self.ts[slot] = ts
+        self.temp_c[slot] = temp_c
+        total += temp_c
+        block = slot // BLOCK
+        if end % BLOCK == 0:
+            self.block_min[block] = self.block_max[block] = temp_c
+        else:
+            if temp_c < self.block_min[block]:
+                self.block_min[block] = temp_c
+            if temp_c > self.block_max[block]:
+                self.block_max[block] = temp_c
+        return start, end + 1, total
+
+    def _repair(self):
+        """Under the write lock: recover from a writer that died mid-write, if one did
+
+        Its header was never updated, so the ring may hold part of a batch
+        over the oldest readings or a half-rewritten merge. The readings the
+        header covers are re-sorted and the ring rebuilt from them; seq moves
+        on by one and every cursor gets a full reload. The rollups keep
+        whatever part of the batch reached them.
+        """
+        buf = self.segment.buf
+        version, start, end, seq, reset_seq, _, total = _HEADER.unpack_from(buf, 0)
+        if not version & 1:
+            return
+        merged = [(ts, temp_c) for ts, temp_c, _ in self._copy(start, end)]
+        merged.sort(key=lambda reading: reading[0])
+        start = end = 0
+        total = 0.0
+        for ts, temp_c in merged:
+            start, end, total = self._append(ts, temp_c, start, end, total)
+        _HEADER.pack_into(buf, 0, version + 1, start, end, seq + 1, seq + 1, self.capacity, total)
+
+    def _merge(self, readings, start, end):
+        """Slow path for late readings: re-sort everything and rewrite the ring from position 0"""
+        merged = [(ts, temp_c) for ts, temp_c, _ in self._copy(start, end)]
+        merged.extend(readings)
+        # Stable sort, so equal timestamps keep their arrival order
+        merged.sort(key=lambda reading: reading[0])
+        start = end = 0
+        total = 0.0
+        for ts, temp_c in merged[-self.capacity:]:
+            start, end, total = self._append(ts, temp_c, start, end, total)
+        return start, end, total
+
+    def close(self):
+        for view in (self.ts, self.temp_c, self.block_min, self.block_max):
+            view.release()
+        self.rollups.release()
+        self.segment.close()
@@ -0,0 +1,125 @@
+"""
+Snapshots of the in-memory stores, so a new process starts with data
+A snapshot is one binary file holding every series' columns (see
+ReadingStore.snapshot) as raw little-endian arrays, each aligned to 8 bytes.
+Loading memory-maps the file and copies each column straight into an array,
+with no per-reading parsing, so hydrating a few hundred thousand readings
+takes milliseconds.
+
+    header  "TS", version (u8), reserved (u8), series count (u32), written at (f64 epoch seconds)
+    series  device id length (u8) + id, probe id length (u8) + id, seq (u64), column count (u16),
+            then per column: name length (u8) + name, array typecode (1 byte),
+            item count (u64), zero padding to an 8-byte offset, the items
+
+Files are written to a temporary name of their own and renamed into place,
+so a reader never sees a partial snapshot, even with several processes
+saving at once.
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import tempfile
+from array import array
+
+MAGIC = b"TS"
+VERSION = 1
+
+_HEADER = struct.Struct("<2sBxId")
+_SERIES = struct.Struct("<QH")
+_COLUMN = struct.Struct("<cQ")
+
+
+def write(path, stores):
+    """Write ((device, probe), store) pairs to path atomically; returns the readings written"""
+    snapshots = [(key, len(store), *store.snapshot()) for key, store in stores]
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                               suffix=".tmp")
+    try:
+        readings = _write(fd, snapshots)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return readings
+
+
+def _write(fd, snapshots):
+    readings = 0
+    with open(fd, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(snapshots), time.time()))
+        for (device, probe), count, seq, columns in snapshots:
+            for name in (device, probe):
+                encoded = name.encode()
+                f.write(bytes([len(encoded)]) + encoded)
+            f.write(_SERIES.pack(seq, len(columns)))
+            for name, values in columns.items():
+                encoded = name.encode()
+                f.write(bytes([len(encoded)]) + encoded + _COLUMN.pack(values.typecode.encode(), len(values)))
+                f.write(bytes(-f.tell() % 8))
+                if sys.byteorder == "big":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                f.write(values)
+            readings += count
+    return readings
+
+
+def load(path, series):
+    """Restore every series in the snapshot at path into a SeriesIndex
+
+    Returns (series restored, readings restored, written at). Raises
+    FileNotFoundError when there is no snapshot and ValueError when the
+    file is not one this version can read.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return _restore(view, series)
+            finally:
+                view.release()
+
+
+def _restore(view, series):
+    if len(view) < _HEADER.size:
+        raise ValueError("snapshot is truncated")
+    magic, version, count, written_at = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version 1 snapshot")
+    offset = _HEADER.size
+    readings = 0
+    try:
+        for _ in range(count):
+            device, offset = _read_name(view, offset)
+            probe, offset = _read_name(view, offset)
+            seq, columns_count = _SERIES.unpack_from(view, offset)
+            offset += _SERIES.size
+            columns = {}
+            for _ in range(columns_count):
+                name, offset = _read_name(view, offset)
+                typecode, items = _COLUMN.unpack_from(view, offset)
+                offset += _COLUMN.size
+                offset += -offset % 8
+                values = array(typecode.decode())
+                size = items * values.itemsize
+                if offset + size > len(view):
+                    raise ValueError("snapshot is truncated")
+                values.frombytes(view[offset:offset + size])
+                if sys.byteorder == "big":
+                    values.byteswap()
+                offset += size
+                columns[name] = values
+            store = series.get_or_create(device, probe)
+            store.restore(seq, columns)
+            readings += len(store)
+    except (struct.error, IndexError, KeyError, UnicodeDecodeError) as e:
+        raise ValueError(f"snapshot is corrupt: {e}") from None
+    return count, readings, written_at
+
+
+def _read_name(view, offset):
+    length = view[offset]
+    return bytes(view[offset + 1:offset + 1 + length]).decode(), offset + 1 + length
@@ -0,0 +1,312 @@
+"""
+SQLite reading store partitioned by series and UTC day
+Each day of each series lives in its own table, indexed by timestamp, so a
+range read only touches the days it overlaps and expiring a day is a single
+DROP TABLE. Per-day min/max/sum/count are kept in memory so stats never scan
+rows. Every row also carries the series' insertion sequence number, and the
+newest one is kept in a meta table so changes() reads it in the same snapshot;
+the newest per day lets changes() skip the days with nothing after a cursor.
+A late batch (older than the newest reading) records its sequence number
+there too, and cursors from before it get a full answer, as in the ring
+buffers. Rollup buckets touched by a write are saved in the same
+transaction, and the in-memory state only moves on once it commits.
+
+The database is only as durable as the filesystem it sits on: on Vercel
+that is an ephemeral /tmp, so point SQLITE_PATH at persistent storage.
+"""
+
+import calendar
+import sqlite3
+import threading
+import time
+
+from _rollup import Rollups
+from _store import ReadingStore
+
+SECONDS_PER_DAY = 86400
+
+
+def day_of(ts):
+    """Day number (days since the epoch, UTC) a timestamp falls in"""
+    return int(ts // SECONDS_PER_DAY)
+
+
+class SQLiteDatabase:
+    """One database file shared by every series: a writer connection, per-thread readers
+    and the table of known series"""
+
+    def __init__(self, path="temperature.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS series ("
+            " id INTEGER PRIMARY KEY, device TEXT NOT NULL, probe TEXT NOT NULL,"
+            " UNIQUE (device, probe))"
+        )
+        self.db.commit()
+
+    def all_series(self):
+        """Every (series_id, device, probe) stored so far, in creation order"""
+        with self.lock:
+            return self.db.execute("SELECT id, device, probe FROM series ORDER BY id").fetchall()
+
+    def series_id(self, device, probe):
+        """Id of a series, registering it on first use"""
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO series (device, probe) VALUES (?, ?)", (device, probe))
+            return self.db.execute(
+                "SELECT id FROM series WHERE device = ? AND probe = ?", (device, probe)
+            ).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def reader(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path)
+        return db
+
+
+class SQLiteStore(ReadingStore):
+    """Day-partitioned history of one series in SQLite (WAL mode)
+
+    Partition tables are named readings_<series id>_<YYYYMMDD>. Writes go
+    through the database's writer connection under its lock, one transaction
+    per extend() call. Reads use a connection per thread, which WAL lets run
+    alongside the writer. Days older than retention_days before the newest
+    reading are dropped as whole partitions.
+    """
+
+    def __init__(self, database, series_id, retention_days=365):
+        self.database = database
+        self.db = database.db
+        self.lock = database.lock
+        self.prefix = f"readings_{series_id}_"
+        self.seq_key = f"seq_{series_id}"
+        self.reset_key = f"reset_{series_id}"
+        self.rollup_table = f"rollups_{series_id}"
+        self.retention_days = retention_days
+
+        # day -> [min, max, sum, count, newest seq]
+        self.partitions = {}
+        self.newest = None
+        self.seq = 0
+        with self.lock:
+            for (name,) in self.db.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name GLOB ?",
+                (self.prefix + "[0-9]" * 8,),
+            ):
+                day = day_of(calendar.timegm(time.strptime(name[len(self.prefix):], "%Y%m%d")))
+                row = self.db.execute(
+                    f'SELECT MIN(temp_c), MAX(temp_c), SUM(temp_c), COUNT(*), MAX(seq) FROM "{name}"'
+                ).fetchone()
+                if row[3]:
+                    self.partitions[day] = list(row)
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (self.seq_key,)).fetchone()
+            if row:
+                self.seq = row[0]
+            if self.partitions:
+                self.newest = self.db.execute(
+                    f'SELECT ts, temp_c FROM "{self._table(max(self.partitions))}" '
+                    'ORDER BY ts DESC, rowid DESC LIMIT 1'
+                ).fetchone()
+            with self.db:
+                self.db.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{self.rollup_table}" ('
+                    ' tier TEXT NOT NULL, bucket REAL NOT NULL, min REAL, max REAL, sum REAL,'
+                    ' count INTEGER, last_ts REAL, last REAL, PRIMARY KEY (tier, bucket)) WITHOUT ROWID'
+                )
+            self._load_rollups()
+
+    def _table(self, day):
+        """Partition table name for a day number, e.g. readings_1_20260101"""
+        return self.prefix + time.strftime("%Y%m%d", time.gmtime(day * SECONDS_PER_DAY))
+
+    def __len__(self):
+        with self.lock:
+            return sum(p[3] for p in self.partitions.values())
+
+    def extend(self, readings, extremes=()):
+        by_day = {}
+        for ts, temp_c in readings:
+            by_day.setdefault(day_of(ts), []).append((ts, temp_c))
+        if not by_day:
+            return 0
+
+        count = 0
+        with self.lock:
+            # Worked out on copies, and only kept once the transaction commits
+            seq, newest, partitions = self.seq, self.newest, {}
+            late = newest is not None and min(ts for rows in by_day.values() for ts, _ in rows) < newest[0]
+            try:
+                with self.db:
+                    for day, rows in by_day.items():
+                        table = self._table(day)
+                        if day not in self.partitions:
+                            self.db.execute(
+                                f'CREATE TABLE IF NOT EXISTS "{table}" '
+                                '(ts REAL NOT NULL, temp_c REAL NOT NULL, seq INTEGER NOT NULL)'
+                            )
+                            self.db.execute(f'CREATE INDEX IF NOT EXISTS "{table}_ts" ON "{table}" (ts)')
+                            self.db.execute(f'CREATE INDEX IF NOT EXISTS "{table}_seq" ON "{table}" (seq)')
+                        first_seq = seq + 1
+                        seq += len(rows)
+                        self.db.executemany(
+                            f'INSERT INTO "{table}" (ts, temp_c, seq) VALUES (?, ?, ?)',
+                            ((ts, temp_c, first_seq + i) for i, (ts, temp_c) in enumerate(rows)),
+                        )
+
+                        agg = list(self.partitions.get(day, (rows[0][1], rows[0][1], 0.0, 0, 0)))
+                        agg[4] = seq
+                        for ts, temp_c in rows:
+                            agg[0] = min(agg[0], temp_c)
+                            agg[1] = max(agg[1], temp_c)
+                            agg[2] += temp_c
+                            agg[3] += 1
+                            # Equal timestamps: the later arrival is the newest, as in the ring buffer
+                            if newest is None or ts >= newest[0]:
+                                newest = (ts, temp_c)
+                        partitions[day] = agg
+                        count += len(rows)
+                    self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self.seq_key, seq))
+                    if late:
+                        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                        (self.reset_key, seq))
+                    self._save_rollups(self.rollups.extend(
+                        (reading for rows in by_day.values() for reading in rows), extremes))
+                    expired = self._drop_expired(newest, set(self.partitions) | set(partitions))
+            except BaseException:
+                self._load_rollups()  # undo the buckets this write touched
+                raise
+            self.seq, self.newest = seq, newest
+            self.partitions.update(partitions)
+            for day in expired:
+                del self.partitions[day]
+        return count
+
+    def latest(self):
+        with self.lock:
+            if self.newest is None:
+                return None
+            ts, temp_c = self.newest
+        return (ts, temp_c, temp_c * 9/5 + 32)
+
+    def stats(self):
+        with self.lock:
+            aggs = list(self.partitions.values())
+        if not aggs:
+            return None
+        total = sum(a[3] for a in aggs)
+        return {
+            "min": min(a[0] for a in aggs),
+            "max": max(a[1] for a in aggs),
+            "avg": sum(a[2] for a in aggs) / total,
+            "count": total,
+        }
+
+    def recent(self, n):
+        with self.lock:
+            days = sorted(self.partitions, reverse=True)
+        db = self.database.reader()
+        rows = []
+        # Walk back from the newest day until we have n readings
+        for day in days:
+            try:
+                rows.extend(db.execute(
+                    f'SELECT ts, temp_c FROM "{self._table(day)}" ORDER BY ts DESC, rowid DESC LIMIT ?',
+                    (n - len(rows),),
+                ))
+            except sqlite3.OperationalError:
+                continue  # partition created or dropped outside this snapshot
+            if len(rows) >= n:
+                break
+        rows.reverse()
+        return [(ts, temp_c, temp_c * 9/5 + 32) for ts, temp_c in rows]
+
+    def iter_range(self, start=None, end=None):
+        with self.lock:
+            days = sorted(d for d in self.partitions
+                          if (start is None or d >= day_of(start)) and (end is None or d <= day_of(end)))
+        return self._iter_days(days, start, end)
+
+    def changes(self, cursor, limit):
+        db = self.database.reader()
+        # One read transaction, so the cursor and the rows come from the same snapshot
+        db.execute("BEGIN")
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = ?", (self.seq_key,)).fetchone()
+            seq = row[0] if row else 0
+            row = db.execute("SELECT value FROM meta WHERE key = ?", (self.reset_key,)).fetchone()
+            reset_seq = row[0] if row else 0
+            if cursor is not None and reset_seq <= cursor <= seq:
+                # Readings after the cursor can land in any day, so every day written to
+                # after it is checked. Read after the snapshot began: writes commit under
+                # the lock, so these are at least as new as the snapshot.
+                with self.lock:
+                    days = sorted(day for day, agg in self.partitions.items() if agg[4] > cursor)
+                rows = []
+                for day in days:
+                    try:
+                        rows.extend(db.execute(
+                            f'SELECT ts, temp_c FROM "{self._table(day)}" WHERE seq > ? ORDER BY ts, rowid LIMIT ?',
+                            (cursor, limit + 1 - len(rows)),
+                        ))
+                    except sqlite3.OperationalError:
+                        continue  # partition created or dropped outside this snapshot
+                    if len(rows) > limit:
+                        break
+                if len(rows) <= limit:
+                    return seq, [(ts, temp_c, temp_c * 9/5 + 32) for ts, temp_c in rows], False
+            return seq, self.recent(limit), True
+        finally:
+            db.execute("COMMIT")
+
+    def _iter_days(self, days, start, end):
+        db = self.database.reader()
+        low = float("-inf") if start is None else start
+        high = float("inf") if end is None else end
+        for day in days:
+            try:
+                cursor = db.execute(
+                    f'SELECT ts, temp_c FROM "{self._table(day)}" '
+                    'WHERE ts >= ? AND ts <= ? ORDER BY ts, rowid',
+                    (low, high),
+                )
+            except sqlite3.OperationalError:
+                continue  # partition expired while we were iterating
+            for ts, temp_c in cursor:
+                yield (ts, temp_c, temp_c * 9/5 + 32)
+
+    def _load_rollups(self):
+        """Rebuild the in-memory rollups from their table"""
+        self.rollups = Rollups()
+        for tier, bucket, *agg in self.db.execute(f'SELECT * FROM "{self.rollup_table}"'):
+            if tier in self.rollups.by_name:
+                self.rollups.by_name[tier].load(bucket, agg)
+
+    def _save_rollups(self, touched):
+        for name, starts in touched.items():
+            tier = self.rollups.by_name[name]
+            self.db.executemany(
+                f'INSERT OR REPLACE INTO "{self.rollup_table}" VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((name, start, *tier.buckets[start]) for start in starts if start in tier.buckets),
+            )
+            cutoff = tier.cutoff()
+            if cutoff is not None:
+                self.db.execute(f'DELETE FROM "{self.rollup_table}" WHERE tier = ? AND bucket < ?', (name, cutoff))
+
+    def _drop_expired(self, newest, days):
+        """Drop the partitions among days that fall out of retention; returns those days"""
+        cutoff = day_of(newest[0]) - self.retention_days
+        expired = [day for day in days if day < cutoff]
+        for day in expired:
+            self.db.execute(f'DROP TABLE IF EXISTS "{self._table(day)}"')
+        return expired
@@ -0,0 +1,333 @@
+"""
+Reading stores for the temperature API
+ReadingStore is the interface the routes use. The default RingBufferStore
+keeps readings in a fixed-capacity ring buffer of compact float arrays, with
+running sum/count plus monotonic min/max deques so stats are O(1) per request.
+CompressedStore (_compressed_store.py) packs history into compressed blocks,
+SQLiteStore (_sqlite_store.py) keeps history on disk in per-day partitions,
+and _series.py holds one store per device/probe series. Every store also
+maintains rollup buckets (_rollup.py) as readings arrive.
+"""
+
+import math
+import threading
+from array import array
+from collections import deque
+
+from _rollup import Rollups
+
+# Readings copied per lock acquisition when iterating a range of a RingBufferStore
+ITER_PAGE = 4096
+# Snapshot column names of rollup tiers, e.g. "rollup:1m"
+ROLLUP_PREFIX = "rollup:"
+
+
+def rollup_columns(columns):
+    """The rollup tiers in a snapshot's columns, by tier name"""
+    return {name[len(ROLLUP_PREFIX):]: values for name, values in columns.items() if name.startswith(ROLLUP_PREFIX)}
+
+
+class ReadingStore:
+    """Interface shared by the storage backends
+
+    Readings go in as (timestamp, temp_c) pairs, timestamp in epoch seconds,
+    and come out as (timestamp, temp_c, temp_f) tuples in timestamp order.
+    """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def extend(self, readings, extremes=()):
+        """Add (timestamp, temp_c) readings in one write; returns the number stored
+
+        extremes are (timestamp, temp_c, min, max, count) for readings that
+        summarize several samples; only the rollups keep them (see _rollup.py).
+        """
+        raise NotImplementedError
+
+    def latest(self):
+        """Newest reading, or None when empty"""
+        raise NotImplementedError
+
+    def stats(self):
+        """min/max/avg/count over every stored reading, or None when empty"""
+        raise NotImplementedError
+
+    def recent(self, n):
+        """The newest n readings, oldest first"""
+        raise NotImplementedError
+
+    def iter_range(self, start=None, end=None):
+        """Iterate readings with start <= timestamp <= end (None = unbounded), oldest first"""
+        raise NotImplementedError
+
+    def changes(self, cursor, limit):
+        """Readings added after `cursor`, read atomically with the new cursor
+
+        The cursor is a monotonic count of readings ever added. Returns
+        (new_cursor, readings, full). When the store cannot answer
+        incrementally (no or unknown cursor, evicted readings, history
+        rewritten by a late batch, more than `limit` new readings) it returns
+        the newest `limit` readings with full=True instead.
+        """
+        raise NotImplementedError
+
+    def rollup(self, start, end, max_points, tier=None):
+        """Precomputed buckets for [start, end] as (tier, scanned, buckets); see Rollups.query"""
+        with self.lock:
+            return self.rollups.query(start, end, max_points, tier)
+
+    def nbytes(self):
+        """Approximate bytes of reading data held in memory, or None for on-disk stores"""
+        return None
+
+    def snapshot(self):
+        """(seq, columns) for _snapshot.py: named arrays holding the readings and rollups"""
+        with self.lock:
+            seq = self.seq
+            rollups = self.rollups.columns()
+        ts, temp_c = array('d'), array('d')
+        for reading in self.iter_range():
+            ts.append(reading[0])
+            temp_c.append(reading[1])
+        columns = {"ts": ts, "temp_c": temp_c}
+        columns.update((ROLLUP_PREFIX + name, values) for name, values in rollups.items())
+        return seq, columns
+
+    def restore(self, seq, columns):
+        """Load what snapshot() returned into this (empty) store"""
+        if "ts" not in columns:
+            raise ValueError("written by another store backend")
+        self.extend(zip(columns["ts"], columns["temp_c"]))
+        with self.lock:
+            self.rollups.restore(rollup_columns(columns))
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class RingBufferStore(ReadingStore):
+    """Keeps the newest `capacity` readings in timestamp order
+
+    Readings are (timestamp, temp_c) pairs with the timestamp in epoch
+    seconds. Appending is O(1) amortized; a batch older than the newest
+    stored reading (e.g. a replayed backlog) is merged in with an O(n) rebuild.
+    All public methods are safe to call from concurrent request threads.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        # Arrays grow by doubling up to capacity, so idle series stay small
+        initial = min(capacity, 1024)
+        self.ts = array('d', bytes(8 * initial))
+        self.temp_c = array('d', bytes(8 * initial))
+        self.temp_f = array('d', bytes(8 * initial))
+        # Absolute positions: the oldest reading is `start`, the newest `end - 1`
+        self.start = 0
+        self.end = 0
+        self.sum = 0.0
+        self.min_q = deque()  # positions with strictly increasing temps
+        self.max_q = deque()  # positions with strictly decreasing temps
+        # The reading at position p has sequence number p + offset + 1. A late
+        # batch rebuilds the ring, which invalidates cursors before reset_seq.
+        self.seq = 0
+        self.offset = 0
+        self.reset_seq = 0
+        # Rollups outlive the ring: evicting raw readings leaves their buckets alone
+        self.rollups = Rollups()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.end - self.start
+
+    def nbytes(self):
+        """Bytes allocated for the ring's three columns"""
+        return 3 * self.ts.itemsize * len(self.ts)
+
+    def extend(self, readings, extremes=()):
+        """Add (timestamp, temp_c) readings; returns the number stored"""
+        readings = list(readings)
+        if not readings:
+            return 0
+        with self.lock:
+            if len(self) and readings[0][0] < self.ts[(self.end - 1) % self.capacity]:
+                self._merge(readings)
+                self.reset_seq = self.seq + len(readings)
+            else:
+                for ts, temp_c in readings:
+                    self._append(ts, temp_c)
+            self.seq += len(readings)
+            self.offset = self.seq - self.end
+            self.rollups.extend(readings, extremes)
+        return len(readings)
+
+    def latest(self):
+        """Newest reading as (timestamp, temp_c, temp_f), or None when empty"""
+        with self.lock:
+            if not len(self):
+                return None
+            return self._get((self.end - 1) % self.capacity)
+
+    def stats(self):
+        """min/max/avg/count over every stored reading, or None when empty"""
+        with self.lock:
+            count = len(self)
+            if not count:
+                return None
+            return {
+                "min": self.temp_c[self.min_q[0] % self.capacity],
+                "max": self.temp_c[self.max_q[0] % self.capacity],
+                "avg": self.sum / count,
+                "count": count,
+            }
+
+    def recent(self, n):
+        """The newest n readings, oldest first, as (timestamp, temp_c, temp_f)"""
+        with self.lock:
+            first = max(self.start, self.end - n)
+            return [self._get(pos % self.capacity) for pos in range(first, self.end)]
+
+    def iter_range(self, start=None, end=None):
+        with self.lock:
+            first = self.start if start is None else self._bisect(start, right=False)
+            last = self.end if end is None else self._bisect(end, right=True)
+            if end is None and last > first:
+                end = self.ts[(last - 1) % self.capacity]
+            reset_seq = self.reset_seq
+        return self._iter_pages(first, last, start, end, reset_seq)
+
+    def _iter_pages(self, pos, last, start, end, reset_seq):
+        # Copy ITER_PAGE readings at a time under the lock, so a long range neither
+        # blocks writers nor has to be held in memory all at once
+        last_ts = None
+        while pos < last:
+            with self.lock:
+                if self.reset_seq != reset_seq:
+                    # A late batch rebuilt the ring: find our place again by timestamp
+                    reset_seq = self.reset_seq
+                    if last_ts is not None:
+                        pos = self._bisect(last_ts, right=True)
+                    else:
+                        pos = self.start if start is None else self._bisect(start, right=False)
+                    last = self._bisect(end, right=True)
+                pos = max(pos, self.start)  # skip anything evicted meanwhile
+                stop = min(last, self.end, pos + ITER_PAGE)
+                page = [self._get(p % self.capacity) for p in range(pos, stop)]
+            if not page:
+                return
+            pos = stop
+            last_ts = page[-1][0]
+            yield from page
+
+    def snapshot(self):
+        # The columns as they are laid out in memory (unwrapped), plus the min/max
+        # deques, so restore() is a few array copies instead of re-adding every reading
+        with self.lock:
+            count = len(self)
+            slot = self.start % self.capacity
+            columns = {}
+            for name, column in (("ts", self.ts), ("temp_c", self.temp_c), ("temp_f", self.temp_f)):
+                head = column[slot:slot + count]
+                columns[name] = head + column[:count - len(head)] if len(head) < count else head
+            columns["sum"] = array('d', [self.sum])
+            columns["min_q"] = array('q', [pos - self.start for pos in self.min_q])
+            columns["max_q"] = array('q', [pos - self.start for pos in self.max_q])
+            columns.update((ROLLUP_PREFIX + name, values) for name, values in self.rollups.columns().items())
+            return self.seq, columns
+
+    def restore(self, seq, columns):
+        count = len(columns.get("ts", ()))
+        if len(self) or count > self.capacity or "min_q" not in columns:
+            # Written by another backend or with a larger capacity: take the slow path
+            return super().restore(seq, columns)
+        if not count:
+            return
+        with self.lock:
+            self.ts, self.temp_c, self.temp_f = columns["ts"], columns["temp_c"], columns["temp_f"]
+            self.start, self.end = 0, count
+            self.sum = columns["sum"][0]
+            self.min_q = deque(columns["min_q"])
+            self.max_q = deque(columns["max_q"])
+            # Cursors handed out before the snapshot get a full reload
+            self.seq = self.reset_seq = seq
+            self.offset = seq - count
+            self.rollups.restore(rollup_columns(columns))
+
+    def changes(self, cursor, limit):
+        with self.lock:
+            if cursor is not None and self.reset_seq <= cursor <= self.seq:
+                first = cursor - self.offset
+                if first >= self.start and self.end - first <= limit:
+                    return self.seq, [self._get(pos % self.capacity) for pos in range(first, self.end)], False
+            first = max(self.start, self.end - limit)
+            return self.seq, [self._get(pos % self.capacity) for pos in range(first, self.end)], True
+
+    def _bisect(self, ts, right):
+        """First position whose timestamp is >= ts (> ts when right=True)"""
+        lo, hi = self.start, self.end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_ts = self.ts[mid % self.capacity]
+            if mid_ts < ts or (right and mid_ts == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _get(self, slot):
+        return (self.ts[slot], self.temp_c[slot], self.temp_f[slot])
+
+    def _append(self, ts, temp_c):
+        if len(self) == self.capacity:
+            self._evict_oldest()
+
+        pos = self.end
+        slot = pos % self.capacity
+        if slot >= len(self.ts):
+            # Only reachable before the first eviction, while start is still 0
+            grow = min(len(self.ts), self.capacity - len(self.ts))
+            for column in (self.ts, self.temp_c, self.temp_f):
+                column.frombytes(bytes(8 * grow))
+        self.ts[slot] = ts
+        self.temp_c[slot] = temp_c
+        self.temp_f[slot] = temp_c * 9/5 + 32
+        self.sum += temp_c
+        self.end += 1
+
+        while self.min_q and self.temp_c[self.min_q[-1] % self.capacity] >= temp_c:
+            self.min_q.pop()
+        self.min_q.append(pos)
+        while self.max_q and self.temp_c[self.max_q[-1] % self.capacity] <= temp_c:
+            self.max_q.pop()
+        self.max_q.append(pos)
+
+    def _evict_oldest(self):
+        pos = self.start
+        self.sum -= self.temp_c[pos % self.capacity]
+        if self.min_q[0] == pos:
+            self.min_q.popleft()
+        if self.max_q[0] == pos:
+            self.max_q.popleft()
+        self.start += 1
+
+        # Re-sum exactly once per full turn of the ring so float error cannot build up
+        if self.start % self.capacity == 0:
+            self.sum = math.fsum(self.temp_c[pos % self.capacity]
+                                 for pos in range(self.start, self.end))
+
+    def _merge(self, readings):
+        """Slow path for late readings: re-sort everything and rebuild the ring"""
+        merged = [(self.ts[pos % self.capacity], self.temp_c[pos % self.capacity])
+                  for pos in range(self.start, self.end)]
+        merged.extend(readings)
+        # Stable sort, so equal timestamps keep their arrival order
+        merged.sort(key=lambda reading: reading[0])
+
+        self.start = self.end = 0
+        self.sum = 0.0
+        self.min_q.clear()
+        self.max_q.clear()
+        for ts, temp_c in merged[-self.capacity:]:
+            self._append(ts, temp_c)
@@ -0,0 +1,120 @@
+"""
+Compact binary wire format for readings (application/x-temperature-readings)
+Used instead of JSON when a client sends that Content-Type or asks for it in
+Accept. Readings travel as columns per series: epoch milliseconds as int64
+and centi-degrees Celsius as int32, about 12 bytes a reading against ~70 in
+JSON, and decoding is two array copies instead of a dict per reading.
+
+    header  "TR", version (u8), reserved (u8), meta length (u32)
+    meta    UTF-8 JSON object; on ingest only the heartbeat of readings sent on
+            change, as {"heartbeats": [seconds or null per frame]} or one
+            {"heartbeat": seconds} for every frame
+    frames  until the end of the body, each:
+              device id length (u8) + device id, probe id length (u8) + probe id,
+              count (u32), count x int64 epoch ms, count x int32 centi-degrees C
+              version 2 adds count x int32 centi-degrees min, count x int32
+              centi-degrees max and count x u32 samples, for readings that
+              are each the mean of a sampling period (see _rollup.py)
+
+All integers are little-endian. An empty device or probe id means the
+receiver's default. raspberry_pi/wire.py writes the same format.
+"""
+
+import json
+import struct
+import sys
+from array import array
+
+MEDIA_TYPE = "application/x-temperature-readings"
+MAGIC = b"TR"
+VERSION = 1
+SUMMARY_VERSION = 2  # frames also carry each reading's min, max and sample count
+
+_HEADER = struct.Struct("<2sBxI")
+_COUNT = struct.Struct("<I")
+
+
+def encode(meta, frames):
+    """Encode frames of (device, probe, readings); readings yield (timestamp, temp_c, ...)"""
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode() if meta else b""
+    parts = [_HEADER.pack(MAGIC, VERSION, len(meta_bytes)), meta_bytes]
+    for device, probe, readings in frames:
+        ts = array('q', [round(r[0] * 1000) for r in readings])
+        temps = array('i', [round(r[1] * 100) for r in readings])
+        if sys.byteorder == "big":
+            ts.byteswap()
+            temps.byteswap()
+        parts += [_pack_id(device), _pack_id(probe), _COUNT.pack(len(ts)), ts.tobytes(), temps.tobytes()]
+    return b"".join(parts)
+
+
+def decode(body):
+    """Decode a body into (meta, [(device, probe, [(timestamp, temp_c), ...]), ...])
+
+    Device and probe are None when the sender left them empty. Version 2
+    readings are (timestamp, temp_c, min, max, count). Raises ValueError on
+    a malformed body.
+    """
+    body = memoryview(body)
+    if len(body) < _HEADER.size:
+        raise ValueError("Binary body is too short")
+    magic, version, meta_length = _HEADER.unpack_from(body)
+    if magic != MAGIC or version not in (VERSION, SUMMARY_VERSION):
+        raise ValueError("Not a version 1 or 2 binary readings body")
+    width = 24 if version == SUMMARY_VERSION else 12  # bytes per reading
+    offset = _HEADER.size + meta_length
+    if offset > len(body):
+        raise ValueError("Binary body is truncated")
+    meta = json.loads(bytes(body[_HEADER.size:offset])) if meta_length else {}
+    if not isinstance(meta, dict):
+        raise ValueError("Binary meta must be a JSON object")
+
+    frames = []
+    while offset < len(body):
+        device, offset = _unpack_id(body, offset)
+        probe, offset = _unpack_id(body, offset)
+        if offset + _COUNT.size > len(body):
+            raise ValueError("Binary body is truncated")
+        (count,) = _COUNT.unpack_from(body, offset)
+        offset += _COUNT.size
+        end = offset + count * width
+        if end > len(body):
+            raise ValueError("Binary body is truncated")
+        ts = array('q')
+        ts.frombytes(body[offset:offset + count * 8])
+        temps = array('i')
+        temps.frombytes(body[offset + count * 8:offset + count * 12])
+        columns = [ts, temps]
+        if version == SUMMARY_VERSION:
+            low, high, samples = array('i'), array('i'), array('I')
+            low.frombytes(body[offset + count * 12:offset + count * 16])
+            high.frombytes(body[offset + count * 16:offset + count * 20])
+            samples.frombytes(body[offset + count * 20:end])
+            columns += [low, high, samples]
+        if sys.byteorder == "big":
+            for column in columns:
+                column.byteswap()
+        if version == SUMMARY_VERSION:
+            readings = [(t / 1000, c / 100, lo / 100, hi / 100, n) for t, c, lo, hi, n in zip(*columns)]
+        else:
+            readings = [(t / 1000, c / 100) for t, c in zip(ts, temps)]
+        frames.append((device, probe, readings))
+        offset = end
+    return meta, frames
+
+
+def _pack_id(value):
+    encoded = (value or "").encode()
+    if len(encoded) > 255:
+        raise ValueError("Series ids are limited to 255 bytes")
+    return bytes((len(encoded),)) + encoded
+
+
+def _unpack_id(body, offset):
+    if offset >= len(body):
+        raise ValueError("Binary body is truncated")
+    length = body[offset]
+    end = offset + 1 + length
+    if end > len(body):
+        raise ValueError("Binary body is truncated")
+    return (bytes(body[offset + 1:end]).decode() or None), end
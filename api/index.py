@@ -1,7 +1,35 @@
-from flask import Flask, render_template, request, jsonify
+import os
+import sys
+import math
+import atexit
+import functools
+import json
+import time
+import itertools
+import collections
+import threading
+
+# Cold start timing: everything below, Flask included, counts towards time to first byte
+import_started = time.perf_counter()
+from flask import Flask, Response, g, render_template, request, jsonify
 from flask_cors import CORS
 from datetime import datetime, timezone
 
+# Make the helper modules next to this file importable under both `flask run` and Vercel
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# The alert rules engine and metrics are shared with the Pi and live in raspberry_pi/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "raspberry_pi"))
+
+from _series import DEFAULT_DEVICE, DEFAULT_PROBE, open_series_index, validate_series_id
+from _pubsub import LAGGED, Event, Hub
+from _rollup import TIERS as ROLLUP_TIERS, mean, summarize
+from _response_cache import ResponseCache
+from _admission import Admission
+from _held import HeldSeries, parse_heartbeat
+import _wire
+from rules import RulesEngine
+import metrics as _metrics
+
 app = Flask(__name__, static_folder="../static", template_folder="../templates")
 CORS(app)
 
@@ -10,58 +38,948 @@ CORS(app)
 def home():
     return render_template("index.html")
 
-# In-memory store (replace with DB later if you want)
-temperature_data = []
-MAX_READINGS = 50
+# Reading storage, one store per device/probe series: "memory" (ring buffers,
+# kept across restarts by the snapshot below), "compressed" (in-memory
+# Gorilla-style blocks, ~1-2 bytes a reading, so MAX_READINGS can cover
+# months), "sqlite" (day-partitioned file) or "shared" (ring buffers in shared
+# memory, one copy for every worker process on the host, e.g. under gunicorn -w N;
+# SHARED_STORE_NAME names the segments)
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "memory")
+MAX_READINGS = int(os.environ.get("MAX_READINGS", 200_000))  # per series
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "temperature.db")
+SHARED_STORE_NAME = os.environ.get("SHARED_STORE_NAME", "temperature")
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 365))
+# Newest readings returned as `history` by GET /api/temperature
+HISTORY_LIMIT = 50
+# Points returned for a from/to range when max_points is not given, and the ceiling for it
+DEFAULT_MAX_POINTS = 1000
+MAX_POINTS_LIMIT = 10_000
+# Where range queries read from: "auto" uses rollups once a point spans a minute or more
+ROLLUP_SOURCES = ("auto", "raw", "rollup")
+series = open_series_index(STORE_BACKEND, capacity=MAX_READINGS, path=SQLITE_PATH,
+                           retention_days=RETENTION_DAYS, name=SHARED_STORE_NAME)
+
+# The in-memory backends are snapshotted to SNAPSHOT_PATH by a background thread
+# every SNAPSHOT_INTERVAL seconds (when anything was ingested) and at exit, and a
+# new process loads the snapshot before its first request. Off unless
+# SNAPSHOT_PATH is set, except on Vercel, where only /tmp is writable and is kept
+# per instance; point SNAPSHOT_PATH at shared storage to carry data across
+# instances. "" disables.
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "/tmp/temperature.snapshot" if os.environ.get("VERCEL") else "")
+if STORE_BACKEND not in ("memory", "compressed"):
+    # SQLite is its own file, and shared segments outlive the workers: every worker
+    # loading a snapshot into them at start would add its readings once per worker
+    if SNAPSHOT_PATH and "SNAPSHOT_PATH" in os.environ:
+        app.logger.warning("Not snapshotting to %s: the %s store already outlives the process",
+                           SNAPSHOT_PATH, STORE_BACKEND)
+    SNAPSHOT_PATH = ""
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", 60))
+snapshot_lock = threading.Lock()
+snapshot_state = {"generation": 0}  # ingest_generation at the last save
+snapshot_stop = threading.Event()
+# Seconds spent in each cold start phase: import, snapshot, first_request
+startup = {}
+
+# Live stream (Server-Sent Events). Serverless hosts such as Vercel cannot hold
+# connections open, so it defaults to off there and the dashboard polls instead.
+STREAM_ENABLED = os.environ.get("STREAM_ENABLED", "0" if os.environ.get("VERCEL") else "1") == "1"
+STREAM_HEARTBEAT_SECONDS = 15
+# With the shared backend, readings can arrive through another worker and are only
+# seen by checking the store, so streams check it this often
+STREAM_POLL_SECONDS = 1 if STORE_BACKEND == "shared" else STREAM_HEARTBEAT_SECONDS
+# Streams end after this long; EventSource reconnects and resumes from Last-Event-ID
+STREAM_MAX_SECONDS = int(os.environ.get("STREAM_MAX_SECONDS", 300))
+hub = Hub()
+publish_lock = threading.Lock()
+last_published = {}  # series -> cursor of the last event published for it
+
+# Encoded GET responses are reused until a write changes the data behind them
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 256))  # entries; 0 disables
+# Also keep a gzipped copy of each body. Vercel compresses at its edge, so off there by default.
+RESPONSE_GZIP = os.environ.get("RESPONSE_GZIP", "0" if os.environ.get("VERCEL") else "1") == "1"
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, compress=RESPONSE_GZIP)
+# Ingest admission control (see _admission.py): each device may upload
+# INGEST_RATE_PER_DEVICE readings per second on average, in bursts of up to
+# INGEST_BURST, and at most INGEST_MAX_IN_FLIGHT readings are being stored at
+# once. Anything over is answered 429 with Retry-After. 0 turns a limit off.
+INGEST_RATE_PER_DEVICE = float(os.environ.get("INGEST_RATE_PER_DEVICE", 1000))
+INGEST_BURST = int(os.environ.get("INGEST_BURST", 100_000))
+INGEST_MAX_IN_FLIGHT = int(os.environ.get("INGEST_MAX_IN_FLIGHT", 200_000))
+admission = Admission(INGEST_RATE_PER_DEVICE, INGEST_BURST, INGEST_MAX_IN_FLIGHT)
+# Bumped after every ingest in this process; tells save_snapshot whether there is anything new
+ingest_generation = 0
+generation_lock = threading.Lock()
+
+# Alert rules evaluated on ingest: a JSON list of rule dicts (see raspberry_pi/rules.py), e.g.
+# ALERT_RULES='[{"name": "no-data", "type": "stale", "after": 300}]'. Series are
+# named "device" or "device/probe" in a rule's "series" list. State is per process.
+alert_rules = RulesEngine(json.loads(os.environ.get("ALERT_RULES", "[]")))
+# Series uploading in send-on-change (deadband) mode and their heartbeats, per process (see _held.py)
+held = HeldSeries()
+# Most recent rule transitions returned by GET /api/alerts
+ALERT_HISTORY = 200
+alert_events = collections.deque(maxlen=ALERT_HISTORY)
+
+# Metrics served at /metrics in the Prometheus text format; per process, like the
+# in-memory stores. Store sizes are read from the stores when scraped.
+metrics = _metrics.Registry()
+request_count = metrics.counter("http_requests_total", "Requests by route, method and status",
+                                ("route", "method", "status"))
+request_latency = metrics.histogram("http_request_duration_seconds", "Request handling time by route",
+                                    ("route",))
+ingested_readings = metrics.counter("ingest_readings_total", "Readings stored, by upload format", ("format",))
+ingest_batch_size = metrics.histogram("ingest_batch_readings", "Readings per upload",
+                                      buckets=(1, 10, 100, 1000, 5000, 10_000, 100_000))
+query_count = metrics.counter("temperature_queries_total", "GET /api/temperature by mode (live, raw, rollup)",
+                              ("mode",))
+query_scanned = metrics.counter("temperature_query_scanned_total",
+                                "Readings or buckets read to answer range queries", ("mode",))
+serialization_time = metrics.histogram("serialization_seconds", "Time to encode history responses",
+                                       ("format",))
+metrics.gauge("store_readings", "Readings held per series", ("device", "probe"),
+              collect=lambda: [(key, len(store)) for key, store in series.items()])
+metrics.gauge("store_bytes", "Approximate bytes of reading data held in memory per series", ("device", "probe"),
+              collect=lambda: [(key, size) for key, store in series.items()
+                               if (size := store.nbytes()) is not None])
+metrics.counter("store_evicted_readings_total", "Readings dropped for capacity or retention per series",
+                ("device", "probe"), collect=lambda: [(key, store.seq - len(store)) for key, store in series.items()])
+metrics.gauge("store_database_bytes", "Size of the SQLite database file and its WAL",
+              collect=lambda: [((), sum(os.path.getsize(series.database.path + suffix)
+                                       for suffix in ("", "-wal")
+                                       if os.path.exists(series.database.path + suffix)))]
+              if series.database is not None else [])
+metrics.counter("response_cache_total", "Cacheable GETs served from the response cache or rebuilt",
+                ("result",), collect=lambda: [(("hit",), response_cache.hits), (("miss",), response_cache.misses)])
+ingest_rejected = metrics.counter("ingest_rejected_total", "Uploads answered 429, by reason (rate, busy)",
+                                  ("reason",))
+metrics.gauge("ingest_in_flight_readings", "Readings admitted and not yet stored",
+              collect=lambda: [((), admission.in_flight)])
+metrics.gauge("startup_seconds", "Cold start time by phase: import (incl. snapshot), snapshot, first_request",
+              ("phase",), collect=lambda: [((phase,), seconds) for phase, seconds in startup.items()])
+metrics.gauge("alerts_firing", "Alert rules currently firing", collect=lambda: [((), len(alert_rules.active()))])
+
+def load_snapshot():
+    """Fill the stores from SNAPSHOT_PATH if a snapshot is there"""
+    import _snapshot  # only loaded when SNAPSHOT_PATH is set
+    started = time.perf_counter()
+    try:
+        count, readings, written_at = _snapshot.load(SNAPSHOT_PATH, series)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        app.logger.warning("Ignoring snapshot %s: %s", SNAPSHOT_PATH, e)
+        return
+    startup["snapshot"] = time.perf_counter() - started
+    app.logger.info("Loaded %d readings in %d series from a snapshot taken %.0f s ago",
+                    readings, count, time.time() - written_at)
+
+def save_snapshot():
+    """Write a snapshot if anything was ingested since the last one"""
+    with snapshot_lock:
+        if not SNAPSHOT_PATH or snapshot_state["generation"] == ingest_generation:
+            return
+        try:
+            import _snapshot
+            generation = ingest_generation
+            _snapshot.write(SNAPSHOT_PATH, series.items())
+            snapshot_state["generation"] = generation
+        except OSError as e:
+            app.logger.warning("Could not write snapshot %s: %s", SNAPSHOT_PATH, e)
+
+def snapshot_periodically():
+    """Background thread: save every SNAPSHOT_INTERVAL seconds, so no upload waits on the write"""
+    while not snapshot_stop.wait(SNAPSHOT_INTERVAL):
+        save_snapshot()
+
+def save_snapshot_at_exit():
+    snapshot_stop.set()
+    save_snapshot()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Label by URL rule, not path, so ids in URLs cannot grow the label set
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_latency.observe(time.perf_counter() - g.request_started, (route,))
+    if "first_request" not in startup:
+        startup["first_request"] = time.perf_counter() - import_started
+    request_count.inc(1, (route, request.method, str(response.status_code)))
+    return response
+
+def reading_to_json(reading):
+    """Turn a stored (timestamp, temp_c, temp_f) reading into the API's JSON shape"""
+    ts, temp_c, temp_f = reading
+    return {
+        'temperature': temp_c,
+        'timestamp': datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+        'temp_f': temp_f,
+    }
+
+def held_to_json(key, latest):
+    """For a send-on-change series, its heartbeat and until when its latest value holds; else None"""
+    heartbeat = held.heartbeat(key)
+    if heartbeat is None or latest is None:
+        return None
+    return {
+        'heartbeat': heartbeat,
+        'until': datetime.fromtimestamp(latest[0] + heartbeat, timezone.utc).isoformat(),
+    }
+
+def bucket_to_json(start, bucket):
+    """Turn a rollup bucket into a reading-shaped point (mean temperature) plus its aggregates"""
+    point = summarize(bucket)
+    point.update({
+        'temperature': point['mean'],
+        'timestamp': datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        'temp_f': point['mean'] * 9/5 + 32,
+    })
+    return point
+
+def live_payload(key, store, since, cursor, full):
+    """Body shared by live polling responses and stream events, minus the history
+
+    Unless ``full`` is set, history holds the readings after ``since`` up to
+    ``cursor``; clients whose own cursor differs from ``since`` should reload.
+    """
+    latest = store.latest() if store is not None else None
+    return {
+        "device": key[0],
+        "probe": key[1],
+        "current": reading_to_json(latest) if latest else None,
+        "stats": held.stats(key, store),
+        "held": held_to_json(key, latest),
+        "since": since,
+        "cursor": cursor,
+        "full": full,
+    }
+
+def stream_event(key, store, since):
+    """Read a series' changes after `since` and encode them once as an SSE event"""
+    if store is None:
+        cursor, readings, full = 0, [], True
+    else:
+        cursor, readings, full = store.changes(since, HISTORY_LIMIT)
+    payload = live_payload(key, store, since, cursor, full)
+    payload["history"] = [reading_to_json(r) for r in readings]
+    data = json.dumps(payload, separators=(',', ':'))
+    return Event(since, cursor, full, f"id: {cursor}\nevent: reading\ndata: {data}\n\n")
+
+def publish_changes(keys):
+    """Push whatever was ingested since the last publish to each series' stream subscribers"""
+    with publish_lock:
+        for key in keys:
+            if not hub.has_subscribers(key):
+                # Nobody is listening; new subscribers start from their own snapshot
+                last_published.pop(key, None)
+                continue
+            event = stream_event(key, series.get(*key), last_published.get(key))
+            last_published[key] = event.cursor
+            hub.publish(key, event)
+
+def evaluate_alerts(by_series):
+    """Run newly stored readings through the alert rules, remembering any transitions"""
+    if not alert_rules.rules:
+        return
+    for key, readings in by_series.items():
+        hold = held.heartbeat(key) or 0
+        for reading in readings:
+            alert_events.extend(alert_rules.observe(key, reading[0], reading[1], hold))
+    alert_events.extend(alert_rules.tick(time.time()))
+
+def alert_to_json(event):
+    device, probe = event.series
+    return {
+        'rule': event.rule,
+        'device': device,
+        'probe': probe,
+        'firing': event.firing,
+        'timestamp': datetime.fromtimestamp(event.ts, timezone.utc).isoformat(),
+        'temperature': event.value,
+        'message': event.message,
+    }
+
+def wants_wire():
+    """True when the client prefers the binary wire format over JSON"""
+    return request.accept_mimetypes.best_match(['application/json', _wire.MEDIA_TYPE]) == _wire.MEDIA_TYPE
+
+def history_response(body, points, to_json=reading_to_json):
+    """Send body plus history as JSON, or in the binary wire format if the client asks for it
+
+    ``points`` are tuples starting (timestamp, temp_c). In JSON each one goes
+    through ``to_json`` into body["history"]; in binary they form the single
+    frame and the rest of body travels as the meta object.
+    """
+    started = time.perf_counter()
+    if wants_wire():
+        response = Response(_wire.encode(body, [(body["device"], body["probe"], points)]),
+                            mimetype=_wire.MEDIA_TYPE)
+        serialization_time.observe(time.perf_counter() - started, ("wire",))
+    else:
+        body["history"] = [to_json(p) for p in points]
+        response = jsonify(body)
+        serialization_time.observe(time.perf_counter() - started, ("json",))
+    response.vary.add('Accept')
+    return response
+
+def cached(generation):
+    """Serve a GET view from response_cache while generation() is unchanged
+
+    The key is the path, query and response format; only 200s are cached.
+    generation() may raise ValueError for a bad request, which skips the cache.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not RESPONSE_CACHE_SIZE:
+                return view(*args, **kwargs)
+            try:
+                current = generation()
+            except ValueError:
+                return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), wants_wire())
+            hit = response_cache.get(key, current)
+            if hit is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                hit = response_cache.put(key, current, response)
+            return hit.respond()
+        return wrapper
+    return decorate
+
+def series_generation():
+    """The series a request resolves to and its write count, which every write to it bumps"""
+    resolved = series.resolve(*requested_series())
+    return (resolved[0], resolved[1].seq) if resolved else None
+
+def requested_series():
+    """The (device, probe) named by ?device=&probe= (None when absent); raises ValueError"""
+    device = request.args.get('device')
+    probe = request.args.get('probe')
+    if device is not None:
+        device = validate_series_id(device, 'device')
+    if probe is not None:
+        probe = validate_series_id(probe, 'probe')
+    return device, probe
+
+@app.route("/api/stream", methods=["GET"])
+def stream():
+    """Server-Sent Events feed of new readings, stats and the current value
+
+    Takes the same ``device``/``probe`` selection as GET /api/temperature.
+    Each event has the same body as a live GET /api/temperature response and
+    its cursor as the event id, so a reconnecting EventSource resumes from
+    Last-Event-ID. Comment lines are sent as heartbeats while idle.
+    """
+    if not STREAM_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Live stream is not available on this deployment'}), 503
+    try:
+        device, probe = requested_series()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    resolved = series.resolve(device, probe)
+    if resolved is not None:
+        key = resolved[0]
+    else:
+        # Nothing stored yet: wait on the series the query will resolve to once it exists
+        key = (device or DEFAULT_DEVICE, probe or DEFAULT_PROBE)
+
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        cursor = int(last_id) if last_id else None
+    except ValueError:
+        cursor = None
+    # Subscribe before reading the snapshot so nothing published in between is missed
+    subscription = hub.subscribe(key)
+
+    def events(cursor):
+        try:
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            yield "retry: 3000\n\n"
+            event = stream_event(key, series.get(*key), cursor)
+            cursor = event.cursor
+            yield event.text
+
+            last_sent = time.monotonic()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = subscription.get(min(STREAM_POLL_SECONDS, remaining))
+                if event is None:
+                    store = series.get(*key)
+                    if store is not None and store.seq != cursor:
+                        # Written without an event here, e.g. by another worker
+                        event = stream_event(key, store, cursor)
+                        cursor = event.cursor
+                        yield event.text
+                    elif time.monotonic() - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                        yield ": heartbeat\n\n"
+                    else:
+                        continue
+                    last_sent = time.monotonic()
+                elif event is LAGGED or (event.cursor > cursor and event.since != cursor and not event.full):
+                    # Dropped or out-of-order events: catch up from the store instead
+                    event = stream_event(key, series.get(*key), cursor)
+                    cursor = event.cursor
+                    yield event.text
+                elif event.cursor > cursor:
+                    cursor = event.cursor
+                    yield event.text
+                    last_sent = time.monotonic()
+        finally:
+            hub.unsubscribe(key, subscription)
+
+    return Response(events(cursor), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # keep proxies from buffering the stream
+    })
+
+def parse_query_time(value):
+    """Parse a from/to query value (epoch seconds or ISO 8601); None when absent"""
+    if value is None or value == '':
+        return None
+    try:
+        ts = float(value)
+    except ValueError:
+        return parse_timestamp(value)
+    if not math.isfinite(ts):
+        raise ValueError('from/to must be finite')
+    return ts
 
 @app.route("/api/temperature", methods=["GET"])
+@cached(series_generation)
 def temperature():
-    if not temperature_data:
-        return jsonify({"current": None, "history": [], "stats": None})
-
-    curr = temperature_data[-1]["temperature"]
-    vals = [d["temperature"] for d in temperature_data]
-    stats = {
-        "min": min(vals),
-        "max": max(vals),
-        "avg": sum(vals) / len(vals),
-        "count": len(vals),
-    }
+    """Current reading, stats and history
+
+    ``device`` and ``probe`` pick the series (see SeriesIndex.resolve).
+    Without other parameters, history is the newest HISTORY_LIMIT readings.
+    Every live response carries a ``cursor``; with ``?since=<cursor>`` history
+    holds only readings added after it (``full`` is false), and a matching
+    If-None-Match gets 304 Not Modified while nothing new has arrived.
+    With ``from``/``to`` (epoch seconds or ISO 8601), ``max_points``,
+    ``source`` and/or ``tier``,
+    history is that time window, reduced on the server with ``downsample``
+    (``lttb`` or ``minmax``) when it holds more than max_points readings.
+    Windows where each point spans at least a minute are served from the
+    rollup tiers instead (``source=auto``, the default): history is then one
+    point per bucket of the coarsest fine-enough tier, with min/max/mean/
+    count/last. ``source=raw`` or ``source=rollup`` (optionally with
+    ``tier=1m|1h|1d``) forces either path.
+    Clients that accept application/x-temperature-readings (see _wire.py)
+    get history in that binary format, with the other fields as its meta.
+    For a series sent on change, ``held`` gives its heartbeat and until when
+    the current value holds, stats' avg is weighted by how long each value
+    held, and windows downsample with ``minmax`` unless asked otherwise, which
+    keeps the levels of a stepped line; clients should draw it stepped.
+    """
+    try:
+        start = parse_query_time(request.args.get('from'))
+        end = parse_query_time(request.args.get('to'))
+        max_points = request.args.get('max_points')
+        max_points = None if max_points is None else int(max_points)
+        since = request.args.get('since')
+        since = None if since is None else int(since)
+        device, probe = requested_series()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid query parameter: {e}'}), 400
+    source = request.args.get('source', 'auto')
+    tier = request.args.get('tier')
+
+    resolved = series.resolve(device, probe)
+    if resolved is None:
+        key, store = (device or DEFAULT_DEVICE, probe or DEFAULT_PROBE), None
+    else:
+        key, store = resolved
+    method = request.args.get('downsample', 'minmax' if held.heartbeat(key) else 'lttb')
+
+    if start is None and end is None and max_points is None and tier is None and 'source' not in request.args:
+        query_count.inc(1, ("live",))
+        # The cursor changes with every write to the series, so it doubles as the ETag
+        cursor, readings, full = store.changes(since, HISTORY_LIMIT) if store else (0, [], True)
+        if request.if_none_match.contains(str(cursor)):
+            response = app.response_class(status=304)
+            response.vary.add('Accept')
+        else:
+            response = history_response(live_payload(key, store, since, cursor, full), readings)
+        response.set_etag(str(cursor))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    if store is None or not len(store):
+        return history_response({"device": key[0], "probe": key[1], "current": None, "stats": None,
+                                 "held": None}, [])
+
+    # Stats cover everything stored
+    latest = store.latest()
+    current = reading_to_json(latest)
+    stats = held.stats(key, store)
+
+    if max_points is None:
+        max_points = DEFAULT_MAX_POINTS
+    if not 3 <= max_points <= MAX_POINTS_LIMIT:
+        return jsonify({'status': 'error', 'message': f'max_points must be between 3 and {MAX_POINTS_LIMIT}'}), 400
+    # Only range reads downsample, so the live view and uploads never load it
+    from _downsample import METHODS as DOWNSAMPLE_METHODS, downsample
+    if method not in DOWNSAMPLE_METHODS:
+        return jsonify({'status': 'error', 'message': f"downsample must be one of {', '.join(DOWNSAMPLE_METHODS)}"}), 400
+    if source not in ROLLUP_SOURCES:
+        return jsonify({'status': 'error', 'message': f"source must be one of {', '.join(ROLLUP_SOURCES)}"}), 400
+
+    window_end = latest[0] if end is None else end
+    if source == 'rollup' or tier is not None or (
+            source == 'auto' and start is not None
+            and (window_end - start) / max_points >= ROLLUP_TIERS[0].width):
+        try:
+            tier, scanned, buckets = store.rollup(start, window_end, max_points, tier)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        points = [(bucket_start, mean(bucket), bucket) for bucket_start, bucket in buckets]
+        query_count.inc(1, ("rollup",))
+        query_scanned.inc(scanned, ("rollup",))
+        return history_response({
+            "device": key[0],
+            "probe": key[1],
+            "current": current,
+            "stats": stats,
+            "held": held_to_json(key, latest),
+            "range": {
+                "from": start,
+                "to": end,
+                "scanned": scanned,
+                "returned": len(points),
+                "downsample": None,
+                "tier": tier,
+            },
+        }, points, lambda point: bucket_to_json(point[0], point[2]))
+
+    readings = store.iter_range(start, end)
+    # Small windows go out as-is; only read past max_points when we must reduce
+    head = list(itertools.islice(readings, max_points + 1))
+    if len(head) <= max_points:
+        points, scanned = head, len(head)
+    else:
+        window_start = head[0][0] if start is None else start
+        points, scanned = downsample(itertools.chain(head, readings), window_start,
+                                     window_end, max_points, method)
+    query_count.inc(1, ("raw",))
+    query_scanned.inc(scanned, ("raw",))
+
+    return history_response({
+        "device": key[0],
+        "probe": key[1],
+        "current": current,
+        "stats": stats,
+        "held": held_to_json(key, latest),
+        "range": {
+            "from": start,
+            "to": end,
+            "scanned": scanned,
+            "returned": len(points),
+            "downsample": method if scanned > len(points) else None,
+            "tier": None,
+        },
+    }, points)
+
+@app.route("/api/devices", methods=["GET"])
+@cached(lambda: tuple(store.seq for _, store in series.items()))
+def devices():
+    """Every device with its probes, each probe's current reading and stats"""
+    listing = {}
+    for (device, probe), store in series.items():
+        latest = store.latest()
+        listing.setdefault(device, []).append({
+            "probe": probe,
+            "current": reading_to_json(latest) if latest else None,
+            "stats": held.stats((device, probe), store),
+            "held": held_to_json((device, probe), latest),
+        })
+    return jsonify({"devices": [{"device": device, "probes": probes} for device, probes in listing.items()]})
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Server metrics in the Prometheus text format"""
+    return Response(metrics.render(), content_type=_metrics.CONTENT_TYPE)
+
+@app.route("/api/alerts", methods=["GET"])
+def alerts():
+    """Rules currently firing, and the latest transitions newest first"""
+    alert_events.extend(alert_rules.tick(time.time()))
+    return jsonify({
+        'rules': [rule.name for rule in alert_rules.rules],
+        'active': [alert_to_json(event) for event in alert_rules.active()],
+        'recent': [alert_to_json(event) for event in reversed(list(alert_events))],
+    })
+
+# Largest number of readings accepted in one batch POST; binary bodies are
+# ~12 bytes a reading and skip per-item parsing, so bulk loads may send more
+MAX_BATCH_SIZE = 5000
+MAX_BINARY_BATCH_SIZE = 100_000
+# POST /api/import has no size limit; it stores the rows it parses in batches of this many
+IMPORT_BATCH_SIZE = 10_000
+# Device timestamps are refused before 2000-01-01 (a clock that was never set)
+# or further ahead of server time than clock skew explains
+EARLIEST_TIMESTAMP = 946684800
+MAX_CLOCK_SKEW = 300
+
+def parse_timestamp(value):
+    """Parse a device timestamp (ISO 8601 string or epoch seconds) into epoch seconds"""
+    if value is None:
+        return datetime.now(timezone.utc).timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if ts.tzinfo is None:
+        # Naive timestamps are assumed to already be UTC
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+def check_timestamp(ts):
+    """Return a device timestamp if it is plausible; raises ValueError"""
+    if not math.isfinite(ts):
+        raise ValueError('Timestamp must be a finite number')
+    if not EARLIEST_TIMESTAMP <= ts <= time.time() + MAX_CLOCK_SKEW:
+        raise ValueError('Timestamp must be after 2000-01-01 and not in the future')
+    return ts
+
+def check_summary(temp_c, low, high, count):
+    """Validate the min, max and sample count of a reading that is a period's mean; raises ValueError"""
+    if not (math.isfinite(low) and math.isfinite(high)):
+        raise ValueError('min and max must be finite numbers')
+    if not low <= temp_c <= high:
+        raise ValueError('Temperature must lie between min and max')
+    count = float(count)
+    if not (count.is_integer() and count >= 1):
+        raise ValueError('count must be a whole number of samples, at least 1')
+    return low, high, int(count)
+
+def make_reading(item, device, probe):
+    """Validate one incoming item as ((device, probe), (timestamp, temp_c))
+
+    device_id/probe_id on the item override the batch-level ones passed in.
+    An item with ``min``/``max``/``count`` (the extremes and number of
+    samples it is the mean of) gives (timestamp, temp_c, min, max, count).
+    """
+    if not isinstance(item, dict) or item.get('temperature') is None:
+        raise ValueError('No temperature data provided')
+    temp_c = float(item['temperature'])
+    if not math.isfinite(temp_c):
+        raise ValueError('Temperature must be a finite number')
+    if 'device_id' in item:
+        device = validate_series_id(item['device_id'], 'device_id')
+    if 'probe_id' in item:
+        probe = validate_series_id(item['probe_id'], 'probe_id')
+    reading = (check_timestamp(parse_timestamp(item.get('timestamp'))), temp_c)
+    if any(item.get(name) is not None for name in ('min', 'max', 'count')):
+        reading += check_summary(temp_c,
+                                 temp_c if item.get('min') is None else float(item['min']),
+                                 temp_c if item.get('max') is None else float(item['max']),
+                                 1 if item.get('count') is None else item['count'])
+    return (device, probe), reading
 
-    reading = {}
-    if curr is not None:
-        # Add timestamp and store the reading
-        reading = {
-            'temperature': float(curr),
-            'timestamp': datetime.now(timezone.utc).isoformat(),
-            'temp_f': float(curr) * 9/5 + 32  # Also store Fahrenheit
-        }
-    return jsonify({"current": reading, "history": temperature_data, "stats": stats})
+def file_reading(by_series, extremes, key, reading):
+    """Group a validated reading under its series; a summary's extremes also go to extremes for the rollups"""
+    if len(reading) > 2:
+        extremes.setdefault(key, []).append(reading)
+        reading = reading[:2]
+    by_series.setdefault(key, []).append(reading)
+
+def store_readings(by_series, count, fmt, heartbeats=None, extremes=None):
+    """Store validated readings grouped by series, then notify streams, alerts and caches
+
+    heartbeats, when given, is {series: heartbeat or None} for the uploaded series;
+    extremes is {series: [(timestamp, temp_c, min, max, count), ...]} (see file_reading).
+    """
+    # Before the write, so nothing cached for the new data misses the heartbeat
+    if heartbeats is not None:
+        held.update(heartbeats)
+    for key, readings in by_series.items():
+        series.get_or_create(*key).extend(readings, extremes.get(key, ()) if extremes else ())
+    with generation_lock:
+        global ingest_generation
+        ingest_generation += 1
+    ingested_readings.inc(count, (fmt,))
+    ingest_batch_size.observe(count)
+    publish_changes(by_series)
+    evaluate_alerts(by_series)
+
+def throttled(rejection, **extra):
+    """429 response for an upload refused by admission control; extra fields go in the body"""
+    ingest_rejected.inc(1, (rejection.reason,))
+    response = jsonify({'status': 'error', 'message': rejection.message,
+                        'retry_after': round(rejection.retry_after, 3), **extra})
+    response.headers['Retry-After'] = str(max(1, math.ceil(rejection.retry_after)))
+    return response, 429
 
 @app.route('/api/receive_temperature', methods=['POST'])
 def receive_temperature():
-    """Endpoint to receive temperature data"""
+    """Endpoint to receive temperature data
+
+    Accepts either a single reading, ``{"temperature": 21.5, "timestamp": "..."}``,
+    or a batch, ``{"readings": [{"temperature": ..., "timestamp": ...}, ...]}``.
+    Device timestamps are kept; readings without one are stamped with server time.
+    Timestamps before 2000 or minutes ahead of the server's clock are refused.
+    A batch stores its valid readings and lists the rest as ``rejected``,
+    ``[{"index": i, "error": "..."}, ...]``, next to ``accepted``; it is
+    only a 400 when none could be stored, or the batch-level fields are bad.
+    ``device_id``/``probe_id`` tag the series, on the body or on each reading;
+    untagged readings go to the default series.
+    A body of Content-Type application/x-temperature-readings (see _wire.py)
+    is read as binary frames instead, with the meta object's device_id/
+    probe_id as the defaults for frames that leave theirs empty.
+    A reading that is the mean of a sampling period may add that period's
+    ``min``, ``max`` and sample ``count`` (version 2 binary frames carry
+    them as columns); the rollups keep them, so spikes survive into charts.
+    ``heartbeat`` (seconds; on the body, the meta or each reading) marks
+    readings sent on change: each holds until the next (see _held.py). The
+    meta can instead give ``heartbeats``, one per frame (null for none). A
+    series uploaded without one goes back to every reading counting once.
+    Uploads over a device's rate limit, or arriving while the server is busy
+    storing others, get a 429 with Retry-After and are not stored; clients
+    should wait that long and send the readings again, batched.
+    """
+    rejection = admission.saturated()
+    if rejection:
+        return throttled(rejection)
+    if request.mimetype == _wire.MEDIA_TYPE:
+        try:
+            meta, frames = _wire.decode(request.get_data())
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        data = meta
+        count = sum(len(readings) for _, _, readings in frames)
+        limit = MAX_BINARY_BATCH_SIZE
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
+        items = data.get('readings')
+        single = items is None
+        if single:
+            items = [data]
+        elif not isinstance(items, list) or not items:
+            return jsonify({'status': 'error', 'message': 'readings must be a non-empty list'}), 400
+        count = len(items)
+        limit = MAX_BATCH_SIZE
+    if not count:
+        return jsonify({'status': 'error', 'message': 'readings must be a non-empty list'}), 400
+    if count > limit:
+        return jsonify({'status': 'error', 'message': f'Batch exceeds {limit} readings'}), 413
+
+    # Batch-level fields are checked first: a bad one refuses the whole upload
     try:
-        data = request.get_json()
-        temp_c = data.get('temperature')
-        reading = {}
-        if temp_c is not None:
-            # Add timestamp and store the reading
-            reading = {
-                'temperature': float(temp_c), #same as value
-                'timestamp': datetime.now(timezone.utc).isoformat(),
-                'temp_f': float(temp_c) * 9/5 + 32,
-            }
-            
-            temperature_data.append(reading)
-            
-            # Keep only the last MAX_READINGS
-            if len(temperature_data) > MAX_READINGS:
-                temperature_data.pop(0)
-            
-            return jsonify({'status': 'success', 'message': 'Temperature recorded'})
-        else:
-            return jsonify({'status': 'error', 'message': 'No temperature data provided'}), 400
-        
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        device = validate_series_id(data.get('device_id', DEFAULT_DEVICE), 'device_id')
+        probe = validate_series_id(data.get('probe_id', DEFAULT_PROBE), 'probe_id')
+        heartbeat = data.get('heartbeat')
+        heartbeat = None if heartbeat is None else parse_heartbeat(heartbeat)
+        if request.mimetype == _wire.MEDIA_TYPE:
+            frame_heartbeats = data.get('heartbeats')
+            if frame_heartbeats is None:
+                frame_heartbeats = [heartbeat] * len(frames)
+            elif not isinstance(frame_heartbeats, list) or len(frame_heartbeats) != len(frames):
+                raise ValueError('heartbeats must list one per frame')
+            else:
+                frame_heartbeats = [None if h is None else parse_heartbeat(h) for h in frame_heartbeats]
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # Then each reading: bad ones are reported back by index and the rest stored
+    by_series, heartbeats, extremes, rejected = {}, {}, {}, []
+    if request.mimetype == _wire.MEDIA_TYPE:
+        index = 0
+        for (frame_device, frame_probe, readings), frame_heartbeat in zip(frames, frame_heartbeats):
+            first, index = index, index + len(readings)
+            try:
+                key = (validate_series_id(frame_device, 'device_id') if frame_device else device,
+                       validate_series_id(frame_probe, 'probe_id') if frame_probe else probe)
+            except ValueError as e:
+                rejected += [{'index': i, 'error': str(e)} for i in range(first, index)]
+                continue
+            summaries = bool(readings) and len(readings[0]) > 2
+            try:
+                # int64 milliseconds are always finite, so the extremes usually cover the frame
+                if readings:
+                    check_timestamp(min(readings)[0])
+                    check_timestamp(max(readings)[0])
+                valid = not summaries
+            except ValueError:
+                valid = False
+            if not valid:
+                kept = []
+                for i, reading in enumerate(readings, first):
+                    try:
+                        check_timestamp(reading[0])
+                        if summaries:
+                            check_summary(*reading[1:])
+                    except ValueError as e:
+                        rejected.append({'index': i, 'error': str(e)})
+                        continue
+                    kept.append(reading)
+                readings = kept
+            if summaries and readings:
+                # Version 2 frames: the extremes go to the rollups, the means to the store
+                extremes.setdefault(key, []).extend(readings)
+                readings = [reading[:2] for reading in readings]
+            if readings:
+                by_series.setdefault(key, []).extend(readings)
+                heartbeats[key] = frame_heartbeat
+    else:
+        for i, item in enumerate(items):
+            try:
+                key, reading = make_reading(item, device, probe)
+                item_heartbeat = parse_heartbeat(item['heartbeat']) if item.get('heartbeat') is not None else heartbeat
+            except (TypeError, ValueError) as e:
+                if single:
+                    return jsonify({'status': 'error', 'message': str(e)}), 400
+                rejected.append({'index': i, 'error': str(e)})
+                continue
+            file_reading(by_series, extremes, key, reading)
+            heartbeats[key] = item_heartbeat
+    accepted = count - len(rejected)
+    if not accepted:
+        return jsonify({'status': 'error', 'message': f"All {count} readings were rejected: {rejected[0]['error']}",
+                        'accepted': 0, 'rejected': rejected}), 400
+
+    per_device = collections.Counter()
+    for (key_device, _), readings in by_series.items():
+        per_device[key_device] += len(readings)
+    rejection = admission.admit(per_device)
+    if rejection:
+        return throttled(rejection)
+    try:
+        store_readings(by_series, accepted, "binary" if request.mimetype == _wire.MEDIA_TYPE else "json",
+                       heartbeats, extremes)
+    except Exception:
+        app.logger.exception("Storing %d readings failed", accepted)
+        return jsonify({'status': 'error', 'message': 'Readings could not be stored'}), 500
+    finally:
+        admission.release(accepted)
+    if rejected:
+        return jsonify({'status': 'success', 'message': f'{accepted} temperatures recorded, {len(rejected)} rejected',
+                        'count': accepted, 'accepted': accepted, 'rejected': rejected})
+    if count == 1:
+        return jsonify({'status': 'success', 'message': 'Temperature recorded'})
+    return jsonify({'status': 'success', 'message': f'{count} temperatures recorded', 'count': count})
+
+@app.route("/api/export", methods=["GET"])
+def export():
+    """Stream stored readings as CSV or NDJSON
+
+    ``format`` is ``csv`` (the default) or ``ndjson``; ``from``/``to`` bound
+    the time range as in /api/temperature. ``device`` and ``probe`` narrow
+    the export to one device or one series, otherwise every series is
+    included, one after another. Rows are read from the stores and sent a
+    chunk at a time, so memory stays flat however long the range is.
+    ``gzip=1`` sends a gzip file instead. POST /api/import reads the result.
+    """
+    try:
+        start = parse_query_time(request.args.get('from'))
+        end = parse_query_time(request.args.get('to'))
+        device, probe = requested_series()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid query parameter: {e}'}), 400
+    import _export  # only needed here and in imports, so not loaded on cold start
+    fmt = request.args.get('format', 'csv')
+    if fmt not in _export.FORMATS:
+        return jsonify({'status': 'error', 'message': f"format must be one of {', '.join(_export.FORMATS)}"}), 400
+
+    selected = [(key, store) for key, store in series.items()
+                if (device is None or key[0] == device) and (probe is None or key[1] == probe)]
+    if not selected and device is not None:
+        return jsonify({'status': 'error', 'message': 'No such device or probe'}), 404
+
+    # iter_range is only called as the generator reaches each series
+    frames = ((key[0], key[1], store.iter_range(start, end)) for key, store in selected)
+    body = _export.encode(frames, fmt)
+    filename = f"temperature-{device or 'all'}{'-' + probe if probe else ''}.{fmt}"
+    mimetype = _export.FORMATS[fmt]
+    if request.args.get('gzip') == '1':
+        body = _export.gzip_chunks(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/import', methods=['POST'])
+def import_readings():
+    """Bulk load readings from a CSV or NDJSON body in the shape /api/export writes
+
+    The format comes from the Content-Type (text/csv or application/x-ndjson)
+    or ``?format=``; a ``Content-Encoding: gzip`` body is decompressed on the
+    fly. Rows without device_id/probe_id go to ``?device=&probe=``, or the
+    default series. The body is parsed as it arrives and stored every
+    IMPORT_BATCH_SIZE rows, so there is no size limit, but unlike
+    receive_temperature an import is not all-or-nothing: on a bad row the
+    batches before it stay stored and the response gives their ``count``.
+    Each batch goes through admission control like an upload, charged per
+    reading to its devices; a refused batch ends the import with a 429 whose
+    ``count`` is the rows stored before it, so the rest can be sent again
+    after Retry-After.
+    """
+    import gzip
+    import _export
+    fmt = _export.format_for(request.mimetype) or request.args.get('format')
+    if fmt not in _export.FORMATS:
+        return jsonify({'status': 'error', 'message': 'Send text/csv or application/x-ndjson'}), 415
+    try:
+        device, probe = requested_series()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid query parameter: {e}'}), 400
+    device = device or DEFAULT_DEVICE
+    probe = probe or DEFAULT_PROBE
+    rejection = admission.saturated()
+    if rejection:
+        return throttled(rejection, count=0)
+
+    def store_batch(by_series, extremes, count):
+        per_device = collections.Counter()
+        for (key_device, _), readings in by_series.items():
+            per_device[key_device] += len(readings)
+        rejection = admission.admit(per_device)
+        if rejection is None:
+            try:
+                store_readings(by_series, count, fmt, extremes=extremes)
+            finally:
+                admission.release(count)
+        return rejection
+
+    stream = request.stream
+    if request.content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    imported = 0
+    by_series, extremes, pending = {}, {}, 0
+    try:
+        for line, item in _export.parse(stream, fmt):
+            try:
+                key, reading = make_reading(item, device, probe)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f'line {line}: {e}') from None
+            file_reading(by_series, extremes, key, reading)
+            pending += 1
+            if pending >= IMPORT_BATCH_SIZE:
+                rejection = store_batch(by_series, extremes, pending)
+                if rejection:
+                    return throttled(rejection, count=imported)
+                imported += pending
+                by_series, extremes, pending = {}, {}, 0
+        if pending:
+            rejection = store_batch(by_series, extremes, pending)
+            if rejection:
+                return throttled(rejection, count=imported)
+            imported += pending
+    except (ValueError, OSError, EOFError) as e:
+        # OSError/EOFError: a corrupt or truncated gzip body
+        return jsonify({'status': 'error', 'message': str(e), 'count': imported}), 400
+    return jsonify({'status': 'success', 'message': f'{imported} temperatures imported', 'count': imported})
+
+if SNAPSHOT_PATH:
+    load_snapshot()
+    threading.Thread(target=snapshot_periodically, name="snapshot", daemon=True).start()
+    atexit.register(save_snapshot_at_exit)
+startup["import"] = time.perf_counter() - import_started
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the API's ingest and query hot paths
+
+    python benchmarks/run.py [--quick] [--backends memory,compressed,sqlite] [--output FILE]
+    python benchmarks/run.py --compare before.json after.json
+
+Runs api/index.py in-process: Flask's test client for per-request costs and
+a local threaded WSGI server for concurrent ingest. Covers ingest throughput,
+GET latency as stored history grows, stats, JSON serialization and memory
+per reading, plus the cold start of a fresh process, with and without a
+snapshot to load, against COLD_START_TARGET_MS. Results are written as JSON (by default to
+benchmarks/results/<UTC time>.json) so runs can be compared with --compare.
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import random
+import argparse
+import logging
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "raspberry_pi"))
+
+# Benchmark stores must not be saved to, or loaded from, a snapshot, and
+# uploads must not be rate limited: the benchmarks measure the stores
+os.environ["SNAPSHOT_PATH"] = ""
+os.environ["INGEST_RATE_PER_DEVICE"] = "0"
+
+import requests
+import index
+import _snapshot
+import _wire
+from _series import open_series_index
+
+BACKENDS = ("memory", "compressed", "sqlite", "shared")
+HISTORY_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+QUICK_HISTORY_SIZES = (1_000, 10_000, 100_000)
+CONCURRENCY = (1, 4, 16)
+# Time from the start of importing api/index.py to the first response being ready
+COLD_START_TARGET_MS = 500
+# Run in a fresh interpreter: import the app, serve one request, report index.startup
+COLD_START_CHILD = ("import json, index; index.app.test_client().get('/api/temperature'); "
+                    "print(json.dumps(index.startup))")
+
+
+def synthetic_readings(count, start=None, interval=1.0, seed=0):
+    """(timestamp, temp_c) pairs one `interval` apart ending now, with a daily cycle and noise"""
+    rng = random.Random(seed)
+    start = time.time() - count * interval if start is None else start
+    return [(start + i * interval, round(22 + 5 * math.sin(i * interval / 13751) + rng.gauss(0, 0.3), 2))
+            for i in range(count)]
+
+
+def timed(fn, repeat):
+    """Run fn `repeat` times; returns per-call seconds, sorted"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples
+
+
+def latency_ms(samples):
+    """median/p95/min of sorted per-call seconds, in milliseconds"""
+    def at(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+    return {"median": at(0.5), "p95": at(0.95), "min": round(samples[0] * 1000, 3), "runs": len(samples)}
+
+
+class Backend:
+    """A fresh series index for one storage backend, installed into the app"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.tmpdir = tempfile.mkdtemp(prefix="bench-") if name == "sqlite" else None
+        path = os.path.join(self.tmpdir, "bench.db") if self.tmpdir else None
+        self.index = open_series_index(name, capacity=capacity, path=path, name=f"bench-{os.getpid()}")
+
+    def __enter__(self):
+        self.previous = index.series
+        index.series = self.index
+        index.last_published.clear()
+        return self.index
+
+    def __exit__(self, *exc):
+        index.series = self.previous
+        if self.name == "shared":
+            self.index.directory.unlink()
+        self.index.close()
+        if self.tmpdir:
+            for name in os.listdir(self.tmpdir):
+                os.remove(os.path.join(self.tmpdir, name))
+            os.rmdir(self.tmpdir)
+
+
+def json_body(readings, device="bench"):
+    return {"device_id": device, "readings": [{"temperature": t, "timestamp": ts} for ts, t in readings]}
+
+
+def bench_ingest(backend, quick):
+    """Readings/s and request latency through the test client for each payload shape"""
+    client = index.app.test_client()
+    total = 20_000 if quick else 100_000
+    shapes = {
+        "json_single": (1, lambda batch: client.post("/api/receive_temperature", json={
+            "device_id": "bench", "temperature": batch[0][1], "timestamp": batch[0][0]})),
+        "json_batch_500": (500, lambda batch: client.post(
+            "/api/receive_temperature", json=json_body(batch))),
+        "binary_batch_5000": (5000, lambda batch: client.post(
+            "/api/receive_temperature", data=_wire.encode({}, [("bench", "0", batch)]),
+            content_type=_wire.MEDIA_TYPE)),
+    }
+    results = {}
+    for shape, (size, post) in shapes.items():
+        count = min(total, 2000) if size == 1 else total
+        readings = synthetic_readings(count)
+        with Backend(backend, capacity=count):
+            samples = []
+            started = time.perf_counter()
+            for i in range(0, count, size):
+                t = time.perf_counter()
+                response = post(readings[i:i + size])
+                samples.append(time.perf_counter() - t)
+                assert response.status_code == 200, response.get_data(as_text=True)
+            elapsed = time.perf_counter() - started
+        samples.sort()
+        results[shape] = {
+            "readings": count,
+            "readings_per_s": round(count / elapsed),
+            "request_latency_ms": latency_ms(samples),
+        }
+    return results
+
+
+def bench_concurrent_ingest(backend, quick):
+    """Requests/s and latency with N client threads against a local threaded WSGI server"""
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no line per request
+    duration = 1.5 if quick else 5.0
+    results = {}
+    for concurrency in CONCURRENCY:
+        with Backend(backend, capacity=1_000_000):
+            server = make_server("127.0.0.1", 0, index.app, threaded=True)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = f"http://127.0.0.1:{server.server_port}/api/receive_temperature"
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+            deadline = time.perf_counter() + duration
+
+            def client(worker):
+                session = requests.Session()
+                mine = []
+                failed = 0
+                readings = synthetic_readings(100, seed=worker)
+                body = json_body(readings, device=f"bench-{worker}")
+                while time.perf_counter() < deadline:
+                    t = time.perf_counter()
+                    if session.post(url, json=body).status_code != 200:
+                        failed += 1
+                    mine.append(time.perf_counter() - t)
+                with lock:
+                    latencies.extend(mine)
+                    errors[0] += failed
+
+            started = time.perf_counter()
+            workers = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            server.shutdown()
+        latencies.sort()
+        results[f"c{concurrency}"] = {
+            "concurrency": concurrency,
+            "requests_per_s": round(len(latencies) / elapsed, 1),
+            "readings_per_s": round(len(latencies) * 100 / elapsed),
+            "errors": errors[0],
+            "request_latency_ms": latency_ms(latencies),
+        }
+    return results
+
+
+def bench_queries(backend, sizes, quick):
+    """GET latency and stats() cost as the stored history grows"""
+    client = index.app.test_client()
+    repeat = 10 if quick else 30
+    results = {}
+    for size in sizes:
+        readings = synthetic_readings(size)
+        with Backend(backend, capacity=size) as series:
+            store = series.get_or_create("bench", "0")
+            for i in range(0, size, 50_000):
+                store.extend(readings[i:i + 50_000])
+            start = datetime.fromtimestamp(readings[0][0], timezone.utc).isoformat()
+            end = datetime.fromtimestamp(readings[-1][0], timezone.utc).isoformat()
+            range_query = {"device": "bench", "from": start, "to": end}
+            queries = {
+                "live": ("/api/temperature", {"device": "bench"}),
+                "range_raw_1000_points": ("/api/temperature", dict(range_query, source="raw")),
+                "range_rollup_1000_points": ("/api/temperature", dict(range_query, source="rollup")),
+                "devices": ("/api/devices", {}),
+            }
+            entry = {}
+            for name, (path, params) in queries.items():
+                def get():
+                    response = client.get(path, query_string=params)
+                    assert response.status_code == 200, response.get_data(as_text=True)
+                entry[name] = latency_ms(timed(get, repeat))
+            entry["stats"] = latency_ms(timed(store.stats, repeat))
+        results[str(size)] = entry
+    return results
+
+
+def bench_serialization(quick):
+    """Cost of turning readings into the API's JSON, per reading"""
+    results = {}
+    for count in (1_000, 10_000) if quick else (1_000, 10_000, 100_000):
+        stored = [(ts, t, t * 9/5 + 32) for ts, t in synthetic_readings(count)]
+        with index.app.app_context():
+            to_dicts = timed(lambda: [index.reading_to_json(r) for r in stored], 5)
+            dicts = [index.reading_to_json(r) for r in stored]
+            dumps = timed(lambda: index.jsonify({"history": dicts}).get_data(), 5)
+        wire = timed(lambda: _wire.encode({}, [(None, None, stored)]), 5)
+        results[str(count)] = {
+            "reading_to_json_us_per_reading": round(to_dicts[len(to_dicts) // 2] / count * 1e6, 3),
+            "jsonify_us_per_reading": round(dumps[len(dumps) // 2] / count * 1e6, 3),
+            "wire_encode_us_per_reading": round(wire[len(wire) // 2] / count * 1e6, 3),
+        }
+    return results
+
+
+def bench_memory(backend, quick):
+    """Bytes held per stored reading (file bytes for sqlite)"""
+    count = 100_000 if quick else 1_000_000
+    readings = synthetic_readings(count)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    with Backend(backend, capacity=count) as series:
+        store = series.get_or_create("bench", "0")
+        for i in range(0, count, 50_000):
+            store.extend(readings[i:i + 50_000])
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        result = {"readings": count, "heap_bytes_per_reading": round(held / count, 2)}
+        if backend == "sqlite":
+            path = series.database.path
+            size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+            result["file_bytes_per_reading"] = round(size / count, 2)
+    return result
+
+
+def bench_cold_start(quick):
+    """Import, snapshot load and first response of a fresh process, empty and with a full snapshot"""
+    count = 100_000 if quick else 200_000
+    tmpdir = tempfile.mkdtemp(prefix="bench-")
+    path = os.path.join(tmpdir, "bench.snapshot")
+    snapshot_index = open_series_index("memory", capacity=count)
+    snapshot_index.get_or_create("bench", "0").extend(synthetic_readings(count))
+    _snapshot.write(path, snapshot_index.items())
+
+    results = {"target_ms": COLD_START_TARGET_MS}
+    for label, snapshot in (("empty", ""), ("snapshot", path)):
+        env = dict(os.environ, SNAPSHOT_PATH=snapshot, STORE_BACKEND="memory", MAX_READINGS=str(count))
+        runs = []
+        for _ in range(3 if quick else 7):
+            started = time.perf_counter()
+            child = subprocess.run([sys.executable, "-c", COLD_START_CHILD], cwd=os.path.join(ROOT, "api"),
+                                   env=env, capture_output=True, text=True, check=True)
+            runs.append((time.perf_counter() - started, json.loads(child.stdout)))
+        runs.sort(key=lambda run: run[1]["first_request"])
+        wall, startup = runs[len(runs) // 2]
+        results[label] = {
+            "readings": count if snapshot else 0,
+            "process_ms": round(wall * 1000, 1),
+            "import_ms": round(startup["import"] * 1000, 1),
+            "snapshot_ms": round(startup.get("snapshot", 0) * 1000, 1),
+            "first_request_ms": round(startup["first_request"] * 1000, 1),
+        }
+    os.remove(path)
+    os.rmdir(tmpdir)
+
+    worst = results["snapshot"]["first_request_ms"]
+    results["within_target"] = worst <= COLD_START_TARGET_MS
+    if not results["within_target"]:
+        print(f"⚠️  Cold start with a snapshot took {worst} ms, over the {COLD_START_TARGET_MS} ms target")
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(backends, quick):
+    sizes = QUICK_HISTORY_SIZES if quick else HISTORY_SIZES
+    results = {"environment": environment(), "quick": quick, "backends": {}}
+    for backend in backends:
+        print(f"⏱  {backend}: ingest", flush=True)
+        entry = {"ingest": bench_ingest(backend, quick)}
+        print(f"⏱  {backend}: concurrent ingest", flush=True)
+        entry["concurrent_ingest"] = bench_concurrent_ingest(backend, quick)
+        print(f"⏱  {backend}: queries at {', '.join(f'{s:,}' for s in sizes)} readings", flush=True)
+        entry["queries"] = bench_queries(backend, sizes, quick)
+        print(f"⏱  {backend}: memory", flush=True)
+        entry["memory"] = bench_memory(backend, quick)
+        results["backends"][backend] = entry
+    print("⏱  serialization", flush=True)
+    results["serialization"] = bench_serialization(quick)
+    print("⏱  cold start", flush=True)
+    results["cold_start"] = bench_cold_start(quick)
+    return results
+
+
+def flatten(tree, prefix=""):
+    """{"a.b.c": number} for every number in nested results"""
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(before_path, after_path):
+    """Print every metric present in both result files with its relative change"""
+    with open(before_path) as f:
+        before = flatten(json.load(f))
+    with open(after_path) as f:
+        after = flatten(json.load(f))
+    print(f"{'metric':<90} {'before':>12} {'after':>12} {'change':>8}")
+    for name in sorted(before.keys() & after.keys()):
+        if name.startswith("environment.") or name.rsplit(".", 1)[-1] in ("runs", "readings", "concurrency"):
+            continue
+        old, new = before[name], after[name]
+        change = f"{(new - old) / old:+.0%}" if old else ""
+        print(f"{name:<90} {old:>12g} {new:>12g} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the temperature API")
+    parser.add_argument("--quick", action="store_true",
+                        help="smaller histories and shorter runs (up to 100,000 readings)")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help=f"comma list of store backends (default: {','.join(BACKENDS)})")
+    parser.add_argument("--output", default=None,
+                        help="results file (default: benchmarks/results/<UTC time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two results files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend '{backend}'")
+    results = run(backends, args.quick)
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
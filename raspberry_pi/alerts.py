@@ -0,0 +1,208 @@
+"""
+Background email alerts
+AlertDispatcher sends alert emails from its own thread so the sampling loop
+never waits on a mail server. It keeps one authenticated SMTP session open
+between emails, folds every alert raised during the cooldown into a single
+digest email, and retries failed sends with exponential backoff.
+"""
+
+import time
+import random
+import smtplib
+import threading
+import collections
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+# One alert: when it was raised, its email subject and a one-line message
+Alert = collections.namedtuple("Alert", "when subject message")
+
+# Alerts listed individually in a digest; the rest are only counted
+DIGEST_MAX_LINES = 50
+
+
+class AlertDispatcher:
+    """Sends alerts by email on a background thread
+
+    raise_alert() only queues. The first alert goes out right away; any
+    raised within cooldown_minutes of an email are held and sent together
+    as one digest when the cooldown ends. A failed send is retried with
+    backoff (the pending alerts are kept) and the SMTP session is rebuilt.
+    Sessions idle for longer than idle_timeout seconds are closed.
+    """
+
+    def __init__(self, smtp_server, smtp_port, sender, password, recipients,
+                 cooldown_minutes=30, starttls=True, timeout=10,
+                 backoff=5.0, max_backoff=600.0, idle_timeout=240.0, max_pending=10_000):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.sender = sender
+        self.password = password
+        # Accept "a@x.com, b@y.com" as in email_config.EMAIL_RECIPIENT
+        if isinstance(recipients, str):
+            recipients = [r.strip() for r in recipients.split(',') if r.strip()]
+        self.recipients = list(recipients)
+        self.cooldown = cooldown_minutes * 60
+        self.starttls = starttls
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+
+        self.pending = collections.deque(maxlen=max_pending)
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        self.session = None
+        self.session_used = None
+        self.last_sent = None  # monotonic time of the last email
+
+        # Counters, updated under self.cond
+        self.sent = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="alerts", daemon=True)
+        self.thread.start()
+        return self
+
+    def raise_alert(self, subject, message, when=None):
+        """Queue an alert; never blocks on the network"""
+        with self.cond:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(Alert(when or datetime.now(), subject, message))
+            self.cond.notify()
+
+    def stop(self, timeout=10):
+        """Try to send what is pending (ignoring the cooldown) and stop the thread"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        delay = self.backoff
+        try:
+            while True:
+                with self.cond:
+                    alerts = self._wait_for_due()
+                if alerts is None:
+                    return
+                if not alerts:
+                    self._close_session()  # idle too long; servers drop these anyway
+                    continue
+                try:
+                    self._send(alerts)
+                except (smtplib.SMTPException, OSError) as e:
+                    self._close_session()
+                    with self.cond:
+                        self.failed_attempts += 1
+                        # Put them back in order, ahead of anything raised meanwhile
+                        self.pending.extendleft(reversed(alerts))
+                        if self.stopping:
+                            return
+                    print(f"❌ Failed to send email alert ({len(alerts)} pending): {e}")
+                    with self.cond:
+                        self.cond.wait_for(lambda: self.stopping,
+                                           timeout=delay * random.uniform(0.5, 1.5))
+                    delay = min(delay * 2, self.max_backoff)
+                    continue
+                delay = self.backoff
+                with self.cond:
+                    self.sent += 1
+                    self.last_sent = time.monotonic()
+                print(f"🔥 EMAIL ALERT SENT: {alerts[-1].subject}"
+                      + (f" (digest of {len(alerts)})" if len(alerts) > 1 else ""))
+        finally:
+            self._close_session()
+
+    def _wait_for_due(self):
+        """Block until alerts may be sent and take them all
+
+        Returns [] when the open session has been idle for idle_timeout,
+        and None once stopped with nothing pending.
+        """
+        while True:
+            if self.stopping:
+                return self._take() if self.pending else None
+            now = time.monotonic()
+            if self.pending:
+                remaining = 0 if self.last_sent is None else self.last_sent + self.cooldown - now
+                if remaining <= 0:
+                    return self._take()
+                self.cond.wait(remaining)
+            elif self.session is not None:
+                idle = self.session_used + self.idle_timeout - now
+                if idle <= 0:
+                    return []
+                self.cond.wait(idle)
+            else:
+                self.cond.wait()
+
+    def _take(self):
+        alerts = list(self.pending)
+        self.pending.clear()
+        return alerts
+
+    def _send(self, alerts):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = ', '.join(self.recipients)
+        if len(alerts) == 1:
+            msg['Subject'] = alerts[0].subject
+            body = alerts[0].message
+        else:
+            msg['Subject'] = f"{alerts[-1].subject} (+{len(alerts) - 1} more)"
+            body = format_digest(alerts)
+        msg.attach(MIMEText(body, 'plain'))
+        self._smtp().sendmail(self.sender, self.recipients, msg.as_string())
+        self.session_used = time.monotonic()
+
+    def _smtp(self):
+        """The open SMTP session, reconnecting if it is missing or went stale"""
+        if self.session is not None:
+            try:
+                self.session.noop()
+                return self.session
+            except (smtplib.SMTPException, OSError):
+                self._close_session()
+        session = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                session.starttls()
+            if self.password:
+                session.login(self.sender, self.password)
+        except Exception:
+            session.close()
+            raise
+        self.session = session
+        return session
+
+    def _close_session(self):
+        if self.session is None:
+            return
+        try:
+            self.session.quit()
+        except (smtplib.SMTPException, OSError):
+            self.session.close()
+        self.session = None
+
+
+def format_digest(alerts):
+    """Body of a digest email: a summary line, then one line per alert"""
+    first, last = alerts[0].when, alerts[-1].when
+    lines = [
+        f"{len(alerts)} alerts between {first.strftime('%Y-%m-%d %H:%M:%S')} "
+        f"and {last.strftime('%Y-%m-%d %H:%M:%S')}:",
+        "",
+    ]
+    for alert in alerts[:DIGEST_MAX_LINES]:
+        lines.append(f"[{alert.when.strftime('%H:%M:%S')}] {alert.subject}")
+    if len(alerts) > DIGEST_MAX_LINES:
+        lines.append(f"... and {len(alerts) - DIGEST_MAX_LINES} more")
+    lines += ["", "Latest alert:", alerts[-1].message]
+    return "\n".join(lines)
@@ -8,15 +8,29 @@ EMAIL_PASSWORD = "xijs wzcu hdoy tvvc"  # Gmail App Password
 EMAIL_RECIPIENT = "14ericfeng@gmail.com"
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 587
+SMTP_STARTTLS = True  # Set to False for a local test server (e.g. python -m aiosmtpd -n -l localhost:1025)
 
 # Temperature Alert Settings
 TEMP_THRESHOLD_C = 30.0  # Temperature threshold in Celsius
-EMAIL_COOLDOWN_MINUTES = 30  # Minutes between email alerts
+EMAIL_COOLDOWN_MINUTES = 30  # Minutes between email alerts; alerts in between arrive as one digest
+ALERT_HYSTERESIS_C = 1.0  # An alert clears once the temperature drops this far below the threshold
+
+# Alert rules (see rules.py). None alerts on TEMP_THRESHOLD_C only; set a list to use your own:
+ALERT_RULES = None
+# ALERT_RULES = [
+#     {"name": "overheat", "type": "threshold", "above": 30.0, "clear_below": 29.0},
+#     {"name": "freezing", "type": "threshold", "below": 2.0, "clear_above": 3.0, "series": ["0"]},
+#     {"name": "fast-rise", "type": "rate", "window": 300, "rise": 5.0},
+#     {"name": "warm-10min", "type": "sustained", "above": 28.0, "for": 600},
+#     {"name": "probe-fault", "type": "stale", "after": 60},  # no good reading for a minute
+# ]
 
 # Notes:
 # 1. For Gmail, you need to use an "App Password" instead of your regular password
 #    - Go to Google Account settings > Security > 2-Step Verification > App passwords
 #    - Generate a new app password for this application
 # 2. The temperature threshold is in Celsius (30.0 = 86°F)
-# 3. Email alerts have a cooldown period to prevent spam
-# 4. You can add multiple recipients by separating with commas: "email1@example.com,email2@example.com"
+# 3. Email alerts have a cooldown period to prevent spam; alerts raised during it
+#    are collected and sent as a single digest email when it ends
+# 4. Rules email once when they fire and once when they clear, not on every reading
+# 5. You can add multiple recipients by separating with commas: "email1@example.com,email2@example.com"
@@ -0,0 +1,277 @@
+"""
+Fleet load generator
+Simulates many devices uploading at once from one asyncio loop over a pooled
+set of keep-alive connections. Arrivals are open-loop: every upload is due at
+a scheduled time whether or not earlier ones have returned, so a struggling
+server shows up as latency and errors instead of quietly lowering the request
+rate, and latency is measured from when the upload was due.
+
+The one exception is the server asking devices to slow down: a device that
+gets a 429 holds its readings until the Retry-After has passed and then
+sends everything held in one larger upload, as the Pi's uploader does.
+
+Run through sample_data_generator.py --fleet N. Needs aiohttp
+(pip install aiohttp), which nothing else on the Pi uses.
+"""
+
+import json
+import time
+import random
+import asyncio
+import collections
+from datetime import datetime, timedelta, timezone
+from uploader import MAX_BATCH_SIZE, make_reading, retry_after
+from wire import MEDIA_TYPE as BINARY_MEDIA_TYPE, encode_readings
+
+# Imported on first use so the rest of raspberry_pi/ never needs it
+aiohttp = None
+
+# One simulated device: its series ids, uploads per second and TemperatureSimulator
+Device = collections.namedtuple("Device", "device_id probe_id rate simulator")
+
+
+def percentile(ordered, p):
+    """p-th percentile (0-100) of a sorted list, nearest-rank"""
+    if not ordered:
+        return None
+    rank = max(1, round(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class FleetStats:
+    """Latencies and outcomes of every upload in a run"""
+
+    def __init__(self):
+        self.latencies = []  # seconds from due time to response, successful uploads only
+        self.errors = collections.Counter()  # "HTTP 503", "timeout", exception name
+        self.throttled = 0  # 429s; their readings are held and sent again, so not errors
+        self.readings = 0
+        self.max_lag = 0.0  # how late the generator itself fired an upload
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def ok(self):
+        return len(self.latencies)
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        ordered = sorted(self.latencies)
+        failed = sum(self.errors.values())
+        total = self.ok + failed + self.throttled
+
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "requests": total,
+            "ok": self.ok,
+            "errors": dict(self.errors),
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "throttled": self.throttled,
+            "requests_per_s": round(self.ok / elapsed, 1) if elapsed else 0.0,
+            "readings_per_s": round(self.readings / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": ms(percentile(ordered, 50)),
+                "p95": ms(percentile(ordered, 95)),
+                "p99": ms(percentile(ordered, 99)),
+                "max": ms(ordered[-1] if ordered else None),
+                "mean": ms(sum(ordered) / len(ordered) if ordered else None),
+            },
+            "max_generator_lag_ms": ms(self.max_lag),
+        }
+
+
+def due_times(rate, duration, arrivals, rng):
+    """Offsets in seconds from the start at which a device's uploads are due
+
+    The first falls at random within one interval so a fleet started
+    together does not arrive in lockstep.
+    """
+    interval = 1.0 / rate
+    due = rng.uniform(0, interval)
+    while due < duration:
+        yield due
+        due += rng.expovariate(rate) if arrivals == "poisson" else interval
+
+
+def make_batch(device, mode, batch_size, now, previous=None):
+    """batch_size fresh readings from one device, sampled evenly since its previous batch
+
+    The newest is stamped `now`. previous is when the device's last batch
+    was made; without one the batch spans the device's nominal interval.
+    """
+    span = (now - previous).total_seconds() if previous is not None else 1.0 / device.rate
+    step = timedelta(seconds=span / batch_size)
+    return [make_reading(device.simulator.next_temperature(mode), now - (batch_size - 1 - i) * step,
+                         device.device_id, device.probe_id)
+            for i in range(batch_size)]
+
+
+def build_body(readings, encoding):
+    """(body bytes, content type) for one upload of readings"""
+    if encoding == "binary":
+        return encode_readings(readings), BINARY_MEDIA_TYPE
+    payload = readings[0] if len(readings) == 1 else {"readings": readings}
+    return json.dumps(payload).encode(), "application/json"
+
+
+class Backlog:
+    """Readings a throttled device is holding, and when it may send again"""
+
+    def __init__(self):
+        self.readings = []
+        self.due = None  # when the oldest held reading was due
+        self.resume_at = 0.0
+
+    def hold(self, readings, due):
+        """Keep new readings until the device may send again"""
+        self.readings.extend(readings)
+        self.due = due if self.due is None else min(self.due, due)
+
+    def put_back(self, readings, due):
+        """Return a throttled upload's readings, which are older than any held since"""
+        self.readings[:0] = readings
+        self.due = due if self.due is None else min(self.due, due)
+
+    def take(self, readings, due):
+        """Held readings plus new ones, up to MAX_BATCH_SIZE, and when the oldest was due"""
+        self.hold(readings, due)
+        batch, self.readings = self.readings[:MAX_BATCH_SIZE], self.readings[MAX_BATCH_SIZE:]
+        due, self.due = self.due, (self.due if self.readings else None)
+        return batch, due
+
+
+async def upload(session, endpoint, readings, encoding, due, stats, backlog):
+    loop = asyncio.get_running_loop()
+    body, content_type = build_body(readings, encoding)
+    try:
+        async with session.post(endpoint, data=body, headers={"Content-Type": content_type}) as response:
+            await response.read()
+            if response.status == 429:
+                stats.throttled += 1
+                backlog.put_back(readings, due)
+                backlog.resume_at = max(backlog.resume_at, loop.time() + retry_after(response))
+                return
+            if response.status != 200:
+                stats.errors[f"HTTP {response.status}"] += 1
+                return
+    except asyncio.TimeoutError:
+        stats.errors["timeout"] += 1
+        return
+    except aiohttp.ClientError as e:
+        stats.errors[type(e).__name__] += 1
+        return
+    stats.latencies.append(loop.time() - due)
+    stats.readings += len(readings)
+
+
+async def run_device(session, endpoint, device, start, duration, mode, batch_size, arrivals,
+                     encoding, stats, rng, max_flushes=5):
+    """Fire one device's uploads on schedule without waiting for responses
+
+    While throttled, due readings are held and go out with the next upload.
+    Readings still held at the end are flushed, waiting out Retry-After up
+    to max_flushes times.
+    """
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+    backlog = Backlog()
+
+    def send(readings, due):
+        task = asyncio.ensure_future(upload(session, endpoint, readings, encoding, due, stats, backlog))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    previous = None  # when the last batch was made
+    for offset in due_times(device.rate, duration, arrivals, rng):
+        due = start + offset
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            stats.max_lag = max(stats.max_lag, -delay)
+        made = datetime.now(timezone.utc)
+        readings = make_batch(device, mode, batch_size, made, previous)
+        previous = made
+        if loop.time() < backlog.resume_at:
+            backlog.hold(readings, due)
+        else:
+            send(*backlog.take(readings, due))
+    for _ in range(max_flushes):
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        if not backlog.readings:
+            break
+        await asyncio.sleep(max(0, backlog.resume_at - loop.time()))
+        while backlog.readings:
+            send(*backlog.take([], backlog.due))
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+
+async def report_progress(stats, every=5.0):
+    last_ok = 0
+    while True:
+        await asyncio.sleep(every)
+        ordered = sorted(stats.latencies[last_ok:])
+        p95 = percentile(ordered, 95)
+        print(f"  {time.monotonic() - stats.started:6.1f}s: {stats.ok} ok, {sum(stats.errors.values())} errors, "
+              f"{stats.throttled} throttled, "
+              f"{(stats.ok - last_ok) / every:.1f} req/s"
+              + (f", p95 {p95 * 1000:.1f} ms" if p95 is not None else ""))
+        last_ok = stats.ok
+
+
+async def run_fleet_async(endpoint, devices, duration, mode="realistic", batch_size=1,
+                          arrivals="fixed", connections=100, encoding="json", timeout=10.0, seed=None):
+    """Upload from every device for `duration` seconds over at most `connections` connections"""
+    global aiohttp
+    if aiohttp is None:
+        try:
+            import aiohttp
+        except ImportError:
+            raise SystemExit("❌ Fleet mode needs aiohttp: pip install aiohttp") from None
+
+    rng = random.Random(seed)
+    stats = FleetStats()
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        stats.started = time.monotonic()
+        progress = asyncio.ensure_future(report_progress(stats))
+        try:
+            await asyncio.gather(*(
+                run_device(session, endpoint, device, start, duration, mode, batch_size, arrivals,
+                           encoding, stats, random.Random(rng.random()))
+                for device in devices
+            ))
+        finally:
+            progress.cancel()
+        stats.finished = time.monotonic()
+    return stats
+
+
+def run_fleet(endpoint, devices, duration, **options):
+    """Run a load test to completion and return its FleetStats (see run_fleet_async)"""
+    return asyncio.run(run_fleet_async(endpoint, devices, duration, **options))
+
+
+def print_summary(summary):
+    latency = summary["latency_ms"]
+    print("\n📊 Fleet results")
+    print(f"   Requests: {summary['requests']} in {summary['elapsed_s']:.1f}s "
+          f"({summary['requests_per_s']} ok/s, {summary['readings_per_s']} readings/s)")
+    print(f"   Errors: {summary['error_rate'] * 100:.2f}%"
+          + (f" {summary['errors']}" if summary["errors"] else ""))
+    if summary["throttled"]:
+        print(f"   Throttled: {summary['throttled']} uploads answered 429 and sent again later")
+    if latency["p50"] is not None:
+        print(f"   Latency: p50 {latency['p50']} ms, p95 {latency['p95']} ms, "
+              f"p99 {latency['p99']} ms, max {latency['max']} ms")
+    if summary["max_generator_lag_ms"] > 50:
+        print(f"   ⚠️  The generator fell up to {summary['max_generator_lag_ms']} ms behind schedule; "
+              "results understate the offered load")
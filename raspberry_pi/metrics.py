@@ -0,0 +1,199 @@
+"""
+Metrics in the Prometheus text format
+Counters, gauges and histograms cheap enough to leave on: histogram buckets
+are preallocated, so an observation is one bisect and two adds under a
+lock, and values that already exist elsewhere (queue depths, store sizes)
+are read by a collect function only when scraped. api/index.py serves them
+at /metrics; test.py on the Pi through serve() or write_textfile().
+"""
+
+import os
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast in-memory request to a slow upload
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """A named metric, with one child per combination of label values
+
+    collect, if given, is called at scrape time and returns
+    [(label values, value), ...] instead of values recorded with labels().
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """The child for these label values, created on first use"""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return [0.0]
+
+    def inc(self, amount=1, values=()):
+        """Add to the value for these label values"""
+        child = self.labels(*values)
+        with self.lock:
+            child[0] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.collect is not None:
+            for values, value in self.collect():
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(value)}")
+            return lines
+        with self.lock:
+            children = [(values, list(child)) for values, child in self.children.items()]
+        for values, child in children:
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(child[0])}")
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+
+class Gauge(Metric):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, values=()):
+        child = self.labels(*values)
+        with self.lock:
+            child[0] = value
+
+
+class Histogram(Metric):
+    """Counts of observations per bucket, plus their sum and count
+
+    Each child is [count per bucket (last is +Inf), sum], allocated once.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return [[0] * (len(self.buckets) + 1), 0.0]
+
+    def observe(self, value, values=()):
+        child = self.labels(*values)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            child[0][slot] += 1
+            child[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            children = [(values, list(child[0]), child[1]) for values, child in self.children.items()]
+        for values, counts, total in children:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics a process exposes, rendered in registration order"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=(), collect=None):
+        return self._register(Counter(name, help, labelnames, collect))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry, port, host="0.0.0.0"):
+    """Answer GET /metrics on a background thread; returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes every few seconds would flood the console
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def write_textfile(registry, path):
+    """Write the metrics to a file atomically (e.g. for node_exporter's textfile collector)"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,286 @@
+"""
+Incremental alert rules
+Rules are declared as dicts and evaluated one reading at a time, each in
+O(1) (amortized) with a few numbers of state per rule and series, so any
+number of rules and series can be checked on ingest without rescanning
+history. Used by test.py on the Pi and by api/index.py on the server.
+
+    {"name": "overheat", "type": "threshold", "above": 30, "clear_below": 29}
+    {"name": "freezing", "type": "threshold", "below": 2, "clear_above": 3}
+    {"name": "fast-rise", "type": "rate", "window": 300, "rise": 5}
+    {"name": "warm-10min", "type": "sustained", "above": 28, "for": 600}
+    {"name": "no-data", "type": "stale", "after": 120}
+
+Every rule may also name the series it applies to with "series": [...];
+by default it applies to all of them. Names must be unique; an unnamed rule
+is called after its type and place in the list, e.g. "stale-3". The engine reports transitions only
+(firing, then resolved), never a repeat of the current state.
+
+A series reporting in send-on-change (deadband) mode is silent while its
+value holds, for up to its heartbeat; observe() takes that as `hold` and
+stale rules then wait `after` seconds past the heartbeat.
+"""
+
+import threading
+import collections
+
+# A rule changed state for a series: firing=True when it starts, False when it clears
+Event = collections.namedtuple("Event", "rule series firing ts value message")
+
+
+class ThresholdRule:
+    """Fires past a limit and clears only once back past a separate clear level
+
+    The gap between the two (hysteresis) stops a reading that hovers around
+    the limit from firing and clearing over and over.
+    """
+
+    def __init__(self, name, above=None, below=None, clear_below=None, clear_above=None, series=None):
+        if (above is None) == (below is None):
+            raise ValueError(f"Rule '{name}': give exactly one of above/below")
+        self.name = name
+        self.series = series
+        self.above = above
+        self.below = below
+        self.clear = (clear_below if clear_below is not None else above) if above is not None \
+            else (clear_above if clear_above is not None else below)
+
+    def new_state(self):
+        return [False]
+
+    def observe(self, state, ts, value):
+        if self.above is not None:
+            firing = value >= self.above if not state[0] else value >= self.clear
+            detail = f"{value:.2f} °C (limit {self.above:g} °C, clears below {self.clear:g} °C)"
+        else:
+            firing = value <= self.below if not state[0] else value <= self.clear
+            detail = f"{value:.2f} °C (limit {self.below:g} °C, clears above {self.clear:g} °C)"
+        state[0] = firing
+        return firing, detail
+
+
+class RateRule:
+    """Fires when the temperature moves by `rise` (or `drop`) degrees within `window` seconds
+
+    Monotonic deques keep the window's minimum and maximum, so each reading
+    is O(1) amortized. Clears once the change falls to `clear` (half the
+    limit by default).
+    """
+
+    def __init__(self, name, window, rise=None, drop=None, clear=None, series=None):
+        if (rise is None) == (drop is None):
+            raise ValueError(f"Rule '{name}': give exactly one of rise/drop")
+        self.name = name
+        self.series = series
+        self.window = window
+        self.limit = rise if rise is not None else drop
+        self.rising = rise is not None
+        self.clear = clear if clear is not None else self.limit / 2
+
+    def new_state(self):
+        # [firing, deque of (ts, value) with increasing values, ... decreasing values]
+        return [False, collections.deque(), collections.deque()]
+
+    def observe(self, state, ts, value):
+        lows, highs = state[1], state[2]
+        while lows and lows[-1][1] >= value:
+            lows.pop()
+        lows.append((ts, value))
+        while highs and highs[-1][1] <= value:
+            highs.pop()
+        highs.append((ts, value))
+        cutoff = ts - self.window
+        while lows[0][0] < cutoff:
+            lows.popleft()
+        while highs[0][0] < cutoff:
+            highs.popleft()
+
+        change = value - lows[0][1] if self.rising else highs[0][1] - value
+        state[0] = change >= (self.clear if state[0] else self.limit)
+        direction = "rose" if self.rising else "fell"
+        return state[0], f"{direction} {change:.2f} °C within {self.window:g} s (limit {self.limit:g} °C)"
+
+
+class SustainedRule:
+    """Fires once the temperature has stayed above (or below) a level for `for` seconds"""
+
+    def __init__(self, name, above=None, below=None, series=None, **kwargs):
+        if (above is None) == (below is None):
+            raise ValueError(f"Rule '{name}': give exactly one of above/below")
+        if "for" not in kwargs:
+            raise ValueError(f"Rule '{name}': 'for' (seconds) is required")
+        self.name = name
+        self.series = series
+        self.above = above
+        self.below = below
+        self.duration = kwargs["for"]
+
+    def new_state(self):
+        return [None]  # when the condition started holding
+
+    def observe(self, state, ts, value):
+        holds = value > self.above if self.above is not None else value < self.below
+        if not holds:
+            state[0] = None
+            return False, f"{value:.2f} °C"
+        if state[0] is None:
+            state[0] = ts
+        held = ts - state[0]
+        level = f"above {self.above:g}" if self.above is not None else f"below {self.below:g}"
+        return held >= self.duration, f"{level} °C for {held:.0f} s (now {value:.2f} °C)"
+
+
+class StaleRule:
+    """Fires when a series sends nothing for `after` seconds; clears on its next reading
+
+    A series that holds its value for up to `hold` seconds between readings
+    gets `after` seconds past that. Series are kept in order of their
+    newest timestamp per hold, so tick() only looks at the ones that are
+    actually overdue, even when replayed readings arrive out of order.
+    """
+
+    def __init__(self, name, after, series=None):
+        self.name = name
+        self.series = series
+        self.after = after
+        self.last_seen = {}  # hold -> OrderedDict of series -> ts, oldest first
+        self.holds = {}  # series -> hold it last reported with
+
+    def touch(self, series, ts, hold=0):
+        previous = self.holds.get(series)
+        if previous is not None and previous != hold:
+            del self.last_seen[previous][series]
+        self.holds[series] = hold
+        seen = self.last_seen.setdefault(hold, collections.OrderedDict())
+        newest = seen[next(reversed(seen))] if seen else ts
+        # An older reading replayed late does not make the series look quieter
+        ts = max(ts, seen.get(series, ts))
+        seen[series] = ts
+        seen.move_to_end(series)
+        if ts < newest:
+            # Out of timestamp order (spool replay, backfill): sort it into place.
+            # The rest is still in order, so this is a single merge.
+            self.last_seen[hold] = collections.OrderedDict(sorted(seen.items(), key=lambda item: item[1]))
+
+    def overdue(self, now):
+        """(series, last ts) for series silent for more than `after` seconds past their hold"""
+        for hold, seen in self.last_seen.items():
+            for series, ts in seen.items():
+                if now - ts <= hold + self.after:
+                    break
+                yield series, ts
+
+
+RULE_TYPES = {
+    "threshold": ThresholdRule,
+    "rate": RateRule,
+    "sustained": SustainedRule,
+    "stale": StaleRule,
+}
+
+
+def make_rule(spec, index=1):
+    """Build a rule from its declarative dict; raises ValueError on a bad spec
+
+    index is the rule's 1-based place in its list, which names unnamed rules.
+    """
+    spec = dict(spec)
+    kind = spec.pop("type", None)
+    if kind not in RULE_TYPES:
+        raise ValueError(f"Unknown rule type '{kind}'; expected one of {', '.join(RULE_TYPES)}")
+    spec.setdefault("name", f"{kind}-{index}")
+    try:
+        return RULE_TYPES[kind](**spec)
+    except TypeError as e:
+        raise ValueError(f"Rule '{spec['name']}': {e}") from None
+
+
+def applies(rule, series):
+    """Whether a rule's "series" list covers a series key
+
+    Keys are probe ids on the Pi and (device, probe) on the server, where
+    the list may name a whole device or "device/probe".
+    """
+    if rule.series is None:
+        return True
+    if isinstance(series, tuple):
+        return series[0] in rule.series or "/".join(series) in rule.series
+    return str(series) in rule.series
+
+
+class RulesEngine:
+    """Evaluates rules per series as readings arrive
+
+    observe() takes readings in time order per series; readings older than
+    the last one seen for that series are ignored. Call tick() periodically
+    to catch stale series. Thread-safe. Raises ValueError when two rules
+    share a name, since firing state is kept by name.
+    """
+
+    def __init__(self, rules):
+        self.rules = [rule if hasattr(rule, "observe") else make_rule(rule, index)
+                      for index, rule in enumerate(rules, 1)]
+        names = collections.Counter(rule.name for rule in self.rules)
+        duplicates = [name for name, count in names.items() if count > 1]
+        if duplicates:
+            raise ValueError(f"Rule names must be unique: {', '.join(duplicates)}")
+        self.states = {}  # series -> [last ts, [(rule, state) for the rules that apply]]
+        self.firing = {}  # (rule name, series) -> firing Event
+        self.lock = threading.Lock()
+
+    def observe(self, series, ts, value, hold=0):
+        """Evaluate one reading; returns the list of transitions it caused
+
+        hold is how long the series may stay silent while its value holds
+        (its heartbeat in send-on-change mode), 0 when it reports every reading.
+        """
+        events = []
+        with self.lock:
+            entry = self.states.get(series)
+            if entry is None:
+                entry = self.states[series] = [
+                    None,
+                    [(rule, None if isinstance(rule, StaleRule) else rule.new_state())
+                     for rule in self.rules if applies(rule, series)],
+                ]
+            elif ts < entry[0]:
+                return events
+            entry[0] = ts
+            for rule, state in entry[1]:
+                was_firing = (rule.name, series) in self.firing
+                if state is None:
+                    rule.touch(series, ts, hold)
+                    if was_firing:
+                        self._transition(events, rule, series, False, ts, value,
+                                         f"reporting again ({value:.2f} °C)")
+                    continue
+                firing, message = rule.observe(state, ts, value)
+                if firing != was_firing:
+                    self._transition(events, rule, series, firing, ts, value, message)
+        return events
+
+    def tick(self, now):
+        """Check stale rules against the current time; returns the transitions"""
+        events = []
+        with self.lock:
+            for rule in self.rules:
+                if not isinstance(rule, StaleRule):
+                    continue
+                for series, last_ts in list(rule.overdue(now)):
+                    if (rule.name, series) not in self.firing:
+                        self._transition(events, rule, series, True, now, None,
+                                         f"no readings for {now - last_ts:.0f} s")
+        return events
+
+    def active(self):
+        """Events for every rule currently firing"""
+        with self.lock:
+            return list(self.firing.values())
+
+    def _transition(self, events, rule, series, firing, ts, value, message):
+        event = Event(rule.name, series, firing, ts, value, message)
+        if firing:
+            self.firing[(rule.name, series)] = event
+        else:
+            del self.firing[(rule.name, series)]
+        events.append(event)
@@ -6,13 +6,14 @@ without requiring actual MAX6675 thermocouple hardware.
 """
 
 import time
-import requests
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 import sys
 import signal
 import random
 import math
+import argparse
+from uploader import MAX_BATCH_SIZE, SENT, THROTTLED, Deadband, ReadingBatcher, deliver, make_reading
 
 # Flask server configuration
 #FLASK_SERVER_URL = "http://localhost:5000"
@@ -21,6 +22,7 @@ API_ENDPOINT = f"{FLASK_SERVER_URL}/api/receive_temperature"
 
 # Global variables
 running = True
+upload_encoding = "json"  # or "binary" (--binary)
 
 def signal_handler(sig, frame):
     """Handle graceful shutdown on Ctrl+C"""
@@ -38,6 +40,7 @@ class TemperatureSimulator:
         self.noise_amplitude = 0.5  # Random noise amplitude
         self.daily_variation = 5.0  # Daily temperature swing
         self.trend_factor = 0.0  # Gradual warming/cooling trend
+        self.demo_step = 0  # Position in the demo mode's warm/cool cycle
         
     def get_temperature(self):
         """Generate a realistic temperature reading"""
@@ -58,47 +61,50 @@ class TemperatureSimulator:
         
         return round(temperature, 2)
     
+    def get_temperatures(self, offsets, rng):
+        """Vectorized get_temperature(): readings at many time offsets (seconds) at once
+
+        offsets is a NumPy array and rng a numpy.random.Generator; the model
+        is the same daily cycle, noise and trend, without rounding.
+        """
+        import numpy as np
+        hours = offsets / 3600.0
+        return (self.base_temp
+                + np.sin(hours) * self.daily_variation
+                + rng.normal(0, self.noise_amplitude, len(offsets))
+                + self.trend_factor * hours)
+    
     def get_random_temperature(self, min_temp=15.0, max_temp=35.0):
         """Generate a random temperature within a range"""
         return round(random.uniform(min_temp, max_temp), 2)
+    
+    def next_temperature(self, mode="realistic"):
+        """Next reading for a simulation mode: realistic, random or demo"""
+        if mode == "random":
+            return self.get_random_temperature()
+        if mode == "demo":
+            # Demo mode: create interesting patterns
+            self.demo_step += 1
+            if self.demo_step < 20:
+                return 20 + (self.demo_step * 0.5)  # Warming up
+            if self.demo_step < 40:
+                return 30 - ((self.demo_step - 20) * 0.3)  # Cooling down
+            if self.demo_step >= 60:
+                self.demo_step = 0  # Reset cycle
+            return self.get_temperature()  # Back to realistic
+        return self.get_temperature()
 
-def send_temperature_to_server(temp_c):
-    """Send temperature reading to Flask web server"""
-    try:
-        payload = {
-            "temperature": temp_c,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        response = requests.post(
-            API_ENDPOINT,
-            json=payload,
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('status') == 'success':
-                return True
-            else:
-                print(f"Server error: {result.get('message', 'Unknown error')}")
-                return False
-        else:
-            print(f"HTTP error: {response.status_code}")
-            return False
-            
-    except requests.exceptions.ConnectionError:
-        print(f"Could not connect to web server at {FLASK_SERVER_URL}")
-        return False
-    except requests.exceptions.Timeout:
-        print("Request timeout when sending to server")
-        return False
-    except Exception as e:
-        print(f"Error sending data to server: {e}")
-        return False
+def send_temperature_to_server(readings):
+    """Send a batch of temperature readings to Flask web server; returns (outcome, seconds to wait)"""
+    return deliver(API_ENDPOINT, readings, encoding=upload_encoding)
+
+def run_simulation_mode(mode="realistic", batch_size=1, batch_interval=None, device_id=None, probe_id=None,
+                        deadband=None, heartbeat=60):
+    """Run different simulation modes
 
-def run_simulation_mode(mode="realistic"):
-    """Run different simulation modes"""
+    With a deadband, only readings that move more than that from the last
+    one sent (or come heartbeat seconds after it) are uploaded.
+    """
     global running
     
     simulator = TemperatureSimulator()
@@ -116,40 +122,46 @@ def run_simulation_mode(mode="realistic"):
     consecutive_failures = 0
     server_failures = 0
     max_server_failures = 10
-    reading_count = 0
+    batcher = ReadingBatcher(batch_size, batch_interval)
+    changes = Deadband(deadband, heartbeat) if deadband is not None else None
+    resume_at = 0  # time.monotonic() after which a throttled upload may be retried
     
     try:
         while running:
             # Generate temperature based on mode
-            if mode == "realistic":
-                temp_c = simulator.get_temperature()
-            elif mode == "random":
-                temp_c = simulator.get_random_temperature()
-            elif mode == "demo":
-                # Demo mode: create interesting patterns
-                reading_count += 1
-                if reading_count < 20:
-                    temp_c = 20 + (reading_count * 0.5)  # Warming up
-                elif reading_count < 40:
-                    temp_c = 30 - ((reading_count - 20) * 0.3)  # Cooling down
-                else:
-                    temp_c = simulator.get_temperature()  # Back to realistic
-                    if reading_count >= 60:
-                        reading_count = 0  # Reset cycle
-            else:
-                temp_c = simulator.get_temperature()
+            temp_c = simulator.next_temperature(mode)
             
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             temp_f = temp_c * 9/5 + 32
             
             print(f"[{timestamp}] Temperature: {temp_c:.2f}°C ({temp_f:.2f}°F)", end=" ")
             
-            # Send to web server
-            if send_temperature_to_server(temp_c):
+            # Queue the reading with its sample time and send once the batch is due
+            outcome = None
+            if changes is not None and not changes(None, time.time(), temp_c):
+                print(f"· Unchanged (held, {changes.held} of {changes.held + changes.passed} so far)")
+            elif not batcher.add(make_reading(temp_c, device_id=device_id, probe_id=probe_id,
+                                              heartbeat=heartbeat if changes else None)):
+                print(f"… Queued ({len(batcher)}/{batcher.batch_size})")
+            elif time.monotonic() < resume_at:
+                print(f"⏸ Held back, server busy ({len(batcher)} queued)")
+            else:
+                batch = batcher.drain()
+                outcome, wait = send_temperature_to_server(batch)
+
+            if outcome == SENT:
                 print("✓ Sent to server")
                 consecutive_failures = 0
                 server_failures = 0
-            else:
+                # Ease back towards the requested batch size once the server keeps up
+                batcher.batch_size = max(batcher.batch_size // 2, batch_size)
+            elif outcome == THROTTLED:
+                # Keep the readings, wait as asked and send them with more in one upload
+                batcher.requeue(batch)
+                batcher.batch_size = min(max(batcher.batch_size, len(batcher)) * 2, MAX_BATCH_SIZE)
+                resume_at = time.monotonic() + wait
+                print(f"⏸ Server busy, holding {len(batcher)} readings for {wait:.0f}s")
+            elif outcome is not None:
                 print("✗ Failed to send")
                 server_failures += 1
                 
@@ -168,7 +180,7 @@ def run_simulation_mode(mode="realistic"):
     finally:
         signal_handler(None, None)
 
-def populate_initial_data():
+def populate_initial_data(device_id=None, probe_id=None):
     """Send some initial historical data to the server"""
     print("📈 Populating initial historical data...")
     
@@ -176,65 +188,183 @@ def populate_initial_data():
     base_time = datetime.now()
     
     # Generate 30 readings spanning the last 30 minutes
+    readings = []
     for i in range(30):
         temp_c = simulator.get_temperature()
         
         # Create timestamps going backwards in time
-        timestamp = datetime.fromtimestamp(base_time.timestamp() - (30 - i) * 60)
-        
-        payload = {
-            "temperature": temp_c,
-            "timestamp": timestamp.isoformat()
-        }
-        
-        try:
-            response = requests.post(API_ENDPOINT, json=payload, timeout=5)
-            if response.status_code == 200:
-                print(f"  ✓ Added reading: {temp_c:.2f}°C at {timestamp.strftime('%H:%M:%S')}")
-            else:
-                print(f"  ✗ Failed to add reading: HTTP {response.status_code}")
-        except Exception as e:
-            print(f"  ✗ Error adding reading: {e}")
-        
-        time.sleep(0.1)  # Small delay to avoid overwhelming server
+        timestamp = datetime.fromtimestamp(base_time.timestamp() - (30 - i) * 60, timezone.utc)
+        readings.append(make_reading(temp_c, timestamp, device_id, probe_id))
+    
+    # The server keeps device timestamps, so the whole history fits in one batch
+    if send_temperature_to_server(readings)[0] == SENT:
+        for reading in readings:
+            added_at = datetime.fromisoformat(reading['timestamp']).astimezone()
+            print(f"  ✓ Added reading: {reading['temperature']:.2f}°C at {added_at.strftime('%H:%M:%S')}")
+    else:
+        print("  ✗ Failed to add initial readings")
     
     print("✅ Initial data population complete!\n")
 
+def make_devices(count, args):
+    """count simulated devices, each with its own simulator and upload rate"""
+    from fleet import Device
+    
+    rates = [float(rate) for rate in args.rate.split(",")]
+    rng = random.Random(args.seed)
+    devices = []
+    for i in range(count):
+        simulator = TemperatureSimulator()
+        simulator.base_temp += rng.uniform(-3, 3)
+        simulator.time_offset = rng.randrange(86400)  # each device at its own point in the day
+        rate = rates[i % len(rates)] * (1 + rng.uniform(-args.rate_jitter, args.rate_jitter))
+        devices.append(Device(f"{args.device_id or 'sim'}-{i:04d}", args.probe_id, rate, simulator))
+    return devices
+
+def run_backfill_mode(args):
+    """Bulk-load args.backfill_days of synthetic history (see backfill.py)"""
+    from backfill import backfill
+    from fleet import Device
+    
+    if args.backfill_devices > 1:
+        devices = make_devices(args.backfill_devices, args)
+    else:
+        devices = [Device(args.device_id, args.probe_id, 0, TemperatureSimulator())]
+    per_device = int(args.backfill_days * 86400 / args.backfill_interval)
+    print(f"📈 Backfilling {args.backfill_days:g} days every {args.backfill_interval:g}s for "
+          f"{len(devices)} device(s): {per_device * len(devices):,} readings")
+    sent, seconds = backfill(API_ENDPOINT, devices, args.backfill_days,
+                             interval=args.backfill_interval, seed=args.seed)
+    print(f"✅ Sent {sent:,} readings in {seconds:.1f}s ({sent / max(seconds, 1e-9):,.0f} readings/s)")
+
+def run_fleet_mode(mode, args):
+    """Load-test the server with args.fleet simulated devices (see fleet.py)"""
+    from fleet import print_summary, run_fleet
+    
+    devices = make_devices(args.fleet, args)
+    offered = sum(device.rate for device in devices)
+    print(f"🚚 Fleet: {len(devices)} devices, {offered:.1f} uploads/s offered "
+          f"({offered * args.batch_size:.1f} readings/s), {args.arrivals} arrivals, "
+          f"{args.connections} connections, {args.duration:g}s")
+    stats = run_fleet(
+        API_ENDPOINT,
+        devices,
+        args.duration,
+        mode=mode,
+        batch_size=args.batch_size,
+        arrivals=args.arrivals,
+        connections=args.connections,
+        encoding=upload_encoding,
+        timeout=args.timeout,
+        seed=args.seed,
+    )
+    summary = stats.summary()
+    print_summary(summary)
+    if args.json_report:
+        with open(args.json_report, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"   Report written to {args.json_report}")
+
 def main():
-    global running
+    global running, upload_encoding, FLASK_SERVER_URL, API_ENDPOINT
     
     # Set up signal handler for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
     
     print("🌡️  Temperature Monitor - Sample Data Generator")
     print("=" * 60)
-    print(f"Web server URL: {FLASK_SERVER_URL}")
     print("Available modes:")
     print("  • realistic : Natural daily temperature variations")
     print("  • random    : Random temperatures (15°C - 35°C)")  
     print("  • demo      : Rapid changes for demonstration")
     print("\nPress Ctrl+C to stop\n")
     
-    # Check command line arguments for mode
-    mode = "realistic"
-    if len(sys.argv) > 1:
-        mode = sys.argv[1].lower()
-        if mode not in ["realistic", "random", "demo"]:
-            print(f"❌ Unknown mode '{mode}'. Using 'realistic' mode.")
-            mode = "realistic"
+    # Check command line arguments for mode and batching
+    parser = argparse.ArgumentParser(description="Sample temperature data generator")
+    parser.add_argument("mode", nargs="?", default="realistic",
+                        help="realistic, random or demo")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="send readings in batches of N (default: 1, no batching)")
+    parser.add_argument("--batch-interval", type=float, default=None,
+                        help="also send a partial batch after T seconds")
+    parser.add_argument("--device-id", default=None,
+                        help="tag readings with this device id (default: server's default series)")
+    parser.add_argument("--probe-id", default=None,
+                        help="tag readings with this probe id")
+    parser.add_argument("--deadband", type=float, default=None, metavar="C",
+                        help="send-on-change: only upload readings that move more than C °C")
+    parser.add_argument("--heartbeat", type=float, default=60.0, metavar="S",
+                        help="with --deadband, still upload at least every S seconds (default: 60)")
+    parser.add_argument("--binary", action="store_true",
+                        help="upload in the compact binary format instead of JSON")
+    parser.add_argument("--url", default=None,
+                        help="server to send to, e.g. http://localhost:5000")
+    fleet = parser.add_argument_group("fleet load test (needs aiohttp)")
+    fleet.add_argument("--fleet", type=int, default=0, metavar="N",
+                       help="simulate N devices uploading concurrently, then report latency")
+    fleet.add_argument("--rate", default="1",
+                       help="uploads per second per device; a comma list is spread over the devices")
+    fleet.add_argument("--rate-jitter", type=float, default=0.0,
+                       help="vary each device's rate by up to this fraction (e.g. 0.2)")
+    fleet.add_argument("--arrivals", choices=["fixed", "poisson"], default="fixed",
+                       help="fixed intervals, or random (Poisson) arrivals at the same mean rate")
+    fleet.add_argument("--duration", type=float, default=60.0,
+                       help="seconds to run (default: 60)")
+    fleet.add_argument("--connections", type=int, default=100,
+                       help="connection pool size (default: 100)")
+    fleet.add_argument("--timeout", type=float, default=10.0,
+                       help="seconds before an upload counts as timed out")
+    fleet.add_argument("--seed", type=int, default=None,
+                       help="random seed for a repeatable schedule")
+    fleet.add_argument("--json-report", default=None, metavar="PATH",
+                       help="also write the results as JSON")
+    bulk = parser.add_argument_group("history backfill (needs numpy)")
+    bulk.add_argument("--backfill-days", type=float, default=0, metavar="D",
+                      help="upload D days of synthetic history in bulk, then exit")
+    bulk.add_argument("--backfill-interval", type=float, default=60.0, metavar="S",
+                      help="seconds between backfilled readings (default: 60)")
+    bulk.add_argument("--backfill-devices", type=int, default=1, metavar="N",
+                      help="backfill N simulated devices (default: 1, tagged with --device-id)")
+    args = parser.parse_args()
+    if args.binary:
+        upload_encoding = "binary"
+    if args.url:
+        FLASK_SERVER_URL = args.url.rstrip("/")
+        API_ENDPOINT = f"{FLASK_SERVER_URL}/api/receive_temperature"
+    print(f"Web server URL: {FLASK_SERVER_URL}")
+    
+    mode = args.mode.lower()
+    if mode not in ["realistic", "random", "demo"]:
+        print(f"❌ Unknown mode '{mode}'. Using 'realistic' mode.")
+        mode = "realistic"
     
     print(f"🎯 Selected mode: {mode}")
+    if args.batch_size > 1 or args.batch_interval:
+        print(f"📦 Batching: {args.batch_size} readings" +
+              (f" or every {args.batch_interval:g}s" if args.batch_interval else ""))
+    if args.deadband is not None:
+        print(f"📉 Send-on-change: ±{args.deadband:g}°C deadband, heartbeat every {args.heartbeat:g}s")
+    if args.device_id or args.probe_id:
+        print(f"🏷️  Series: device {args.device_id or 'default'}, probe {args.probe_id or '0'}")
+    
+    if args.backfill_days:
+        run_backfill_mode(args)
+        return
+    if args.fleet:
+        run_fleet_mode(mode, args)
+        return
     
     # Ask if user wants to populate initial data
     try:
         populate = input("\n📊 Would you like to populate some initial historical data? (y/n): ").lower().strip()
         if populate == 'y' or populate == 'yes':
-            populate_initial_data()
+            populate_initial_data(args.device_id, args.probe_id)
     except KeyboardInterrupt:
         print("\nStarting simulation without initial data...\n")
     
     # Start the simulation
-    run_simulation_mode(mode)
+    run_simulation_mode(mode, args.batch_size, args.batch_interval, args.device_id, args.probe_id,
+                        args.deadband, args.heartbeat)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,166 @@
+"""
+Fixed-rate sampling with on-device aggregation
+Sampler reads every probe at the MAX6675's conversion rate (about 4 Hz) on
+a drift-free schedule, median-filters out single glitch reads, and reports
+one Record per probe each reporting period with the min/max/mean/count of
+what it read. FakeSpiDev stands in for spidev.SpiDev without hardware.
+"""
+
+import math
+import time
+import random
+import threading
+import collections
+from datetime import datetime, timezone
+
+# The MAX6675 needs ~220 ms per conversion; reading faster just repeats values
+MAX6675_RATE_HZ = 4
+
+# Aggregate of one probe over one reporting period. timestamp is the end of
+# the period; mean/min/max are None when no read succeeded (errors > 0).
+Record = collections.namedtuple("Record", "probe timestamp mean min max count errors")
+
+
+def decode_max6675(raw):
+    """Temperature in °C from the MAX6675's two bytes, or None if the thermocouple is open"""
+    word = (raw[0] << 8) | raw[1]
+    if word & 0x4:  # D2 is set while no thermocouple is connected
+        return None
+    return (word >> 3) * 0.25
+
+
+class MedianFilter:
+    """Median of the last `size` values, so a lone spike never gets through"""
+
+    def __init__(self, size=5):
+        self.window = collections.deque(maxlen=size)
+
+    def __call__(self, value):
+        self.window.append(value)
+        ordered = sorted(self.window)
+        middle = len(ordered) // 2
+        if len(ordered) % 2:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class Sampler:
+    """Reads probes at a fixed rate and reports aggregated records
+
+    read(probe) returns °C or None for a failed read. on_record(record) is
+    called from run()'s thread at the end of each reporting period, once per
+    probe. Ticks are scheduled from the start time rather than from the
+    previous sleep, so slow reads or callbacks never make the rate drift;
+    a late tick runs at once, and ticks missed by a whole period are
+    skipped and counted in `overruns`.
+    """
+
+    def __init__(self, probes, read, on_record, rate_hz=MAX6675_RATE_HZ,
+                 report_seconds=5.0, median_window=5):
+        self.probes = list(probes)
+        self.read = read
+        self.on_record = on_record
+        self.period = 1.0 / rate_hz
+        self.report_seconds = report_seconds
+        self.filters = {probe: MedianFilter(median_window) for probe in self.probes}
+        self.stopped = threading.Event()
+        self.overruns = 0
+        self._reset()
+
+    def _reset(self):
+        # probe -> [min, max, sum, count, errors] for the current period
+        self.pending = {probe: [math.inf, -math.inf, 0.0, 0, 0] for probe in self.probes}
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        """Sample until stop() is called"""
+        start = time.monotonic()
+        tick = 0
+        report_at = start + self.report_seconds
+        while not self.stopped.is_set():
+            self.sample()
+            now = time.monotonic()
+            if now >= report_at:
+                self.report()
+                report_at += self.report_seconds
+                if report_at <= now:  # fell a whole period behind; start afresh
+                    report_at = now + self.report_seconds
+
+            tick += 1
+            next_at = start + tick * self.period
+            now = time.monotonic()
+            if now - next_at >= self.period:
+                missed = int((now - next_at) / self.period)
+                self.overruns += missed
+                tick += missed
+                next_at = start + tick * self.period
+            self.stopped.wait(max(0.0, next_at - now))
+
+    def sample(self):
+        """Read each probe once and fold the filtered value into its period"""
+        for probe in self.probes:
+            value = self.read(probe)
+            agg = self.pending[probe]
+            if value is None:
+                agg[4] += 1
+                continue
+            value = self.filters[probe](value)
+            if value < agg[0]:
+                agg[0] = value
+            if value > agg[1]:
+                agg[1] = value
+            agg[2] += value
+            agg[3] += 1
+
+    def report(self):
+        """Emit a record per probe for the period so far and start the next one"""
+        now = datetime.now(timezone.utc)
+        pending = self.pending
+        self._reset()
+        for probe in self.probes:
+            low, high, total, count, errors = pending[probe]
+            if count:
+                record = Record(probe, now, total / count, low, high, count, errors)
+            else:
+                record = Record(probe, now, None, None, None, 0, errors)
+            self.on_record(record)
+
+
+class FakeSpiDev:
+    """Stand-in for spidev.SpiDev that produces MAX6675 reads
+
+    The temperature drifts slowly around `base` with sensor noise, quantized
+    to the chip's 0.25 °C steps. A fraction `glitch_rate` of reads come back
+    as a wild value and `fault_rate` as an open thermocouple.
+    """
+
+    def __init__(self, base=22.0, swing=3.0, noise=0.2, glitch_rate=0.01, fault_rate=0.0, seed=None):
+        self.base = base
+        self.swing = swing
+        self.noise = noise
+        self.glitch_rate = glitch_rate
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.opened = None
+
+    def open(self, bus, device):
+        self.opened = (bus, device)
+
+    def close(self):
+        self.opened = None
+
+    def readbytes(self, count):
+        roll = self.random.random()
+        if roll < self.fault_rate:
+            return [0, 0x04]
+        if roll < self.fault_rate + self.glitch_rate:
+            word = self.random.randrange(0, 4096) << 3
+        else:
+            temp = (self.base + self.swing * math.sin(time.time() / 600)
+                    + self.random.gauss(0, self.noise))
+            word = max(0, min(4095, round(temp * 4))) << 3
+        return [word >> 8, word & 0xFF][:count]
@@ -0,0 +1,166 @@
+"""
+Durable store-and-forward spool for readings that could not be delivered
+Backed by SQLite in WAL mode with synchronous=NORMAL, so commits append to the
+WAL without an fsync and only checkpoints hit the SD card. Writes are buffered
+and committed every commit_interval seconds or commit_every readings.
+Readings the server refuses are moved to a quarantine table with its reason
+rather than deleted, so a fixed clock or server can take them after all.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class ReadingSpool:
+    """Append-only, size-capped queue of readings on disk (oldest first)"""
+
+    def __init__(self, path="spool.db", max_readings=2_000_000,
+                 commit_interval=30.0, commit_every=500, compact_every=10_000):
+        self.path = path
+        self.max_readings = max_readings
+        self.commit_interval = commit_interval
+        self.commit_every = commit_every
+        self.compact_every = compact_every
+
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_commit = time.monotonic()
+        self.acked_since_compact = 0
+        self.evicted = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum only takes effect on a new database, before the first table
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " reading TEXT NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS quarantine ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " reading TEXT NOT NULL,"
+            " error TEXT NOT NULL,"
+            " quarantined_at REAL NOT NULL)"
+        )
+        self.db.commit()
+        self.stored = self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        self.quarantined = self.db.execute("SELECT COUNT(*) FROM quarantine").fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self.stored + len(self.pending)
+
+    def append(self, readings):
+        """Buffer readings for the spool; committed in groups to limit SD card writes"""
+        with self.lock:
+            self.pending.extend(json.dumps(r) for r in readings)
+            if (len(self.pending) >= self.commit_every or
+                    time.monotonic() - self.last_commit >= self.commit_interval):
+                self._commit()
+
+    def flush(self):
+        """Commit any buffered readings now (call on shutdown)"""
+        with self.lock:
+            self._commit()
+
+    def peek(self, limit):
+        """Return (last_id, readings) for up to limit of the oldest spooled readings"""
+        with self.lock:
+            # Replay must see everything that was spooled, including the buffer
+            self._commit()
+            rows = self.db.execute(
+                "SELECT id, reading FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [json.loads(reading) for _, reading in rows]
+
+    def ack(self, last_id, rejected=()):
+        """Remove readings up to and including last_id once they were delivered
+
+        rejected is (reading, error) pairs among them that the server
+        refused; they go to quarantine in the same transaction.
+        """
+        with self.lock:
+            self._quarantine(rejected)
+            cursor = self.db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self.db.commit()
+            self.stored -= cursor.rowcount
+            self.acked_since_compact += cursor.rowcount
+            if self.acked_since_compact >= self.compact_every:
+                self._compact()
+
+    def quarantine(self, rejected):
+        """Keep (reading, error) pairs the server refused, instead of dropping them"""
+        with self.lock:
+            self._quarantine(rejected)
+            self.db.commit()
+
+    def release_quarantine(self):
+        """Move every quarantined reading back into the spool to be sent again; returns how many"""
+        with self.lock:
+            self._commit()
+            self.db.execute("INSERT INTO spool (reading) SELECT reading FROM quarantine ORDER BY id")
+            self.db.execute("DELETE FROM quarantine")
+            self.db.commit()
+            released, self.quarantined = self.quarantined, 0
+            self.stored += released
+            return released
+
+    def compact(self):
+        """Give freed pages back to the filesystem and truncate the WAL"""
+        with self.lock:
+            self._compact()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self._compact()
+            self.db.close()
+
+    def _commit(self):
+        if self.pending:
+            self.db.executemany(
+                "INSERT INTO spool (reading) VALUES (?)",
+                ((reading,) for reading in self.pending),
+            )
+            self.stored += len(self.pending)
+            self.pending = []
+
+            # Enforce the size cap by dropping the oldest readings
+            overflow = self.stored - self.max_readings
+            if overflow > 0:
+                self.db.execute(
+                    "DELETE FROM spool WHERE id IN "
+                    "(SELECT id FROM spool ORDER BY id LIMIT ?)", (overflow,)
+                )
+                self.stored -= overflow
+                self.evicted += overflow
+        self.db.commit()
+        self.last_commit = time.monotonic()
+
+    def _quarantine(self, rejected):
+        now = time.time()
+        rows = [(json.dumps(reading), error, now) for reading, error in rejected]
+        if not rows:
+            return
+        self.db.executemany("INSERT INTO quarantine (reading, error, quarantined_at) VALUES (?, ?, ?)", rows)
+        self.quarantined += len(rows)
+        # Capped like the spool, oldest first
+        overflow = self.quarantined - self.max_readings
+        if overflow > 0:
+            self.db.execute(
+                "DELETE FROM quarantine WHERE id IN "
+                "(SELECT id FROM quarantine ORDER BY id LIMIT ?)", (overflow,)
+            )
+            self.quarantined -= overflow
+
+    def _compact(self):
+        self.db.execute("PRAGMA incremental_vacuum")
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.acked_since_compact = 0
@@ -1,13 +1,21 @@
-#Run this file on the raspberry pi!
-import spidev
+#Run this file on the raspberry pi! (FAKE_SPI=1 runs it anywhere against simulated probes)
+import os
 import time
-import requests
+import socket
 from datetime import datetime
 import sys
 import signal
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from alerts import AlertDispatcher
+from rules import RulesEngine
+from metrics import Registry, serve as serve_metrics, write_textfile
+from sampler import FakeSpiDev, Sampler, decode_max6675
+from uploader import BackgroundSender, Deadband, SpoolReplayer, make_reading
+from spool import ReadingSpool
+
+try:
+    import spidev
+except ImportError:
+    spidev = None  # not on a Pi; only FAKE_SPI=1 works
 
 # Flask server configuration
 #FLASK_SERVER_URL = "http://192.168.2.34:5000"
@@ -15,6 +23,66 @@ from email.mime.multipart import MIMEMultipart
 FLASK_SERVER_URL = "https://new-church.vercel.app/"
 API_ENDPOINT = f"{FLASK_SERVER_URL}/api/receive_temperature"
 
+# Series tagging: readings are filed on the server under (DEVICE_ID, probe id).
+# PROBES maps each probe id to the SPI (bus, device) its MAX6675 is wired to.
+DEVICE_ID = socket.gethostname()
+PROBES = {
+    "0": (0, 0),  # Bus 0, Device 0 (CE0)
+}
+
+# Sampling: every probe is read SAMPLE_RATE_HZ times a second (the MAX6675
+# converts about 4 times a second), median-filtered over MEDIAN_WINDOW reads,
+# and one reading per probe, the mean, is sent every REPORT_INTERVAL_SECONDS
+# with the period's min/max/count, which the server keeps in its rollups so a
+# spike between two reports still shows on the chart.
+SAMPLE_RATE_HZ = 4
+MEDIAN_WINDOW = 5
+REPORT_INTERVAL_SECONDS = 5
+USE_FAKE_SPI = os.environ.get("FAKE_SPI") == "1"
+
+# Send-on-change reporting: upload a probe's reading only when it moves more
+# than DEADBAND_C from the last one uploaded, or HEARTBEAT_SECONDS after it.
+# The server holds the last value in between. A deadband of 0.25 (one MAX6675
+# step) cuts uploads of a steady or slowly drifting probe by ~90% at a 60 s
+# heartbeat. None uploads every reading.
+DEADBAND_C = None
+HEARTBEAT_SECONDS = 60
+
+# Upload batching: send once BATCH_SIZE readings are queued or
+# BATCH_INTERVAL_SECONDS have passed (None = size only). 1 sends every reading.
+BATCH_SIZE = 1
+BATCH_INTERVAL_SECONDS = None
+
+# Upload format: "json", or "binary" for the compact columnar format (wire.py),
+# about 6x smaller per reading. Needs a server that understands it.
+UPLOAD_ENCODING = "json"
+
+# Background sender: readings wait in a bounded queue (oldest dropped when full)
+# and SENDER_WORKERS threads deliver them over keep-alive connections
+SENDER_QUEUE_SIZE = 3600
+SENDER_WORKERS = 1
+SENDER_MAX_RETRIES = 5
+SENDER_BACKOFF_SECONDS = 1.0
+
+# Offline spool: readings that cannot be delivered are kept on disk and
+# replayed oldest first once the server is reachable again
+SPOOL_ENABLED = True
+SPOOL_PATH = "spool.db"
+SPOOL_MAX_READINGS = 2_000_000  # ~23 days at 1 Hz
+SPOOL_REPLAY_BATCH_SIZE = 500
+SPOOL_REPLAY_MAX_PER_SECOND = 1000
+
+# Metrics (Prometheus text format): a listener on METRICS_PORT answering
+# GET /metrics (None to disable), and/or a file rewritten every report,
+# e.g. for node_exporter's textfile collector
+METRICS_PORT = 9105
+METRICS_TEXTFILE = None
+
+# Email settings added after email_config.py was written; it may override them
+SMTP_STARTTLS = True  # False for a local test server such as aiosmtpd
+ALERT_HYSTERESIS_C = 1.0  # an over-threshold alert clears this far below TEMP_THRESHOLD_C
+ALERT_RULES = None  # list of rules.py rule dicts; None = just the TEMP_THRESHOLD_C rule
+
 # Import email configuration
 try:
     from email_config import *
@@ -29,145 +97,150 @@ except ImportError:
     TEMP_THRESHOLD_C = 30.0
     EMAIL_COOLDOWN_MINUTES = 30
 
+def default_alert_rules():
+    """The original behaviour: alert at TEMP_THRESHOLD_C, now with hysteresis"""
+    return [{
+        "name": "over-threshold",
+        "type": "threshold",
+        "above": TEMP_THRESHOLD_C,
+        "clear_below": TEMP_THRESHOLD_C - ALERT_HYSTERESIS_C,
+    }]
+
 # Global variables
-spi = None
+spi = {}  # probe id -> SpiDev
+sender = None
+spool = None
+deadband = Deadband(DEADBAND_C, HEARTBEAT_SECONDS) if DEADBAND_C is not None else None
+replayer = None
+alerter = None
+sampler = None
+rules = RulesEngine(ALERT_RULES if ALERT_RULES is not None else default_alert_rules())
 running = True
-last_email_sent = None
+
+# Metrics: timings are recorded as they happen, everything else is read when scraped
+pi_metrics = Registry()
+spi_read_time = pi_metrics.histogram(
+    "spi_read_seconds", "Time to read one probe over SPI", ("probe",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1))
+spi_read_failures = pi_metrics.counter("spi_read_failures_total", "Probe reads that failed or found no thermocouple",
+                                       ("probe",))
+upload_time = pi_metrics.histogram("upload_duration_seconds", "Time per upload attempt by outcome", ("outcome",))
+pi_metrics.gauge("sender_queue_depth", "Readings waiting to be uploaded",
+                 collect=lambda: [((), sender.depth())] if sender else [])
+pi_metrics.gauge("sender_consecutive_failures", "Upload attempts failed since the last success",
+                 collect=lambda: [((), sender.consecutive_failures)] if sender else [])
+pi_metrics.counter("sender_throttled_total", "Uploads the server answered with 429 (Retry-After honored)",
+                   collect=lambda: [((), sender.throttles)] if sender else [])
+pi_metrics.gauge("sender_batch_size", "Readings per upload now; grows while the server throttles",
+                 collect=lambda: [((), sender.current_batch_size)] if sender else [])
+pi_metrics.counter("sender_readings_total", "Readings by what became of them", ("outcome",),
+                   collect=lambda: [((outcome,), getattr(sender, outcome))
+                                    for outcome in ("sent", "failed", "dropped", "spooled")] if sender else [])
+pi_metrics.counter("deadband_readings_total", "Readings uploaded or held back by the deadband", ("outcome",),
+                   collect=lambda: [(("sent",), deadband.passed), (("held",), deadband.held)] if deadband else [])
+pi_metrics.gauge("spool_readings", "Readings waiting in the offline spool",
+                 collect=lambda: [((), len(spool))] if spool is not None else [])
+pi_metrics.counter("sampler_overruns_total", "Sampling ticks skipped because the loop fell behind",
+                   collect=lambda: [((), sampler.overruns)] if sampler else [])
+pi_metrics.counter("alert_emails_total", "Alert emails by outcome", ("outcome",),
+                   collect=lambda: [((outcome,), getattr(alerter, outcome))
+                                    for outcome in ("sent", "failed_attempts", "dropped")] if alerter else [])
 
 def signal_handler(sig, frame):
     """Handle graceful shutdown on Ctrl+C"""
-    global running, spi
+    global running, spi, spool
     print('\n\nShutting down gracefully...')
     running = False
+    if sampler:
+        sampler.stop()
+    if alerter:
+        alerter.stop()
+    if replayer:
+        replayer.stop()
+    if sender:
+        sender.stop()
+        print(f'Sender stopped ({sender.depth()} readings unsent).')
+    if spool is not None:
+        spool.close()
+        print(f'Spool closed ({len(spool)} readings waiting).')
+        spool = None  # main()'s finally runs this again after Ctrl+C
+    for device in spi.values():
+        device.close()
     if spi:
-        spi.close()
         print('SPI connection closed.')
     sys.exit(0)
 
 def initialize_spi():
-    """Initialize SPI connection to MAX6675"""
-    global spi
-    try:
-        spi = spidev.SpiDev()
-        spi.open(0, 0)  # Bus 0, Device 0 (CE0)
-        spi.max_speed_hz = 500000
-        spi.mode = 0
-        print("✓ SPI connection initialized")
-        return True
-    except Exception as e:
-        print(f"✗ Failed to initialize SPI: {e}")
+    """Initialize an SPI connection to each probe's MAX6675"""
+    if spidev is None and not USE_FAKE_SPI:
+        print("✗ spidev is not installed (set FAKE_SPI=1 to simulate the probes)")
         return False
+    for probe_id, (bus, device) in PROBES.items():
+        try:
+            spi[probe_id] = FakeSpiDev() if USE_FAKE_SPI else spidev.SpiDev()
+            spi[probe_id].open(bus, device)
+            spi[probe_id].max_speed_hz = 500000
+            spi[probe_id].mode = 0
+            spi_read_time.labels(probe_id)  # so both series exist before the first failure
+            spi_read_failures.labels(probe_id)
+            print(f"✓ SPI connection initialized for probe {probe_id} (bus {bus}, device {device})")
+        except Exception as e:
+            spi.pop(probe_id, None)
+            print(f"✗ Failed to initialize SPI for probe {probe_id}: {e}")
+    return bool(spi)
 
-def read_temp():
-    """Read temperature from MAX6675 thermocouple sensor"""
-    global spi
-    if not spi:
+def read_temp(probe_id):
+    """Read temperature from one probe's MAX6675 thermocouple sensor"""
+    device = spi.get(probe_id)
+    if not device:
         return None
     
+    started = time.perf_counter()
     try:
-        # MAX6675 returns 2 bytes
-        raw = spi.readbytes(2)
-        value = ((raw[0] << 8) | raw[1]) >> 3
-        
-        # Check fault bit
-        if value & 0x8000:
-            return None
-            
-        # Convert to temperature in Celsius
-        return value * 0.25
+        # MAX6675 returns 2 bytes; None if the thermocouple is open
+        temp_c = decode_max6675(device.readbytes(2))
     except Exception as e:
-        print(f"✗ Error reading temperature: {e}")
-        return None
+        print(f"✗ Error reading probe {probe_id}: {e}")
+        temp_c = None
+    spi_read_time.observe(time.perf_counter() - started, (probe_id,))
+    if temp_c is None:
+        spi_read_failures.inc(1, (probe_id,))
+    return temp_c
 
-def send_temperature_to_server(temp_c):
-    """Send temperature reading to Flask web server"""
-    try:
-        payload = {
-            "temperature": temp_c,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        response = requests.post(
-            API_ENDPOINT,
-            json=payload,
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('status') == 'success':
-                return True
-            else:
-                print(f"Server error: {result.get('message', 'Unknown error')}")
-                return False
-        else:
-            print(f"HTTP error: {response.status_code}")
-            return False
-            
-    except requests.exceptions.ConnectionError:
-        print(f"Could not connect to web server at {FLASK_SERVER_URL}")
-        return False
-    except requests.exceptions.Timeout:
-        print("Request timeout when sending to server")
+def send_rule_alert(event):
+    """Hand a rule transition to the background dispatcher (never waits on SMTP)"""
+    if not alerter:
         return False
-    except Exception as e:
-        print(f"Error sending data to server: {e}")
-        return False
-
-def send_temperature_alert(temp_c, temp_f):
-    """Send email alert when temperature threshold is exceeded"""
-    global last_email_sent
     
-    if not EMAIL_ENABLED:
-        return False
-    
-    # Check cooldown period
-    if last_email_sent:
-        time_since_last = (datetime.now() - last_email_sent).total_seconds() / 60
-        if time_since_last < EMAIL_COOLDOWN_MINUTES:
-            return False
-    
-    # Parse recipients (support multiple emails separated by commas)
-    recipients = [email.strip() for email in EMAIL_RECIPIENT.split(',')]
-    
-    try:
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_SENDER
-        msg['To'] = ', '.join(recipients)
-        msg['Subject'] = f"🌡️ Temperature Alert: {temp_c:.1f}°C ({temp_f:.1f}°F)"
-        
-        body = f"""
-Temperature Alert!
+    now = datetime.fromtimestamp(event.ts)
+    if event.value is not None:
+        temp_f = event.value * 9/5 + 32
+        reading = f"{event.value:.1f}°C ({temp_f:.1f}°F)"
+    else:
+        reading = "no reading"
+    if event.firing:
+        subject = f"🌡️ Temperature Alert: {event.rule} on probe {event.series}, {reading}"
+        title = "Temperature Alert!"
+        headline = f"Alert '{event.rule}' is firing on probe {event.series} of {DEVICE_ID}:"
+    else:
+        subject = f"✅ Resolved: {event.rule} on probe {event.series}, {reading}"
+        title = "Alert cleared"
+        headline = f"Alert '{event.rule}' has cleared on probe {event.series} of {DEVICE_ID}:"
+    body = f"""
+{title}
 
-The temperature has reached {temp_c:.1f}°C ({temp_f:.1f}°F), 
-which exceeds the threshold of {TEMP_THRESHOLD_C:.1f}°C.
+{headline}
+{event.message}
 
-Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Time: {now.strftime('%Y-%m-%d %H:%M:%S')}
 
 This is an automated alert from your Raspberry Pi temperature monitoring system.
         """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_SENDER, recipients, text)
-        server.quit()
-        
-        last_email_sent = datetime.now()
-        print(f"🔥 EMAIL ALERT SENT: {temp_c:.1f}°C to {len(recipients)} recipient(s)")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Failed to send email alert: {e}")
-        return False
+    alerter.raise_alert(subject, body, now)
+    return True
 
 def main():
-    global running
+    global running, sender, spool, replayer, alerter, sampler
     
     # Set up signal handler for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
@@ -175,14 +248,31 @@ def main():
     print("Temperature Monitor - MAX6675 Thermocouple Sensor")
     print("=" * 50)
     print(f"Web server URL: {FLASK_SERVER_URL}")
+    print(f"Device: {DEVICE_ID}, probes: {', '.join(PROBES)}" + (" (simulated)" if USE_FAKE_SPI else ""))
+    print(f"Sampling at {SAMPLE_RATE_HZ} Hz, reporting every {REPORT_INTERVAL_SECONDS} s")
+    if deadband is not None:
+        print(f"Send-on-change: ±{DEADBAND_C}°C deadband, heartbeat every {HEARTBEAT_SECONDS} s")
     
     # Display email configuration
     if EMAIL_ENABLED:
         temp_f_threshold = TEMP_THRESHOLD_C * 9/5 + 32
         print(f"📧 Email alerts enabled")
-        print(f"   Threshold: {TEMP_THRESHOLD_C:.1f}°C ({temp_f_threshold:.1f}°F)")
+        if ALERT_RULES is None:
+            print(f"   Threshold: {TEMP_THRESHOLD_C:.1f}°C ({temp_f_threshold:.1f}°F), "
+                  f"clears below {TEMP_THRESHOLD_C - ALERT_HYSTERESIS_C:.1f}°C")
+        else:
+            print(f"   Rules: {', '.join(rule.name for rule in rules.rules)}")
         print(f"   Recipient: {EMAIL_RECIPIENT}")
-        print(f"   Cooldown: {EMAIL_COOLDOWN_MINUTES} minutes")
+        print(f"   Cooldown: {EMAIL_COOLDOWN_MINUTES} minutes (alerts in between are sent as one digest)")
+        alerter = AlertDispatcher(
+            SMTP_SERVER,
+            SMTP_PORT,
+            EMAIL_SENDER,
+            EMAIL_PASSWORD,
+            EMAIL_RECIPIENT,
+            cooldown_minutes=EMAIL_COOLDOWN_MINUTES,
+            starttls=SMTP_STARTTLS,
+        ).start()
     else:
         print("📧 Email alerts disabled")
     
@@ -194,49 +284,107 @@ def main():
         return
     
     consecutive_failures = 0
-    server_failures = 0
     max_server_failures = 10
+    warned_failures = 0
+    if SPOOL_ENABLED:
+        spool = ReadingSpool(SPOOL_PATH, max_readings=SPOOL_MAX_READINGS)
+        if len(spool):
+            print(f"📦 {len(spool)} spooled readings will be replayed")
+    sender = BackgroundSender(
+        API_ENDPOINT,
+        max_queue=SENDER_QUEUE_SIZE,
+        workers=SENDER_WORKERS,
+        batch_size=BATCH_SIZE,
+        batch_interval=BATCH_INTERVAL_SECONDS,
+        max_retries=SENDER_MAX_RETRIES,
+        backoff=SENDER_BACKOFF_SECONDS,
+        spool=spool,
+        encoding=UPLOAD_ENCODING,
+        observe_send=lambda outcome, seconds: upload_time.observe(seconds, (outcome,)),
+    ).start()
+    if METRICS_PORT:
+        try:
+            serve_metrics(pi_metrics, METRICS_PORT)
+            print(f"📈 Metrics at http://{DEVICE_ID}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"✗ Metrics listener not started on port {METRICS_PORT}: {e}")
+    if spool is not None:
+        replayer = SpoolReplayer(
+            API_ENDPOINT,
+            spool,
+            sender=sender,
+            batch_size=SPOOL_REPLAY_BATCH_SIZE,
+            max_readings_per_second=SPOOL_REPLAY_MAX_PER_SECOND,
+            encoding=UPLOAD_ENCODING,
+        ).start()
     
-    try:
-        while running:
-            # Read temperature from sensor
-            temp_c = read_temp()
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def handle_record(record):
+        """Alert on and upload one probe's aggregate for the reporting period"""
+        nonlocal consecutive_failures, warned_failures
+        probe_id = record.probe
+        timestamp = record.timestamp.astimezone().strftime("%Y-%m-%d %H:%M:%S")
+        
+        if record.mean is not None:
+            temp_c = record.mean
+            temp_f = temp_c * 9/5 + 32
+            print(f"[{timestamp}] Probe {probe_id}: {temp_c:.2f}°C ({temp_f:.2f}°F) "
+                  f"[{record.min:.2f}-{record.max:.2f}, {record.count} reads"
+                  + (f", {record.errors} failed" if record.errors else "") + "]", end=" ")
+            consecutive_failures = 0
             
-            if temp_c is not None:
-                temp_f = temp_c * 9/5 + 32
-                print(f"[{timestamp}] Temperature: {temp_c:.2f}°C ({temp_f:.2f}°F)", end=" ")
-                
-                # Check temperature threshold and send email alert
-                if temp_c >= TEMP_THRESHOLD_C:
-                    send_temperature_alert(temp_c, temp_f)
-                
-                # Send to web server
-                if send_temperature_to_server(temp_c):
-                    print("✓ Sent to server")
-                    consecutive_failures = 0
-                    server_failures = 0
-                else:
-                    print("✗ Failed to send")
-                    server_failures += 1
-                    
-                    # Show warning if server is consistently unreachable
-                    if server_failures >= max_server_failures:
-                        print(f"⚠️  Warning: Web server unreachable for {server_failures} attempts")
-                        print("   Temperature readings will continue locally")
-                        server_failures = 0  # Reset to avoid spam
-                        
+            # Evaluate alert rules; only a change of state sends an email
+            for event in rules.observe(probe_id, record.timestamp.timestamp(), temp_c):
+                send_rule_alert(event)
+            
+            # Hand the reading to the sender thread; this never waits on the network
+            if deadband is not None and not deadband(probe_id, record.timestamp.timestamp(), temp_c):
+                print("· Unchanged (held)")
             else:
-                print(f"[{timestamp}] ✗ Thermocouple error (not connected or faulty)")
-                consecutive_failures += 1
+                reading = make_reading(round(temp_c, 3), when=record.timestamp, device_id=DEVICE_ID,
+                                       probe_id=probe_id, heartbeat=HEARTBEAT_SECONDS if deadband else None,
+                                       min_c=round(record.min, 3), max_c=round(record.max, 3), count=record.count)
+                sender.submit(reading)
+                print(f"→ Queued ({sender.depth()} pending" + (", server busy)" if sender.throttled() else ")"))
+            
+            # Show warning if server is consistently unreachable
+            server_failures = sender.consecutive_failures
+            if server_failures - warned_failures >= max_server_failures:
+                print(f"⚠️  Warning: Web server unreachable for {server_failures} attempts")
+                if spool is not None:
+                    print(f"   Readings are spooled to {SPOOL_PATH} ({len(spool)} waiting)")
+                else:
+                    print(f"   {sender.depth()} readings queued, {sender.dropped} dropped so far")
+                warned_failures = server_failures  # Only warn again after more failures
+            elif server_failures < warned_failures:
+                warned_failures = 0
                 
-                # Show warning for persistent sensor issues
-                if consecutive_failures >= 5:
-                    print("⚠️  Warning: Multiple sensor read failures - check thermocouple connection")
-                    consecutive_failures = 0  # Reset counter
+        else:
+            print(f"[{timestamp}] ✗ Probe {probe_id} thermocouple error (not connected or faulty)")
+            consecutive_failures += 1
             
-            # Wait before next reading
-            time.sleep(1)
+            # Show warning for persistent sensor issues
+            if consecutive_failures >= 5:
+                print("⚠️  Warning: Multiple sensor read failures - check thermocouple connection")
+                consecutive_failures = 0  # Reset counter
+        
+        # Stale-data rules fire on silence, so they are checked every report
+        for event in rules.tick(time.time()):
+            send_rule_alert(event)
+        
+        if METRICS_TEXTFILE:
+            write_textfile(pi_metrics, METRICS_TEXTFILE)
+    
+    sampler = Sampler(
+        spi,
+        read_temp,
+        handle_record,
+        rate_hz=SAMPLE_RATE_HZ,
+        report_seconds=REPORT_INTERVAL_SECONDS,
+        median_window=MEDIAN_WINDOW,
+    )
+    try:
+        # Reads on a fixed schedule until Ctrl+C; handle_record runs once per probe per report
+        sampler.run()
             
     except Exception as e:
         print(f"\nUnexpected error: {e}")
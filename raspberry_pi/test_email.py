@@ -2,12 +2,20 @@
 """
 Test script for email functionality on Raspberry Pi
 Run this to test if email alerts work correctly
+
+    python test_email.py                        # one email through email_config settings
+    python test_email.py --local localhost:1025 # alert dispatcher against a local stand-in:
+                                                #   python -m aiosmtpd -n -l localhost:1025
 """
 
+import sys
+import time
+import argparse
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+from alerts import AlertDispatcher
 
 # Import email configuration
 try:
@@ -74,6 +82,35 @@ If you receive this email, the email functionality is working correctly!
         print("4. Check your internet connection")
         return False
 
+def test_dispatcher(host, port):
+    """Send an alert and then a digest through AlertDispatcher to a local SMTP server"""
+    print(f"🧪 Testing alert dispatcher against {host}:{port}")
+    print("=" * 40)
+    
+    # A 3 second cooldown: the first alert goes out at once, the next three as one digest
+    dispatcher = AlertDispatcher(host, port, EMAIL_SENDER, None, EMAIL_RECIPIENT,
+                                 cooldown_minutes=0.05, starttls=False).start()
+    for i in range(4):
+        dispatcher.raise_alert(f"🧪 Test alert {i + 1}", f"Test alert {i + 1} from the alert dispatcher")
+        time.sleep(0.2)
+    time.sleep(4)
+    dispatcher.stop()
+    
+    if dispatcher.sent == 2 and not dispatcher.pending:
+        print("✅ Sent 1 alert and 1 digest over one SMTP session")
+        return True
+    print(f"❌ Expected 2 emails, sent {dispatcher.sent} ({dispatcher.failed_attempts} failed attempts)")
+    return False
+
 if __name__ == "__main__":
-    test_email()
+    parser = argparse.ArgumentParser(description="Test email alerts")
+    parser.add_argument("--local", metavar="HOST:PORT",
+                        help="test the alert dispatcher against a local SMTP server instead")
+    args = parser.parse_args()
+    if args.local:
+        host, _, port = args.local.rpartition(":")
+        ok = test_dispatcher(host or "localhost", int(port))
+    else:
+        ok = test_email()
+    sys.exit(0 if ok else 1)
 
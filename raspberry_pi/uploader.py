@@ -0,0 +1,575 @@
+"""
+Upload helpers shared by test.py and sample_data_generator.py
+Readings are stamped on the device and can be grouped so one POST carries many samples.
+BackgroundSender moves delivery off the sampling loop onto worker threads, and
+SpoolReplayer forwards readings that were spooled to disk while offline.
+Uploads are JSON unless encoding="binary" selects the compact format in wire.py.
+When the server answers 429 (or 503) with Retry-After, both wait that long
+and then send what has piled up in larger batches instead of retrying blindly.
+Deadband filters readings down to the ones worth sending in send-on-change mode.
+"""
+
+import time
+import random
+import threading
+import collections
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from wire import MEDIA_TYPE as BINARY_MEDIA_TYPE, encode_readings, encoded_order
+
+# Outcomes of one delivery attempt
+SENT = "sent"
+RETRY = "retry"        # network error, timeout or 5xx: worth trying again
+REJECTED = "rejected"  # the server refused the payload: retrying will not help
+THROTTLED = "throttled"  # the server is overloaded: retry after the delay it asked for
+
+# The server's limit for one JSON upload; throttled senders grow batches up to this
+MAX_BATCH_SIZE = 5000
+# Seconds to wait on a 429/503 that gives no usable Retry-After
+DEFAULT_RETRY_AFTER = 5.0
+
+
+def make_reading(temp_c, when=None, device_id=None, probe_id=None, heartbeat=None,
+                 min_c=None, max_c=None, count=None):
+    """Build a {temperature, timestamp} reading stamped with device time (UTC)
+
+    device_id/probe_id tag the series the reading belongs to; the server
+    files untagged readings under its default series. heartbeat marks a
+    send-on-change reading (see Deadband): its value holds until the next
+    reading, which comes within that many seconds. When temp_c is the mean
+    of a sampling period, min_c/max_c/count give that period's extremes and
+    number of samples, which the server keeps in its rollups.
+    """
+    when = when or datetime.now(timezone.utc)
+    reading = {
+        "temperature": temp_c,
+        "timestamp": when.isoformat()
+    }
+    if device_id is not None:
+        reading["device_id"] = device_id
+    if probe_id is not None:
+        reading["probe_id"] = probe_id
+    if heartbeat is not None:
+        reading["heartbeat"] = heartbeat
+    if count is not None:
+        reading.update({"min": min_c, "max": max_c, "count": count})
+    return reading
+
+
+class Deadband:
+    """Send-on-change filter: passes a reading only when it matters
+
+    A series' reading is passed when it lies more than `deadband` from the
+    last value passed, or once `heartbeat` seconds have gone by since then.
+    Everything in between repeats the last value to within the deadband, so
+    the server can hold that value instead of receiving it again. Series
+    are any hashable key.
+    """
+
+    def __init__(self, deadband, heartbeat):
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.last = {}  # series -> (ts, value) last passed
+        self.passed = 0
+        self.held = 0
+
+    def __call__(self, series, ts, value):
+        """True when the reading should be sent; ts in epoch seconds"""
+        last = self.last.get(series)
+        # Rounded so a heartbeat falling exactly on a report is not missed by float error
+        if last is not None and round(ts - last[0], 3) < self.heartbeat and abs(value - last[1]) <= self.deadband:
+            self.held += 1
+            return False
+        self.last[series] = (ts, value)
+        self.passed += 1
+        return True
+
+
+class ReadingBatcher:
+    """Collects readings until batch_size is reached or batch_interval seconds have passed"""
+
+    def __init__(self, batch_size=1, batch_interval=None):
+        self.batch_size = max(1, int(batch_size))
+        self.batch_interval = batch_interval
+        self.readings = []
+        self.first_added = None
+
+    def add(self, reading):
+        """Queue a reading; returns True when the batch should be flushed"""
+        if not self.readings:
+            self.first_added = time.monotonic()
+        self.readings.append(reading)
+        return self.due()
+
+    def due(self):
+        """True when the pending batch is full or has waited batch_interval seconds"""
+        if not self.readings:
+            return False
+        if len(self.readings) >= self.batch_size:
+            return True
+        if self.batch_interval is not None:
+            return time.monotonic() - self.first_added >= self.batch_interval
+        return False
+
+    def drain(self):
+        """Return the pending readings and start a new batch"""
+        readings, self.readings = self.readings, []
+        self.first_added = None
+        return readings
+
+    def requeue(self, readings):
+        """Put drained readings that were not delivered back in front of the batch"""
+        if readings:
+            self.first_added = time.monotonic() if self.first_added is None else self.first_added
+            self.readings[:0] = readings
+
+    def __len__(self):
+        return len(self.readings)
+
+
+def retry_after(response):
+    """Seconds the server asked us to wait (Retry-After as seconds or an HTTP date)"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def refused(readings, result, message):
+    """(reading, error) pairs for the readings a server response refused
+
+    Uses the response's per-reading "rejected" list when there is one,
+    otherwise every reading is refused with message.
+    """
+    listed = result.get("rejected") if isinstance(result, dict) else None
+    if not isinstance(listed, list):
+        return [(reading, message) for reading in readings]
+    return [(readings[item["index"]], str(item.get("error", message))) for item in listed
+            if isinstance(item, dict) and isinstance(item.get("index"), int) and 0 <= item["index"] < len(readings)]
+
+
+def deliver(endpoint, readings, timeout=5, session=None, encoding="json", rejected=None):
+    """POST one or more readings to the Flask web server
+
+    Returns (outcome, seconds to wait): the outcome is SENT, RETRY, REJECTED
+    or THROTTLED, and the wait is only set for THROTTLED. A batch is SENT
+    even if the server refused some of its readings; pass a list as
+    rejected to have (reading, error) pairs for those, and for every
+    reading of a REJECTED batch, added to it.
+    """
+    if not readings:
+        return SENT, None
+
+    poster = session or requests
+
+    def sent():
+        # The server's indexes into a binary upload follow its frames, not our list
+        return encoded_order(readings) if encoding == "binary" else readings
+
+    try:
+        if encoding == "binary":
+            response = poster.post(
+                endpoint,
+                data=encode_readings(readings),
+                headers={"Content-Type": BINARY_MEDIA_TYPE},
+                timeout=timeout
+            )
+        else:
+            # A single reading keeps the original payload shape
+            payload = readings[0] if len(readings) == 1 else {"readings": readings}
+            response = poster.post(
+                endpoint,
+                json=payload,
+                timeout=timeout
+            )
+
+        if response.status_code == 200:
+            result = response.json()
+            if result.get('status') == 'success':
+                if result.get('rejected'):
+                    print(f"Server refused {len(result['rejected'])} of {len(readings)} readings: "
+                          f"{result['rejected'][0].get('error')}")
+                    if rejected is not None:
+                        rejected += refused(sent(), result, "Refused by the server")
+                return SENT, None
+            else:
+                message = result.get('message', 'Unknown error')
+                print(f"Server error: {message}")
+                if rejected is not None:
+                    rejected += refused(sent(), result, message)
+                return REJECTED, None
+        elif response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers):
+            wait = retry_after(response)
+            print(f"Server busy (HTTP {response.status_code}), retrying in {wait:.0f}s")
+            return THROTTLED, wait
+        elif 400 <= response.status_code < 500:
+            try:
+                result = response.json()
+            except ValueError:
+                result = None
+            message = result.get('message') if isinstance(result, dict) else None
+            print(f"HTTP error: {response.status_code} (batch refused{': ' + message if message else ''})")
+            if rejected is not None:
+                rejected += refused(sent(), result, message or f"HTTP {response.status_code}")
+            return REJECTED, None
+        else:
+            print(f"HTTP error: {response.status_code}")
+            return RETRY, None
+
+    except requests.exceptions.ConnectionError:
+        print(f"Could not connect to web server at {endpoint}")
+        return RETRY, None
+    except requests.exceptions.Timeout:
+        print("Request timeout when sending to server")
+        return RETRY, None
+    except Exception as e:
+        print(f"Error sending data to server: {e}")
+        return RETRY, None
+
+
+def deliver_readings(endpoint, readings, timeout=5, session=None, encoding="json"):
+    """POST one or more readings to the Flask web server; returns SENT, RETRY, REJECTED or THROTTLED"""
+    return deliver(endpoint, readings, timeout, session, encoding)[0]
+
+
+def send_readings_to_server(endpoint, readings, timeout=5, encoding="json"):
+    """POST one or more readings to the Flask web server; returns True on success"""
+    return deliver_readings(endpoint, readings, timeout, encoding=encoding) == SENT
+
+
+class BackgroundSender:
+    """Delivers readings from a bounded queue on worker threads
+
+    submit() never blocks: when the queue is full the oldest reading is
+    dropped. Each worker keeps its own keep-alive requests.Session, takes up
+    to batch_size readings (waiting at most batch_interval seconds for a
+    batch to fill) and retries failed batches with exponential backoff.
+    With more than one worker, batches may reach the server out of order.
+
+    If a spool (see spool.py) is given, batches that still fail after the
+    retries, and readings pushed out of a full queue, are saved to it instead
+    of being dropped. Readings pushed out are written by a thread of their
+    own, so submit() never waits on the disk; only if that falls a whole
+    queue behind are the oldest of them dropped. Once the server is known to
+    be unreachable, failed batches are spooled after a single attempt.
+    Readings the server refuses are put in the spool's quarantine.
+
+    When the server throttles an upload, every worker holds off until its
+    Retry-After has passed; the batch is then resent topped up with what
+    queued meanwhile. Each throttle doubles the batch size, up to
+    max_batch_size, and each successful batch halves it back towards
+    batch_size, so fewer, larger uploads reach a busy server. Throttling
+    uses up no retries.
+
+    observe_send, if given, is called as observe_send(outcome, seconds)
+    after every delivery attempt, e.g. to feed a latency histogram.
+    """
+
+    def __init__(self, endpoint, max_queue=3600, workers=1, batch_size=1,
+                 batch_interval=None, max_retries=5, backoff=1.0,
+                 max_backoff=60.0, timeout=5, spool=None, encoding="json", observe_send=None,
+                 max_batch_size=MAX_BATCH_SIZE):
+        self.endpoint = endpoint
+        self.observe_send = observe_send
+        self.encoding = encoding
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.max_batch_size = max(self.batch_size, int(max_batch_size))
+        self.batch_interval = batch_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.spool = spool
+
+        self.queue = collections.deque(maxlen=max_queue)
+        # Readings pushed out of the full queue, waiting for the overflow thread to spool them
+        self.overflow = collections.deque(maxlen=max_queue)
+        self.overflowed = threading.Event()
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.stopped = threading.Event()
+        self.threads = []
+
+        # Counters, updated under self.cond
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spooled = 0
+        self.throttles = 0
+        self.consecutive_failures = 0
+        # Backpressure from the server, also under self.cond
+        self.current_batch_size = self.batch_size
+        self.throttled_until = 0.0  # time.monotonic() before which nothing is sent
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"sender-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        if self.spool is not None:
+            thread = threading.Thread(target=self._spool_overflow, name="sender-overflow", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, reading):
+        """Queue a reading for delivery; when the queue is full the oldest is spooled or dropped"""
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                oldest = self.queue.popleft()
+                if self.spool is None or len(self.overflow) == self.overflow.maxlen:
+                    self.dropped += 1
+                if self.spool is not None:
+                    self.overflow.append(oldest)
+                    self.overflowed.set()
+            self.queue.append(reading)
+            self.cond.notify()
+
+    def depth(self):
+        """Number of readings waiting to be sent"""
+        with self.cond:
+            return len(self.queue)
+
+    def throttled(self):
+        """True while waiting out a Retry-After from the server"""
+        return time.monotonic() < self.throttled_until
+
+    def stop(self, timeout=5):
+        """Flush what can be sent within timeout seconds and stop the workers"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.stopped.set()
+        self.overflowed.set()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        # Whatever could not be flushed in time survives in the spool
+        if self.spool is not None:
+            with self.cond:
+                leftover = list(self.overflow) + list(self.queue)
+                self.overflow.clear()
+                self.queue.clear()
+            if leftover:
+                self.spool.append(leftover)
+                self.spooled += len(leftover)
+
+    def _next_batch(self):
+        """Block until a batch is ready (or we are stopping) and take it off the queue"""
+        with self.cond:
+            while not self.queue and not self.stopping:
+                self.cond.wait()
+            if not self.queue:
+                return None
+
+            # Hold off while throttled; readings queued meanwhile go out together
+            while not self.stopping:
+                remaining = self.throttled_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+            # Give a partial batch up to batch_interval seconds to fill
+            if self.batch_interval is not None:
+                deadline = time.monotonic() + self.batch_interval
+                while len(self.queue) < self.current_batch_size and not self.stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+            count = min(self.current_batch_size, len(self.queue))
+            return [self.queue.popleft() for _ in range(count)]
+
+    def _throttle(self, batch, wait):
+        """Hold every worker off for `wait` seconds and grow the batch size"""
+        with self.cond:
+            self.throttles += 1
+            self.throttled_until = max(self.throttled_until, time.monotonic() + wait)
+            self.current_batch_size = min(max(self.current_batch_size, len(batch)) * 2, self.max_batch_size)
+
+    def _top_up(self, batch):
+        """Add queued readings to a throttled batch, up to the current batch size"""
+        with self.cond:
+            count = min(self.current_batch_size - len(batch), len(self.queue))
+            return batch + [self.queue.popleft() for _ in range(max(0, count))]
+
+    def _spool_overflow(self):
+        """Write readings pushed out of the full queue to the spool, a batch at a time"""
+        while True:
+            self.overflowed.wait()
+            self.overflowed.clear()
+            with self.cond:
+                readings = list(self.overflow)
+                self.overflow.clear()
+                stopping = self.stopping
+            if readings:
+                self.spool.append(readings)
+                with self.cond:
+                    self.spooled += len(readings)
+            if stopping:
+                return
+
+    def _run(self):
+        session = requests.Session()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._send_with_retry(session, batch)
+        finally:
+            session.close()
+
+    def _send_with_retry(self, session, batch):
+        retries = self.max_retries
+        if self.spool is not None and self.consecutive_failures > self.max_retries:
+            retries = 0
+
+        delay = self.backoff
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            rejected = []
+            outcome, wait = deliver(self.endpoint, batch, self.timeout, session, self.encoding, rejected)
+            if self.observe_send:
+                self.observe_send(outcome, time.monotonic() - started)
+            if rejected:
+                self._refused(rejected)
+            if outcome == SENT:
+                with self.cond:
+                    self.sent += len(batch) - len(rejected)
+                    self.consecutive_failures = 0
+                    self.current_batch_size = max(self.current_batch_size // 2, self.batch_size)
+                return True
+            if outcome == REJECTED:
+                return False
+
+            if outcome == THROTTLED:
+                # The server is up but busy: wait as asked, then send more at once
+                self._throttle(batch, wait)
+                if self.stopped.wait(max(0, self.throttled_until - time.monotonic())):
+                    break
+                batch = self._top_up(batch)
+                continue
+
+            with self.cond:
+                self.consecutive_failures += 1
+            if attempt == retries:
+                break
+            attempt += 1
+            # Back off with jitter; wake early only to shut down
+            if self.stopped.wait(delay * random.uniform(0.5, 1.5)):
+                break
+            delay = min(delay * 2, self.max_backoff)
+
+        if self.spool is not None:
+            self.spool.append(batch)
+            with self.cond:
+                self.spooled += len(batch)
+        else:
+            with self.cond:
+                self.failed += len(batch)
+        return False
+
+    def _refused(self, rejected):
+        """Count readings the server refused and quarantine them in the spool, if any"""
+        if self.spool is not None:
+            self.spool.quarantine(rejected)
+        with self.cond:
+            self.failed += len(rejected)
+
+
+class SpoolReplayer:
+    """Forwards spooled readings to the server, oldest first, in large rate-limited batches
+
+    Runs on its own thread with its own session so replaying a long backlog
+    never delays live readings. It stays idle while the live sender is
+    failing or throttled and backs off after a failed replay attempt. When
+    the server throttles a replay batch it waits the Retry-After and halves
+    its rate, then speeds back up by a tenth of max_readings_per_second per
+    accepted batch.
+    """
+
+    def __init__(self, endpoint, spool, sender=None, batch_size=500,
+                 max_readings_per_second=1000, idle_interval=5.0,
+                 backoff=5.0, max_backoff=300.0, timeout=30, encoding="json"):
+        self.endpoint = endpoint
+        self.encoding = encoding
+        self.spool = spool
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_readings_per_second = max_readings_per_second
+        self.idle_interval = idle_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.stopped = threading.Event()
+        self.thread = None
+        self.replayed = 0
+        self.rate = max_readings_per_second  # lowered while the server throttles us
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="spool-replay", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _link_down(self):
+        return self.sender is not None and (self.sender.consecutive_failures > 0 or self.sender.throttled())
+
+    def _run(self):
+        session = requests.Session()
+        delay = self.backoff
+        try:
+            while not self.stopped.is_set():
+                if self._link_down() or not len(self.spool):
+                    self.stopped.wait(self.idle_interval)
+                    continue
+
+                last_id, batch = self.spool.peek(self.batch_size)
+                if not batch:
+                    continue
+                started = time.monotonic()
+                rejected = []
+                outcome, wait = deliver(self.endpoint, batch, self.timeout, session, self.encoding, rejected)
+                if outcome == THROTTLED:
+                    self.rate = max(self.rate / 2, 1)
+                    self.stopped.wait(wait)
+                    continue
+                if outcome == RETRY:
+                    self.stopped.wait(delay)
+                    delay = min(delay * 2, self.max_backoff)
+                    continue
+
+                # Refused readings move to quarantine: resending them would loop forever
+                self.spool.ack(last_id, rejected)
+                delay = self.backoff
+                if rejected:
+                    print(f"⚠ Quarantined {len(rejected)} spooled readings the server refused")
+                if outcome == SENT:
+                    self.rate = min(self.rate + self.max_readings_per_second / 10, self.max_readings_per_second)
+                    self.replayed += len(batch) - len(rejected)
+                    print(f"↻ Replayed {len(batch) - len(rejected)} spooled readings ({len(self.spool)} left)")
+
+                # Rate limit: spread batches so the backlog drains at self.rate
+                budget = len(batch) / self.rate
+                self.stopped.wait(max(0, budget - (time.monotonic() - started)))
+        finally:
+            session.close()
@@ -2,16 +2,56 @@
 
 let temperatureChart;
 let currentUnit = 'C'; // 'C' for Celsius, 'F' for Fahrenheit
+let currentRange = 'live'; // 'live' or a window length in seconds
+let lastRangeFetch = 0;
+let liveCursor = null; // server cursor of the newest reading already plotted
+let liveEtag = null;
+let plottedTimestamps = []; // timestamps of the points on the chart, oldest first
+let streamOpen = false; // true while the server's live event stream is connected
+let heldUntil = null; // for a send-on-change series, when its current value stops holding
+
+// Longer windows are downsampled on the server, so refresh them less often
+const RANGE_REFRESH_MS = 30000;
+// Live mode keeps as many points as the server's default history
+const LIVE_HISTORY_LIMIT = 50;
 
 // Initialize the dashboard when page loads
 document.addEventListener('DOMContentLoaded', function() {
     initializeChart();
     fetchTemperatureData();
+    startLiveStream();
     
-    // Auto-refresh every second
-    setInterval(fetchTemperatureData, 1000);
+    // Auto-refresh every second; skipped in live mode while the stream is connected
+    setInterval(() => {
+        fetchTemperatureData();
+        checkStale();
+    }, 1000);
 });
 
+// Receive live readings as the server accepts them instead of polling for them
+function startLiveStream() {
+    if (!window.EventSource) return;
+
+    const source = new EventSource('/api/stream');
+    source.addEventListener('open', () => {
+        streamOpen = true;
+    });
+    source.addEventListener('reading', event => {
+        if (!applyLiveUpdate(JSON.parse(event.data))) {
+            liveCursor = null;
+            fetchTemperatureData(true);
+        }
+    });
+    source.addEventListener('error', () => {
+        // EventSource reconnects by itself (resuming from the last event id);
+        // polling covers the gap. CLOSED means the deployment has no stream.
+        streamOpen = false;
+        if (source.readyState === EventSource.CLOSED) {
+            console.info('Live stream unavailable, polling instead');
+        }
+    });
+}
+
 // Initialize the temperature chart
 function initializeChart() {
     const ctx = document.getElementById('temperatureChart').getContext('2d');
@@ -73,23 +113,61 @@ function initializeChart() {
     });
 }
 
+// Build the API URL for the selected range; windows ask for about one point per pixel
+function temperatureUrl(force) {
+    if (currentRange === 'live') {
+        // After the first load only ask for readings newer than what is plotted
+        return liveCursor === null || force ? '/api/temperature' : `/api/temperature?since=${liveCursor}`;
+    }
+    const now = Date.now() / 1000;
+    const from = now - Number(currentRange);
+    const maxPoints = Math.max(3, Math.round(document.getElementById('temperatureChart').clientWidth));
+    return `/api/temperature?from=${from}&max_points=${maxPoints}`;
+}
+
 // Fetch temperature data from the server
-async function fetchTemperatureData() {
+async function fetchTemperatureData(force = false) {
+    const live = currentRange === 'live';
+    if (live && streamOpen && !force) {
+        return;
+    }
+    if (!live && !force && Date.now() - lastRangeFetch < RANGE_REFRESH_MS) {
+        return;
+    }
+    lastRangeFetch = Date.now();
+
+    const headers = {};
+    if (live && liveEtag && !force) {
+        headers['If-None-Match'] = liveEtag;
+    }
+
     try {
-        const response = await fetch('/api/temperature');
-        const data = await response.json();
+        const response = await fetch(temperatureUrl(force), { headers, cache: 'no-store' });
         const timestamp = new Date().toLocaleTimeString();
         document.getElementById('current-time').textContent = timestamp;
-        
-        if (data.current) {
+
+        // 304: nothing new since the last poll, everything on screen is current
+        if (response.status === 304) {
+            return;
+        }
+        const data = await response.json();
+
+        if (live) {
+            liveEtag = response.headers.get('ETag');
+            if (!applyLiveUpdate(data)) {
+                // Missed or late readings: reload the whole live window
+                liveCursor = null;
+                liveEtag = null;
+                return fetchTemperatureData(true);
+            }
+        } else if (data.current) {
+            applyHeld(data.held);
+            updateChart(data.history);
             updateCurrentTemperature(data.current);
             updateStatistics(data.stats);
-            updateChart(data.history);
             updateStatus('connected', data.history.length);
         } else {
-            document.getElementById('current-temp').textContent = '--';
-            document.getElementById('current-temp-f').textContent = '--°F';
-            updateStatus('waiting', 0);
+            showWaiting();
         }
     } catch (error) {
         console.error('Error fetching temperature data:', error);
@@ -97,6 +175,67 @@ async function fetchTemperatureData() {
     }
 }
 
+// Apply a live poll response or stream event; returns false when a full reload is needed
+function applyLiveUpdate(data) {
+    document.getElementById('current-time').textContent = new Date().toLocaleTimeString();
+
+    // Already have everything up to this cursor (e.g. polled while the stream reconnected)
+    if (liveCursor !== null && data.cursor < liveCursor) {
+        return true;
+    }
+    if (!data.current) {
+        showWaiting();
+        liveCursor = data.cursor;
+        return true;
+    }
+
+    applyHeld(data.held);
+    if (currentRange === 'live') {
+        if (data.full) {
+            updateChart(data.history);
+        } else if (data.since !== liveCursor || !appendToChart(data.history)) {
+            return false;
+        }
+    }
+    liveCursor = data.cursor;
+    updateCurrentTemperature(data.current);
+    updateStatistics(data.stats);
+    updateStatus('connected', data.history.length);
+    return true;
+}
+
+// A send-on-change series holds each value until the next reading, so it is drawn as steps
+function applyHeld(held) {
+    const stepped = held ? 'after' : false;
+    if (temperatureChart.data.datasets[0].stepped !== stepped) {
+        temperatureChart.data.datasets[0].stepped = stepped;
+        temperatureChart.update('none');
+    }
+    heldUntil = held ? new Date(held.until) : null;
+}
+
+// A held value is current until its heartbeat runs out; after that the device is late
+function checkStale() {
+    if (heldUntil && new Date() > heldUntil) {
+        updateStatus('stale', 0);
+    }
+}
+
+// No readings on the server yet
+function showWaiting() {
+    document.getElementById('current-temp').textContent = '--';
+    document.getElementById('current-temp-f').textContent = '--°F';
+    updateStatus('waiting', 0);
+}
+
+// Switch the chart between live readings and a downsampled time window
+function changeRange(range) {
+    currentRange = range;
+    liveCursor = null;
+    liveEtag = null;
+    fetchTemperatureData(true);
+}
+
 // Update current temperature display
 function updateCurrentTemperature(current) {
     const tempC = current.temperature;
@@ -129,23 +268,57 @@ function updateStatistics(stats) {
 function updateChart(history) {
     if (!history || history.length === 0) return;
     
+    // Windows longer than a day need the date in the label too
+    const showDate = currentRange !== 'live' && Number(currentRange) > 86400;
     const labels = history.map(reading => {
         const date = new Date(reading.timestamp);
-        return date.toLocaleTimeString();
+        return showDate ? date.toLocaleString() : date.toLocaleTimeString();
     });
     
     const temperatures = history.map(reading => 
         currentUnit === 'C' ? reading.temperature : reading.temp_f
     );
     
+    plottedTimestamps = history.map(reading => reading.timestamp);
     temperatureChart.data.labels = labels;
     temperatureChart.data.datasets[0].data = temperatures;
     temperatureChart.data.datasets[0].label = `Temperature (°${currentUnit})`;
+    // Dense downsampled windows read better (and draw faster) without point markers
+    temperatureChart.data.datasets[0].pointRadius = currentRange === 'live' ? 4 : 0;
     temperatureChart.options.scales.y.title.text = `Temperature (°${currentUnit})`;
     
     temperatureChart.update('none'); // Update without animation for smoother real-time updates
 }
 
+// Append new live readings to the chart; returns false if they are older than the last point
+function appendToChart(readings) {
+    if (!readings || readings.length === 0) return true;
+
+    const lastTimestamp = plottedTimestamps[plottedTimestamps.length - 1];
+    if (lastTimestamp && new Date(readings[0].timestamp) < new Date(lastTimestamp)) {
+        return false;
+    }
+
+    const labels = temperatureChart.data.labels;
+    const temperatures = temperatureChart.data.datasets[0].data;
+    readings.forEach(reading => {
+        plottedTimestamps.push(reading.timestamp);
+        labels.push(new Date(reading.timestamp).toLocaleTimeString());
+        temperatures.push(currentUnit === 'C' ? reading.temperature : reading.temp_f);
+    });
+
+    // Drop the oldest points so the live window stays the same size
+    const excess = labels.length - LIVE_HISTORY_LIMIT;
+    if (excess > 0) {
+        plottedTimestamps.splice(0, excess);
+        labels.splice(0, excess);
+        temperatures.splice(0, excess);
+    }
+
+    temperatureChart.update('none');
+    return true;
+}
+
 // Toggle between Celsius and Fahrenheit
 function toggleUnit() {
     currentUnit = currentUnit === 'C' ? 'F' : 'C';
@@ -161,7 +334,7 @@ function toggleUnit() {
     }
     
     // Refresh the display with new units
-    fetchTemperatureData();
+    fetchTemperatureData(true);
 }
 
 // Update system status display
@@ -170,9 +343,16 @@ function updateStatus(status, dataCount) {
 
     switch (status) {
         case 'connected':
+            if (heldUntil && new Date() > heldUntil) {
+                return updateStatus('stale', dataCount);
+            }
             connectionStatus.textContent = 'Connected';
             connectionStatus.className = 'status-value connected';
             break;
+        case 'stale':
+            connectionStatus.textContent = 'No reading since the last heartbeat';
+            connectionStatus.className = 'status-value disconnected';
+            break;
         case 'waiting':
             connectionStatus.textContent = 'Waiting for data...';
             connectionStatus.className = 'status-value';
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The server helpers and the Pi modules are imported by file name, as api/index.py does
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.append(os.path.join(ROOT, "raspberry_pi"))
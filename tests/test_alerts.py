@@ -0,0 +1,136 @@
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from alerts import DIGEST_MAX_LINES, Alert, AlertDispatcher, format_digest
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server to accept mail: counts sessions and keeps each message"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.sessions = 0
+        self.messages = []
+        self.received = threading.Condition()
+        self.hang_up_after = None  # close each session after this many messages
+
+    def wait_for(self, count, timeout=5):
+        with self.received:
+            return self.received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        sink = self.server
+        sink.sessions += 1
+        sent = 0
+        self.reply("220 sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 sink")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                body = []
+                while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                    body.append(line.decode())
+                with sink.received:
+                    sink.messages.append("".join(body))
+                    sink.received.notify_all()
+                self.reply("250 queued")
+                sent += 1
+                if sink.hang_up_after == sent:
+                    return
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:  # MAIL, RCPT, NOOP, RSET
+                self.reply("250 ok")
+
+
+@pytest.fixture
+def sink():
+    server = SmtpSink()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def dispatcher(sink, cooldown_minutes=0.0):
+    return AlertDispatcher("127.0.0.1", sink.server_address[1], "pi@example.com", "",
+                           "a@example.com, b@example.com", cooldown_minutes=cooldown_minutes,
+                           starttls=False, timeout=5, backoff=0.05).start()
+
+
+def subject(message):
+    return next(line for line in message.splitlines() if line.startswith("Subject:"))
+
+
+def test_alerts_reuse_one_session(sink):
+    alerter = dispatcher(sink)
+    for i in range(3):
+        alerter.raise_alert(f"alert {i}", "too hot")
+        assert sink.wait_for(i + 1)
+    alerter.stop()
+    assert sink.sessions == 1
+    assert alerter.sent == 3 and alerter.failed_attempts == 0
+
+
+def test_alerts_within_cooldown_go_out_as_one_digest(sink):
+    alerter = dispatcher(sink, cooldown_minutes=0.5 / 60)
+    alerter.raise_alert("first", "first message")
+    assert sink.wait_for(1)
+    for i in range(3):
+        alerter.raise_alert(f"held {i}", f"held message {i}")
+    time.sleep(0.1)
+    assert len(sink.messages) == 1  # still cooling down
+    assert sink.wait_for(2)
+    alerter.stop()
+    assert len(sink.messages) == 2
+    assert subject(sink.messages[1]) == "Subject: held 2 (+2 more)"
+    assert "3 alerts between" in sink.messages[1]
+
+
+def test_dropped_session_is_rebuilt(sink):
+    sink.hang_up_after = 1
+    alerter = dispatcher(sink)
+    alerter.raise_alert("one", "first")
+    assert sink.wait_for(1)
+    alerter.raise_alert("two", "second")
+    assert sink.wait_for(2)
+    alerter.stop()
+    assert sink.sessions == 2
+    assert alerter.sent == 2
+
+
+def test_stop_flushes_pending_alerts_despite_cooldown(sink):
+    alerter = dispatcher(sink, cooldown_minutes=60)
+    alerter.raise_alert("first", "sent at once")
+    assert sink.wait_for(1)
+    alerter.raise_alert("second", "held for the cooldown")
+    alerter.stop()
+    assert len(sink.messages) == 2
+
+
+def test_digest_lists_at_most_max_lines():
+    when = datetime(2026, 1, 1, 12, 0, 0)
+    alerts = [Alert(when, f"alert {i}", f"message {i}") for i in range(DIGEST_MAX_LINES + 5)]
+    body = format_digest(alerts)
+    assert body.startswith(f"{len(alerts)} alerts between 2026-01-01 12:00:00")
+    assert "... and 5 more" in body
+    assert body.endswith(f"Latest alert:\nmessage {len(alerts) - 1}")
+    assert f"alert {DIGEST_MAX_LINES}\n" not in body
@@ -0,0 +1,265 @@
+import csv
+import io
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import _export
+import _wire
+import index
+import wire
+from _admission import Admission
+from uploader import make_reading
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+@pytest.fixture
+def device():
+    # Series live for the whole process, so every test writes to its own device
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+def post_readings(client, device, count, first=None, step=1.0):
+    first = time.time() - 3600 if first is None else first
+    readings = [{"timestamp": first + i * step, "temperature": 20 + (i * 7 % 41) / 4} for i in range(count)]
+    response = client.post("/api/receive_temperature", json={"device_id": device, "readings": readings})
+    assert response.status_code == 200, response.get_json()
+    return readings
+
+
+def test_batch_stores_valid_readings_and_reports_the_rest(client, device):
+    now = time.time()
+    response = client.post("/api/receive_temperature", json={"device_id": device, "readings": [
+        {"timestamp": now - 10, "temperature": 20.5},
+        {"timestamp": now + 3600, "temperature": 21.0},
+        {"timestamp": now - 5, "temperature": "warm"},
+        {"timestamp": now - 1, "temperature": 22.0},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["accepted"] == body["count"] == 2
+    assert [item["index"] for item in body["rejected"]] == [1, 2]
+    assert "future" in body["rejected"][0]["error"]
+    history = client.get(f"/api/temperature?device={device}").get_json()["history"]
+    assert [reading["temperature"] for reading in history] == [20.5, 22.0]
+
+
+def test_batch_with_nothing_valid_is_refused(client, device):
+    response = client.post("/api/receive_temperature", json={"device_id": device, "readings": [
+        {"timestamp": 1, "temperature": 20.0}, {"temperature": None}]})
+    assert response.status_code == 400
+    assert response.get_json()["accepted"] == 0
+    assert len(response.get_json()["rejected"]) == 2
+    # A single reading, and a bad batch-level field, are refused outright
+    assert client.post("/api/receive_temperature", json={"device_id": device, "temperature": "x"}).status_code == 400
+    response = client.post("/api/receive_temperature", json={"device_id": "bad id!", "readings": [{"temperature": 20}]})
+    assert response.status_code == 400 and "rejected" not in response.get_json()
+    assert client.get(f"/api/temperature?device={device}").get_json()["history"] == []
+
+
+def test_period_extremes_reach_the_rollups(client, device):
+    now = time.time() - 120
+    start = now - now % 60
+    response = client.post("/api/receive_temperature", json={"device_id": device, "readings": [
+        {"timestamp": start + 5, "temperature": 20.5, "min": 20.0, "max": 31.0, "count": 20},
+        {"timestamp": start + 10, "temperature": 20.0, "min": 20.5, "max": 21.0, "count": 20},
+    ]})
+    assert response.get_json()["rejected"][0]["index"] == 1
+    body = client.get(f"/api/temperature?device={device}&source=rollup&tier=1m").get_json()
+    assert [(point["min"], point["max"], point["count"]) for point in body["history"]] == [(20.0, 31.0, 20)]
+
+
+def test_batch_over_the_limit_is_refused(client, device):
+    readings = [{"temperature": 20.0}] * (index.MAX_BATCH_SIZE + 1)
+    response = client.post("/api/receive_temperature", json={"device_id": device, "readings": readings})
+    assert response.status_code == 413
+
+
+def test_since_cursor_and_etag(client, device):
+    post_readings(client, device, 3)
+    response = client.get(f"/api/temperature?device={device}")
+    body = response.get_json()
+    cursor = body["cursor"]
+    assert len(body["history"]) == 3 and body["full"]
+    assert response.headers["ETag"] == f'"{cursor}"'
+
+    response = client.get(f"/api/temperature?device={device}", headers={"If-None-Match": f'"{cursor}"'})
+    assert response.status_code == 304
+
+    post_readings(client, device, 2, first=time.time() - 60)
+    response = client.get(f"/api/temperature?device={device}&since={cursor}",
+                          headers={"If-None-Match": f'"{cursor}"'})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert len(body["history"]) == 2 and not body["full"] and body["since"] == cursor
+    assert body["cursor"] != cursor
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_range_is_downsampled_to_max_points(client, device, method):
+    readings = post_readings(client, device, 1000)
+    first = readings[0]["timestamp"]
+    response = client.get(f"/api/temperature?device={device}&from={first}&to={first + 999}"
+                          f"&max_points=100&downsample={method}")
+    body = response.get_json()
+    assert body["range"]["scanned"] == 1000
+    assert body["range"]["downsample"] == method and body["range"]["tier"] is None
+    assert body["range"]["returned"] == len(body["history"]) <= 100
+    if method == "minmax":
+        # Every extreme of the window survives the reduction
+        temperatures = [point["temperature"] for point in body["history"]]
+        assert max(temperatures) == max(r["temperature"] for r in readings)
+        assert min(temperatures) == min(r["temperature"] for r in readings)
+
+
+def test_max_points_is_bounded(client, device):
+    post_readings(client, device, 10)
+    assert client.get(f"/api/temperature?device={device}&max_points=2").status_code == 400
+    assert client.get(f"/api/temperature?device={device}&max_points=many").status_code == 400
+
+
+def test_wide_windows_are_served_from_rollups(client, device):
+    readings = post_readings(client, device, 1200)
+    first = readings[0]["timestamp"]
+    # 1200 s over 10 points is two minutes a point: the 1m tier is fine enough
+    body = client.get(f"/api/temperature?device={device}&from={first}&to={first + 1200}&max_points=10").get_json()
+    assert body["range"]["tier"] == "1m"
+    assert sum(point["count"] for point in body["history"]) == 1200
+    assert all(point["min"] <= point["mean"] <= point["max"] for point in body["history"])
+    # Unless raw readings are asked for
+    body = client.get(f"/api/temperature?device={device}&from={first}&to={first + 1200}&max_points=10"
+                      f"&source=raw").get_json()
+    assert body["range"]["tier"] is None and body["range"]["downsample"] == "lttb"
+    assert client.get(f"/api/temperature?device={device}&tier=1w").status_code == 400
+
+
+def test_binary_wire_format_both_ways(client, device):
+    now = time.time()
+    body = _wire.encode({"device_id": device}, [(None, "1", [(now - 2, 20.25), (now - 1, 20.5)])])
+    response = client.post("/api/receive_temperature", data=body, content_type=_wire.MEDIA_TYPE)
+    assert response.status_code == 200 and response.get_json()["count"] == 2
+
+    response = client.get(f"/api/temperature?device={device}&probe=1", headers={"Accept": _wire.MEDIA_TYPE})
+    assert response.mimetype == _wire.MEDIA_TYPE
+    assert "Accept" in response.headers["Vary"]
+    meta, frames = _wire.decode(response.data)
+    assert meta["device"] == device and meta["stats"]["count"] == 2
+    assert [temp_c for _, temp_c in frames[0][2]] == [20.25, 20.5]
+
+    # JSON is still the default, and preferred when both are acceptable
+    response = client.get(f"/api/temperature?device={device}&probe=1",
+                          headers={"Accept": f"application/json, {_wire.MEDIA_TYPE};q=0.5"})
+    assert response.mimetype == "application/json"
+
+
+def test_binary_upload_keeps_each_series_heartbeat(client, device):
+    now = datetime.now(timezone.utc)
+    readings = [make_reading(20.0, now - timedelta(seconds=5), device, "held", heartbeat=60),
+                make_reading(21.0, now - timedelta(seconds=4), device, "every"),
+                make_reading(22.0, now - timedelta(seconds=3), device, "held", heartbeat=60)]
+    response = client.post("/api/receive_temperature", data=wire.encode_readings(readings),
+                           content_type=wire.MEDIA_TYPE)
+    assert response.status_code == 200 and response.get_json()["count"] == 3
+    assert index.held.heartbeat((device, "held")) == 60
+    assert index.held.heartbeat((device, "every")) is None
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_export_and_import_round_trip(client, device, fmt):
+    readings = post_readings(client, device, 20)
+    response = client.get(f"/api/export?device={device}&format={fmt}")
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        rows = [json.loads(line) for line in text.splitlines()]
+    assert [float(row["temperature"]) for row in rows] == [r["temperature"] for r in readings]
+
+    # Into another device: the rows name theirs, so point them at the copy
+    copy = device + "-copy"
+    if fmt == "csv":
+        body = text.replace(f",{device},", f",{copy},")
+    else:
+        body = "".join(json.dumps({**row, "device_id": copy}) + "\n" for row in rows)
+    response = client.post("/api/import", data=body, content_type=_export.FORMATS[fmt])
+    assert response.status_code == 200 and response.get_json()["count"] == 20
+    history = client.get(f"/api/temperature?device={copy}").get_json()["history"]
+    assert [reading["temperature"] for reading in history] == [r["temperature"] for r in readings]
+
+
+def test_import_stops_at_a_bad_row(client, device, monkeypatch):
+    monkeypatch.setattr(index, "IMPORT_BATCH_SIZE", 2)
+    now = time.time()
+    body = "timestamp,temperature\n" + "".join(f"{now - 10 + i},20.{i}\n" for i in range(3)) + f"{now},hot\n"
+    response = client.post(f"/api/import?device={device}", data=body, content_type="text/csv")
+    assert response.status_code == 400
+    assert response.get_json()["message"].startswith("line 5:")
+    # The full batch before the bad row stays stored
+    assert response.get_json()["count"] == 2
+    assert len(client.get(f"/api/temperature?device={device}").get_json()["history"]) == 2
+
+
+def test_import_needs_timestamp_and_temperature_columns(client, device):
+    for header, missing in (("temperature", "timestamp"), ("timestamp", "temperature")):
+        response = client.post(f"/api/import?device={device}", data=f"{header}\n20.0\n", content_type="text/csv")
+        assert response.status_code == 400
+        assert response.get_json()["message"] == f"line 1: CSV header must name a {missing} column"
+    assert client.get(f"/api/temperature?device={device}").get_json()["history"] == []
+
+
+def test_rate_limited_upload_gets_429_with_retry_after(client, device, monkeypatch):
+    monkeypatch.setattr(index, "admission", Admission(rate=1, burst=3, max_in_flight=0))
+    post_readings(client, device, 3)
+    response = client.post("/api/receive_temperature", json={"device_id": device, "temperature": 20.0})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert 0 < response.get_json()["retry_after"] <= 1
+    # Imports are charged too, and say how far they got
+    response = client.post(f"/api/import?device={device}", data=f"timestamp,temperature\n{time.time()},20.0\n",
+                           content_type="text/csv")
+    assert response.status_code == 429 and response.get_json()["count"] == 0
+
+
+def test_response_cache_is_invalidated_by_writes(client, device):
+    readings = post_readings(client, device, 10)
+    url = f"/api/temperature?device={device}&from={readings[0]['timestamp']}"
+    first = client.get(url).get_json()
+    hits = index.response_cache.hits
+    assert client.get(url).get_json() == first
+    assert index.response_cache.hits == hits + 1
+
+    post_readings(client, device, 1, first=time.time() - 1)
+    after = client.get(url).get_json()
+    assert after["range"]["returned"] == 11 and after["stats"]["count"] == 11
+    assert index.response_cache.hits == hits + 1
+
+
+def test_stream_sends_a_snapshot_then_new_readings(client, device):
+    post_readings(client, device, 2)
+    response = client.get(f"/api/stream?device={device}", buffered=False)
+    assert response.mimetype == "text/event-stream"
+    chunks = iter(response.response)
+    try:
+        assert next(chunks).startswith(b"retry:")
+        snapshot = next(chunks).decode()
+        assert snapshot.startswith("id: ") and "event: reading" in snapshot
+        data = json.loads(snapshot.split("data: ", 1)[1])
+        assert len(data["history"]) == 2 and data["full"]
+
+        # The first publish to a new subscriber is whole; the ones after it only carry what is new
+        post_readings(client, device, 1, first=time.time() - 2)
+        event = json.loads(next(chunks).decode().split("data: ", 1)[1])
+        assert len(event["history"]) == 3 and event["full"]
+        post_readings(client, device, 1, first=time.time() - 1)
+        latest = json.loads(next(chunks).decode().split("data: ", 1)[1])
+        assert len(latest["history"]) == 1 and latest["since"] == event["cursor"] and not latest["full"]
+    finally:
+        response.close()
@@ -0,0 +1,46 @@
+import pytest
+
+from _held import HeldSeries, TimeWeighted
+from test_stores import BASE, open_store
+
+HEARTBEAT = 5.0
+
+
+def readings(first, count):
+    # Gaps alternate between 6 s (held for the 5 s heartbeat) and 1 s
+    return [(BASE + 7 * (n // 2) + 6 * (n % 2), 20 + (n * 7 % 41) / 4) for n in range(first, first + count)]
+
+
+@pytest.mark.parametrize("backend", ["memory", "compressed", "shared"])
+def test_incremental_mean_survives_eviction(backend, tmp_path):
+    store, dispose = open_store(backend, str(tmp_path), capacity=300)
+    held = HeldSeries()
+    held.update({"key": HEARTBEAT})
+    scans = []
+    iter_range = store.iter_range
+    store.iter_range = lambda *args: scans.append(args) or iter_range(*args)
+    try:
+        first = 0
+        for size in [100, 150, 90, 1, 1, 40, 299, 7, 3, 250] * 3:
+            store.extend(readings(first, size))
+            first += size
+            avg = held.stats("key", store)["avg"]
+            scans_before = len(scans)
+            expected = TimeWeighted(HEARTBEAT).extend(store.iter_range()).mean()
+            del scans[scans_before:]
+            assert avg == pytest.approx(expected, rel=1e-12)
+        # Only the first call reads the whole store
+        assert len(scans) == 1
+    finally:
+        dispose()
+
+
+def test_drop_matches_folding_the_rest():
+    stored = readings(0, 50)
+    weighted = TimeWeighted(HEARTBEAT).extend(stored)
+    for dropped in (1, 5, 30, 49):
+        weighted.drop(dropped - (50 - weighted.count))
+        expected = TimeWeighted(HEARTBEAT).extend(stored[dropped:])
+        assert weighted.count == expected.count
+        assert weighted.mean() == pytest.approx(expected.mean(), rel=1e-12)
+    assert weighted.drop(1).mean() is None
@@ -0,0 +1,47 @@
+import pytest
+
+from rules import RulesEngine
+
+
+def transitions(engine, values, series="0"):
+    events = []
+    for ts, value in enumerate(values):
+        events += engine.observe(series, ts, value)
+    return [(event.rule, event.firing) for event in events]
+
+
+def test_unnamed_rules_of_one_type_keep_separate_state():
+    engine = RulesEngine([{"type": "threshold", "above": 30}, {"type": "threshold", "below": 2}])
+    assert [rule.name for rule in engine.rules] == ["threshold-1", "threshold-2"]
+    assert transitions(engine, [31, 1, 20]) == [
+        ("threshold-1", True), ("threshold-1", False), ("threshold-2", True), ("threshold-2", False)]
+
+
+def test_duplicate_rule_names_are_rejected():
+    with pytest.raises(ValueError, match="unique: no-data"):
+        RulesEngine([{"name": "no-data", "type": "stale", "after": 60},
+                     {"name": "no-data", "type": "stale", "after": 600}])
+
+
+def test_threshold_clears_only_past_hysteresis():
+    engine = RulesEngine([{"name": "hot", "type": "threshold", "above": 30, "clear_below": 29}])
+    assert transitions(engine, [30, 29.5, 30.5, 28.9]) == [("hot", True), ("hot", False)]
+
+
+def test_stale_rule_waits_out_the_heartbeat():
+    engine = RulesEngine([{"name": "quiet", "type": "stale", "after": 10}])
+    engine.observe("0", 0, 20.0)
+    engine.observe("1", 0, 20.0, hold=60)
+    assert [(e.series, e.firing) for e in engine.tick(30)] == [("0", True)]
+    assert [(e.series, e.firing) for e in engine.tick(71)] == [("1", True)]
+    assert [(e.series, e.firing) for e in engine.observe("0", 72, 20.0)] == [("0", False)]
+
+
+def test_stale_rule_orders_series_by_timestamp_not_arrival():
+    engine = RulesEngine([{"name": "quiet", "type": "stale", "after": 10}])
+    engine.observe("fresh", 100, 20.0)
+    # Replayed from a spool after "fresh": touched later, but with an older timestamp
+    engine.observe("replayed", 50, 20.0)
+    engine.observe("replayed", 40, 20.0)
+    assert [(e.series, e.firing) for e in engine.tick(65)] == [("replayed", True)]
+    assert [(e.series, e.firing) for e in engine.tick(111)] == [("fresh", True)]
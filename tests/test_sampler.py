@@ -0,0 +1,54 @@
+import pytest
+
+from sampler import FakeSpiDev, MedianFilter, Sampler, decode_max6675
+
+
+def max6675_bytes(temp_c):
+    word = round(temp_c * 4) << 3
+    return [word >> 8, word & 0xFF]
+
+
+@pytest.mark.parametrize("temp_c", [0.0, 0.25, 21.5, 100.75, 1023.75])
+def test_decode_max6675(temp_c):
+    assert decode_max6675(max6675_bytes(temp_c)) == temp_c
+
+
+def test_decode_max6675_open_thermocouple():
+    assert decode_max6675([0x01, 0x44]) is None  # D2 set, whatever the reading bits say
+
+
+def test_median_filter_drops_a_lone_spike():
+    median = MedianFilter(5)
+    out = [median(v) for v in [20.0, 20.25, 500.0, 20.0, 20.25, 20.5]]
+    assert max(out) < 21
+    assert out[:2] == [20.0, 20.125]  # even counts average the middle pair
+
+
+def sampler_over(device, reads, median_window=5):
+    records = []
+    sampler = Sampler(["0"], lambda probe: decode_max6675(device.readbytes(2)), records.append,
+                      median_window=median_window)
+    for _ in range(reads):
+        sampler.sample()
+    sampler.report()
+    return records
+
+
+def test_fake_device_glitches_are_filtered_out():
+    device = FakeSpiDev(base=22.0, swing=0.0, noise=0.1, glitch_rate=0.05, seed=1)
+    [record] = sampler_over(device, 400)
+    assert record.count == 400 and record.errors == 0
+    assert 21 < record.min <= record.mean <= record.max < 23
+
+    device = FakeSpiDev(base=22.0, swing=0.0, noise=0.1, glitch_rate=0.05, seed=1)
+    [unfiltered] = sampler_over(device, 400, median_window=1)
+    assert unfiltered.max - unfiltered.min > 10
+
+
+def test_fake_device_faults_count_as_errors():
+    device = FakeSpiDev(fault_rate=0.25, glitch_rate=0.0, seed=2)
+    [record] = sampler_over(device, 200)
+    assert record.errors > 0 and record.count + record.errors == 200
+
+    [record] = sampler_over(FakeSpiDev(fault_rate=1.0, seed=2), 10)
+    assert (record.mean, record.min, record.max, record.count, record.errors) == (None, None, None, 0, 10)
@@ -0,0 +1,224 @@
+import math
+import os
+import sqlite3
+import tempfile
+import uuid
+
+import pytest
+
+from _compressed_store import CompressedStore
+from _sqlite_store import SQLiteDatabase, SQLiteStore
+from _store import RingBufferStore
+
+CAPACITY = 1024
+BASE = 1_700_000_000
+
+
+def open_store(backend, tmpdir, capacity=CAPACITY):
+    """A fresh store of one backend and a function that disposes of it"""
+    if backend == "memory":
+        return RingBufferStore(capacity), lambda: None
+    if backend == "compressed":
+        return CompressedStore(capacity, block_size=256), lambda: None
+    if backend == "sqlite":
+        database = SQLiteDatabase(os.path.join(tmpdir, "test.db"))
+        return SQLiteStore(database, database.series_id("d", "0")), database.close
+    if backend == "shared":
+        pytest.importorskip("fcntl")
+        from _shared_store import SharedDirectory, SharedRingStore
+        directory = SharedDirectory(f"test-{uuid.uuid4().hex[:12]}")
+        store = SharedRingStore(directory, "d", "0", capacity)
+
+        def dispose():
+            store.close()
+            directory.unlink()
+            directory.close()
+            os.remove(os.path.join(tempfile.gettempdir(), f"{directory.name}.shm.lock"))
+        return store, dispose
+    raise ValueError(backend)
+
+
+BACKENDS = ["memory", "compressed", "sqlite", "shared"]
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, tmp_path):
+    store, dispose = open_store(request.param, str(tmp_path))
+    yield store
+    dispose()
+
+
+def readings(first, count, step=1.0):
+    # Whole-millisecond timestamps and quarter degrees, which every backend stores exactly
+    return [(BASE + (first + i) * step, 20 + ((first + i) * 7 % 41) / 4) for i in range(count)]
+
+
+def assert_stats_match_contents(store):
+    stored = list(store.iter_range())
+    assert len(store) == len(stored)
+    temps = [temp_c for _, temp_c, _ in stored]
+    stats = store.stats()
+    assert stats["count"] == len(temps)
+    assert stats["min"] == min(temps) and stats["max"] == max(temps)
+    assert stats["avg"] == pytest.approx(math.fsum(temps) / len(temps), rel=1e-12)
+    assert [ts for ts, _, _ in stored] == sorted(ts for ts, _, _ in stored)
+    return stored
+
+
+def test_in_order_and_late_batches(store):
+    store.extend(readings(0, 300))
+    store.extend(readings(400, 300))
+    cursor = store.seq
+    late = readings(300, 100)
+    store.extend(late)
+    stored = assert_stats_match_contents(store)
+    assert [(ts, temp_c) for ts, temp_c, _ in stored] == readings(0, 700)
+    assert store.latest()[:2] == readings(699, 1)[0]
+
+    # A late batch rewrites history: changes() since before it is not incremental...
+    new_cursor, changed, full = store.changes(cursor, 50)
+    assert new_cursor == store.seq and full
+    assert [r[:2] for r in changed] == readings(650, 50)
+    # ...but the next in-order batch is
+    store.extend(readings(700, 10))
+    assert store.changes(new_cursor, 50)[1:] == ([r + (r[1] * 9/5 + 32,) for r in readings(700, 10)], False)
+
+
+def test_range_reads(store):
+    store.extend(readings(0, 500))
+    window = list(store.iter_range(BASE + 100, BASE + 199))
+    assert [(ts, temp_c) for ts, temp_c, _ in window] == readings(100, 100)
+    assert [r[:2] for r in store.recent(5)] == readings(495, 5)
+
+
+@pytest.mark.parametrize("backend", ["compressed", "shared"])
+def test_wrapping_ring_matches_memory(backend, tmp_path):
+    other, dispose = open_store(backend, str(tmp_path))
+    memory = RingBufferStore(CAPACITY)
+    try:
+        # In order past several turns of the ring, then a late batch and more in order
+        for first in range(0, 3 * CAPACITY + 10, 250):
+            batch = readings(first, min(250, 3 * CAPACITY + 10 - first))
+            memory.extend(batch)
+            other.extend(batch)
+            assert_stats_match_contents(other)
+        for batch in (readings(2 * CAPACITY + 5, 3, step=1.0001), readings(4 * CAPACITY, 2 * CAPACITY)):
+            memory.extend(batch)
+            other.extend(batch)
+            assert_stats_match_contents(other)
+
+        expected = list(memory.iter_range())
+        stored = list(other.iter_range())
+        # The compressed store may keep up to one block more than capacity
+        assert stored[len(stored) - len(expected):] == expected
+        if backend == "shared":
+            assert other.stats() == pytest.approx(memory.stats(), rel=1e-12)
+    finally:
+        dispose()
+
+
+def test_shared_store_recovers_from_a_writer_killed_mid_write(tmp_path, monkeypatch):
+    import multiprocessing
+    import signal
+    import _shared_store
+    monkeypatch.setattr(_shared_store, "STALLED_WRITE_SECONDS", 0.05)
+    store, dispose = open_store("shared", str(tmp_path))
+    try:
+        store.extend(readings(0, CAPACITY))
+
+        def die_mid_write():
+            other = _shared_store.SharedRingStore(store.directory, "d", "0", CAPACITY)
+            with other.directory.locked():
+                version = _shared_store._VERSION.unpack_from(other.segment.buf, 0)[0]
+                _shared_store._VERSION.pack_into(other.segment.buf, 0, version + 1)
+                # Half of an in-order batch written over the oldest readings
+                for i in range(10):
+                    other.ts[i], other.temp_c[i] = BASE + CAPACITY + i, 99.0
+                os.kill(os.getpid(), signal.SIGKILL)
+
+        child = multiprocessing.get_context("fork").Process(target=die_mid_write)
+        child.start()
+        child.join()
+        assert child.exitcode == -signal.SIGKILL
+        seq = store.seq
+
+        stored = assert_stats_match_contents(store)  # would spin forever on the odd version
+        assert len(stored) == CAPACITY and stored[-1][:2] == (BASE + CAPACITY + 9, 99.0)
+        assert store.seq == seq + 1 and store.changes(seq, 10)[2]
+        store.extend(readings(CAPACITY + 10, 5))
+        assert_stats_match_contents(store)
+    finally:
+        dispose()
+
+
+@pytest.mark.parametrize("backend", ["compressed", "sqlite", "shared"])
+def test_rollups_outlive_the_ring(backend, tmp_path):
+    other, dispose = open_store(backend, str(tmp_path))
+    memory = RingBufferStore(CAPACITY)
+    try:
+        # 20 turns of the ring a reading every 37 s, then two late readings
+        history = readings(0, 20 * CAPACITY, step=37.0)
+        for first in range(0, len(history), 500):
+            memory.extend(history[first:first + 500])
+            other.extend(history[first:first + 500])
+        late = [(BASE + 1000.5, 5.0), (BASE + 5000.25, 40.0)]
+        memory.extend(late)
+        other.extend(late)
+
+        end = history[-1][0]
+        for start, max_points, tier in [(None, 1000, None), (BASE, 100, "1m"), (BASE, 50, "1h"),
+                                        (None, 20, "1d"), (BASE + 100_000, 30, None)]:
+            expected = memory.rollup(start, end, max_points, tier)
+            assert other.rollup(start, end, max_points, tier) == expected
+        assert sum(bucket[3] for _, bucket in memory.rollup(None, end, 10_000, "1h")[2]) == len(history) + 2
+    finally:
+        dispose()
+
+
+def test_rollups_keep_the_extremes_of_summarized_readings(store):
+    # Two 5 s means in one minute, the second hiding a spike to 35 °C among its 20 samples
+    means = [(BASE, 20.0), (BASE + 5, 21.0)]
+    store.extend(means, [(BASE + 5, 21.0, 19.5, 35.0, 20)])
+    tier, _, buckets = store.rollup(BASE, BASE + 60, 10, "1m")
+    (start, bucket), = buckets
+    assert bucket[:4] == [19.5, 35.0, 20.0 + 21.0 * 20, 21]
+    assert store.stats()["max"] == 21.0  # the raw readings are the means
+
+
+def test_shared_rollups_are_seen_by_every_worker(tmp_path):
+    import multiprocessing
+    store, dispose = open_store("shared", str(tmp_path))
+    try:
+        def write():
+            from _shared_store import SharedRingStore
+            SharedRingStore(store.directory, "d", "0", CAPACITY).extend(readings(0, 3 * CAPACITY, step=60.0))
+
+        child = multiprocessing.get_context("fork").Process(target=write)
+        child.start()
+        child.join()
+        tier, scanned, buckets = store.rollup(None, BASE + 3 * CAPACITY * 60, 10_000, "1m")
+        assert (tier, scanned) == ("1m", 3 * CAPACITY)
+        assert len(store) == CAPACITY
+    finally:
+        dispose()
+
+
+def test_sqlite_write_that_fails_leaves_the_store_as_it_was(tmp_path, monkeypatch):
+    store, dispose = open_store("sqlite", str(tmp_path))
+    store.extend(readings(0, 10))
+    before = (store.seq, store.newest, {day: list(agg) for day, agg in store.partitions.items()},
+              store.rollup(None, None, 100, "1m"))
+
+    def fail(newest, days):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(store, "_drop_expired", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        store.extend(readings(10, 5) + readings(100_000, 5))
+    assert (store.seq, store.newest, store.partitions, store.rollup(None, None, 100, "1m")) == before
+    assert store.changes(store.seq, 50) == (10, [], False)
+    monkeypatch.undo()
+    # The next write carries on from where the failed one started
+    store.extend(readings(10, 5))
+    assert [r[:2] for r in store.iter_range()] == readings(0, 15)
+    assert_stats_match_contents(store)
+    dispose()
@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from spool import ReadingSpool
+from uploader import BackgroundSender, SpoolReplayer, make_reading
+
+
+class SlowSpool:
+    """Spool that takes a while to write, like a busy SD card"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.readings = []
+        self.callers = set()
+
+    def append(self, readings):
+        self.callers.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        self.readings.extend(readings)
+
+
+def test_full_queue_is_spooled_off_the_submitting_thread():
+    spool = SlowSpool(0.05)
+    # Nothing listens on port 9, so the worker is backing off and the queue fills up
+    sender = BackgroundSender("http://127.0.0.1:9/api/receive_temperature", max_queue=10,
+                              spool=spool, backoff=30).start()
+    started = time.monotonic()
+    for i in range(18):
+        sender.submit({"temperature": i})
+    assert time.monotonic() - started < 0.1
+    sender.stop(timeout=5)
+    assert sorted(r["temperature"] for r in spool.readings) == list(range(18))
+    assert "sender-overflow" in spool.callers
+    assert sender.dropped == 0 and sender.spooled == 18
+
+
+class RefusingHandler(BaseHTTPRequestHandler):
+    """Accepts a batch but refuses its readings hotter than 100 °C, by index"""
+
+    def do_POST(self):
+        readings = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["readings"]
+        rejected = [{"index": i, "error": "Too hot"} for i, r in enumerate(readings) if r["temperature"] > 100]
+        status = 200 if len(rejected) < len(readings) else 400
+        body = json.dumps({"status": "success" if status == 200 else "error", "rejected": rejected}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_replayed_readings_the_server_refuses_are_quarantined(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RefusingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    spool = ReadingSpool(str(tmp_path / "spool.db"))
+    try:
+        # One batch partly refused, then one refused outright
+        spool.append([make_reading(t) for t in (20, 500, 21, 22)])
+        spool.append([make_reading(t) for t in (600, 700)])
+        replayer = SpoolReplayer(f"http://127.0.0.1:{server.server_port}/", spool, batch_size=4,
+                                 max_readings_per_second=1e6, idle_interval=0.01).start()
+        deadline = time.monotonic() + 5
+        while len(spool) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        replayer.stop()
+        assert len(spool) == 0 and replayer.replayed == 3
+        assert spool.quarantined == 3
+        errors = spool.db.execute("SELECT reading, error FROM quarantine ORDER BY id").fetchall()
+        assert [(json.loads(reading)["temperature"], error) for reading, error in errors] == [
+            (500, "Too hot"), (600, "Too hot"), (700, "Too hot")]
+        assert spool.release_quarantine() == 3
+        assert len(spool) == 3 and spool.quarantined == 0
+    finally:
+        spool.close()
+        server.shutdown()
+        server.server_close()